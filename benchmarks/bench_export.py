@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+#
+# End-to-end benchmark of the export scripts. It runs the
+#  full `go` pipeline of export_data.py or export_data_groups.py
+#  against the local mock server, for every combination of
+#  page size and shard count, and writes the results as json
+#  so runs on different branches can be compared.
+#
+# Every run happens in its own process, so peak RSS is
+#  measured per run.
+
+import argparse
+import datetime
+import importlib.util
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import types
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, 'mock-server'))
+import mock_server
+
+SCRIPTS = {
+    'export_data': os.path.join(ROOT, 'export-data', 'export_data.py'),
+    'export_data_groups': os.path.join(ROOT, 'export-data-groups', 'export_data_groups.py')
+}
+
+STAGES = ['write_users', 'write_pods', 'write_calls']
+
+
+def load_script(name, api_url):
+    """
+    Imports an export script with a siteconfig pointing
+    at the mock server.
+    """
+    siteconfig = types.ModuleType('siteconfig')
+    siteconfig.API_KEY = 'bench'
+    siteconfig.PARTNER_KEY = None
+    siteconfig.SITE_ID = 8888
+    siteconfig.HELPLIGHTNING_ENDPOINT = api_url
+    siteconfig.HELPLIGHTNING_URL = api_url
+    siteconfig.DEFAULT_TTL = 60 * 5
+    sys.modules['siteconfig'] = siteconfig
+
+    spec = importlib.util.spec_from_file_location(name, SCRIPTS[name])
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    # the mock server accepts any token, so don't sign one
+    module.generate_token = lambda *args, **kwargs: 'bench-token'
+    return module
+
+
+class CountingWriter:
+    '''
+    Wraps a table writer and counts the rows written.
+    '''
+    def __init__(self, writer, counts):
+        self.writer = writer
+        self.counts = counts
+
+    def _count(self, rows):
+        for r in rows:
+            self.counts['rows'] += 1
+            yield r
+
+    def writerow(self, row):
+        self.counts['rows'] += 1
+        self.writer.writerow(row)
+
+    def writerows(self, rows):
+        self.writer.writerows(self._count(rows))
+
+    def __enter__(self):
+        self.writer.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self.writer.__exit__(*exc)
+
+
+def run_one(config, result_file):
+    """
+    Runs a single configuration (in a child process) and
+    writes its measurements to result_file.
+    """
+    module = load_script(config['script'], config['api_url'])
+
+    # time every stage
+    timings = {}
+    for stage in STAGES:
+        def timed(*args, __fn=getattr(module, stage), __stage=stage, **kwargs):
+            start_wall = time.perf_counter()
+            start_cpu = time.process_time()
+            try:
+                return __fn(*args, **kwargs)
+            finally:
+                timings[__stage] = {
+                    'wall': time.perf_counter() - start_wall,
+                    'cpu': time.process_time() - start_cpu
+                }
+        setattr(module, stage, timed)
+
+    # count the rows written
+    counts = {'rows': 0}
+    open_table = module.TableWriter.open_table
+    module.TableWriter.open_table = lambda *args, **kwargs: CountingWriter(open_table(*args, **kwargs), counts)
+
+    cwd = tempfile.mkdtemp()
+    os.chdir(cwd)
+    args = ['bench-password']
+    if config['script'] == 'export_data_groups':
+        args.append(config['group_id'])
+    args.append(True)
+
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    try:
+        module.go(*args, fmt=config['format'], page_size=config['page_size'], shards=config['shards'])
+    finally:
+        os.chdir(HERE)
+        shutil.rmtree(cwd, ignore_errors=True)
+    wall = time.perf_counter() - start_wall
+    cpu = time.process_time() - start_cpu
+
+    # everything that isn't a write_* stage is archiving and bookkeeping
+    timings['archive'] = {
+        'wall': wall - sum(t['wall'] for t in timings.values()),
+        'cpu': cpu - sum(t['cpu'] for t in timings.values())
+    }
+
+    result = {
+        'wall': wall,
+        'cpu': cpu,
+        'rows': counts['rows'],
+        'rows_per_second': counts['rows'] / wall if wall else 0,
+        # ru_maxrss is in kilobytes on linux and bytes on macOS
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024),
+        'stages': timings
+    }
+    with open(result_file, 'w') as f:
+        json.dump(result, f)
+
+
+def fetch_stats(server):
+    with urllib.request.urlopen(server.base_url + '/_stats') as r:
+        return json.loads(r.read())
+
+
+def run_matrix(args):
+    server = mock_server.from_arguments(args).start()
+    results = []
+    try:
+        for script in args.scripts:
+            for page_size in args.page_sizes:
+                for shards in args.shards:
+                    config = {
+                        'script': script,
+                        'api_url': server.api_url,
+                        'group_id': '1',
+                        'format': args.format,
+                        'page_size': page_size,
+                        'shards': shards
+                    }
+                    before = fetch_stats(server)
+                    with tempfile.NamedTemporaryFile(suffix='.json') as result_file:
+                        subprocess.run(
+                            [sys.executable, __file__, '--run-one', json.dumps(config), result_file.name],
+                            check=True,
+                            stdout=subprocess.DEVNULL
+                        )
+                        with open(result_file.name) as f:
+                            result = json.load(f)
+                    after = fetch_stats(server)
+
+                    # subtract the /_stats request itself
+                    result['requests'] = after['requests'] - before['requests'] - 1
+                    result['throttled'] = after['throttled'] - before['throttled']
+                    result['errors'] = after['errors'] - before['errors']
+                    result['config'] = {k: v for (k, v) in config.items() if k != 'api_url'}
+                    results.append(result)
+
+                    print('{:<20} page_size={:<5} shards={:<3} {:>8.2f}s {:>9} requests {:>11.0f} rows/s {:>7.1f} MB'.format(
+                        script, page_size, shards, result['wall'], result['requests'],
+                        result['rows_per_second'], result['peak_rss_mb']
+                    ))
+    finally:
+        server.stop()
+
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True
+        ).stdout.strip()
+    except OSError:
+        return None
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == '--run-one':
+        run_one(json.loads(sys.argv[2]), sys.argv[3])
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--scripts',
+        nargs='+',
+        choices=list(SCRIPTS),
+        default=['export_data'],
+        help='Export scripts to benchmark'
+    )
+    parser.add_argument(
+        '--page-sizes',
+        nargs='+',
+        type=lambda v: v if v == 'auto' else int(v),
+        default=[50, 200, 'auto'],
+        help="Page sizes to run with ('auto' for adaptive)"
+    )
+    parser.add_argument(
+        '--shards',
+        nargs='+',
+        type=int,
+        default=[1, 4],
+        help='Shard counts for the calls export (1 is sequential pagination)'
+    )
+    parser.add_argument(
+        '--format',
+        default='csv',
+        help='Output format of the exported tables'
+    )
+    parser.add_argument(
+        '--output',
+        default='bench_export.json',
+        help='Where to write the results'
+    )
+    mock_server.add_arguments(parser)
+    args = parser.parse_args()
+
+    if shutil.which('7z') is None:
+        sys.exit('The export scripts need the 7-Zip command line tool (7z) on the PATH')
+
+    results = run_matrix(args)
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'revision': git_revision(),
+            'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'dataset': {'users': args.users, 'pods': args.pods, 'calls': args.calls},
+            'server': {'latency': args.latency, 'latency_per_entry': args.latency_per_entry,
+                       'error_rate': args.error_rate, 'throttle': args.throttle},
+            'results': results
+        }, f, indent=2)
+    print(f'Results written to {args.output}')
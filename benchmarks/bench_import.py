@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+#
+# Startup benchmark for libhelplightning and the sample
+#  scripts. It times `import libhelplightning` in fresh
+#  interpreters, checks that the modules only some scripts
+#  need are not imported with it, and fails if the import
+#  costs more than a budget on top of importing requests
+#  (which every script needs anyway).
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+# Modules that must not be imported by `import libhelplightning`
+LAZY_MODULES = [
+    'http.server',
+    'webbrowser',
+    'getpass',
+    'sqlite3',
+    'cProfile',
+    'pstats',
+    'pyarrow',
+    'jwt',
+    'cryptography',
+    'libhelplightning.BlobStore',
+    'libhelplightning.CallStore',
+    'libhelplightning.ChangeTracker',
+    'libhelplightning.CallbackServer',
+    'libhelplightning.Profiler',
+    'libhelplightning.ReportReader',
+    'libhelplightning.ResponseCache'
+]
+
+SCRIPTS = [
+    os.path.join(ROOT, 'export-data', 'export_data.py'),
+    os.path.join(ROOT, 'export-data-groups', 'export_data_groups.py'),
+    os.path.join(ROOT, 'generate-report', 'generate_report.py'),
+    os.path.join(ROOT, 'download-attachments', 'download-attachments.py')
+]
+
+SITECONFIG = '''
+API_KEY = 'bench'
+PARTNER_KEY = None
+SITE_ID = 8888
+HELPLIGHTNING_ENDPOINT = 'http://localhost:8090/api'
+HELPLIGHTNING_URL = 'http://localhost:8090'
+DEFAULT_TTL = 60 * 5
+'''
+
+
+def python(code, cwd=ROOT, extra_args=[]):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    return subprocess.run(
+        [sys.executable] + extra_args + ['-c', code],
+        cwd=cwd, env=env, capture_output=True, text=True, check=True
+    )
+
+
+def time_import(module, runs):
+    """
+    Median seconds to import `module` in a fresh interpreter.
+    """
+    code = f'import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)'
+    return statistics.median(float(python(code).stdout) for _ in range(runs))
+
+
+def time_script(script, cwd, runs):
+    """
+    Median seconds for a script to start up and print its --help.
+    """
+    code = (
+        'import runpy, sys, time\n'
+        f'sys.argv = [{script!r}, "--help"]\n'
+        't = time.perf_counter()\n'
+        'try:\n'
+        f'    runpy.run_path({script!r}, run_name="__main__")\n'
+        'except SystemExit:\n'
+        '    pass\n'
+        'print(time.perf_counter() - t, file=sys.stderr)\n'
+    )
+    return statistics.median(float(python(code, cwd).stderr.strip().splitlines()[-1]) for _ in range(runs))
+
+
+def slowest_imports(module, count):
+    """
+    The modules with the largest self time when importing
+    `module`, from python -X importtime.
+    """
+    result = python(f'import {module}', extra_args=['-X', 'importtime'])
+    rows = []
+    for line in result.stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) != 3 or not parts[0].strip().split(':')[-1].strip().isdigit():
+            continue
+        rows.append((int(parts[0].split(':')[-1]), int(parts[1]), parts[2].rstrip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+def eager_imports():
+    """
+    The LAZY_MODULES that `import libhelplightning` imports.
+    """
+    code = f'import sys, libhelplightning; print(" ".join(m for m in {LAZY_MODULES!r} if m in sys.modules))'
+    return python(code).stdout.split()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10, help='Fresh interpreters per measurement')
+    parser.add_argument('--budget-ms', type=float, default=30, help='Allowed import time on top of requests')
+    parser.add_argument('--top', type=int, default=10, help='Number of slowest imports to list')
+    args = parser.parse_args()
+
+    baseline = time_import('requests', args.runs)
+    library = time_import('libhelplightning', args.runs)
+    overhead = (library - baseline) * 1000
+    print(f'import requests          {baseline * 1000:8.1f} ms')
+    print(f'import libhelplightning  {library * 1000:8.1f} ms ({overhead:+.1f} ms, budget {args.budget_ms:.0f} ms)')
+
+    print('\nSlowest imports (self time) of libhelplightning:')
+    for (self_us, cumulative_us, name) in slowest_imports('libhelplightning', args.top):
+        print(f'  {self_us / 1000:8.1f} ms {name}')
+
+    with tempfile.TemporaryDirectory() as cwd:
+        with open(os.path.join(cwd, 'siteconfig.py'), 'w') as f:
+            f.write(SITECONFIG)
+        print('\nScript startup (--help):')
+        for script in SCRIPTS:
+            print(f'  {time_script(script, cwd, args.runs) * 1000:8.1f} ms {os.path.basename(script)}')
+
+    failures = []
+    eager = eager_imports()
+    if eager:
+        failures.append(f'import libhelplightning imports {", ".join(eager)}')
+    if overhead > args.budget_ms:
+        failures.append(f'import libhelplightning takes {overhead:.1f} ms on top of requests (budget {args.budget_ms:.0f} ms)')
+
+    if failures:
+        sys.exit('\n' + '\n'.join(failures))
+    print('\nWithin budget')
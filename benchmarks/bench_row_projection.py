@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+#
+# Micro-benchmark for turning call pages into csv rows.
+#  It compares the original per-row dict + csv.DictWriter
+#  approach against the Resources records (make_call and
+#  call_user_rows) the export scripts write, on a synthetic
+#  stream of pages.
+
+import argparse
+import csv
+import os
+import sys
+import time
+
+try:
+    sys.path.append('.')
+    from libhelplightning import Resources
+except ImportError:
+    sys.path.append('..')
+    from libhelplightning import Resources
+
+# (api name, column, default) of the calls table
+FILTER_PARAMS = Resources.CALL_FIELDS
+
+LINK_TABLE_FIELDNAMES = Resources.CALL_USER_COLUMNS
+
+ENTERPRISE_ID = 8888
+
+
+def generate_pages(calls, page_size):
+    """
+    Yields pages of synthetic calls shaped like the
+    /v1/enterprise/calls entries.
+    """
+    n = 0
+    while n < calls:
+        page = []
+        for i in range(n, min(n + page_size, calls)):
+            call = {
+                'session': f'session-{i}',
+                'has_attachments': i % 7 == 0,
+                'callDuration': i % 3600,
+                'dialerId': str(i % 1000),
+                'dialerName': f'Dialer {i % 1000}',
+                'intraEnterpriseCall': i % 5 != 0,
+                'reasonCallEnded': 'hangup',
+                'receiverId': str((i + 1) % 1000),
+                'receiverName': f'Receiver {(i + 1) % 1000}',
+                'timestamp': '2024-01-01T00:00:00Z',
+                'timeCallStarted': 1704067200 + i,
+                'timeCallEnded': 1704067200 + i + i % 3600,
+                'participants': [
+                    {'id': i % 1000, 'name': f'Dialer {i % 1000}', 'isAnonymous': False, 'enterpriseId': f'{ENTERPRISE_ID}'},
+                    {'id': (i + 1) % 1000, 'name': f'Receiver {(i + 1) % 1000}', 'isAnonymous': False, 'enterpriseId': '1'}
+                ]
+            }
+            # leave out an optional field now and then
+            if i % 2:
+                call['recordingStatus'] = 'complete'
+            page.append(call)
+        n += len(page)
+        yield page
+
+
+def dict_writer(pages, calls_file, users_file):
+    calls_writer = csv.DictWriter(calls_file, [p[1] for p in FILTER_PARAMS])
+    calls_writer.writeheader()
+    link_table_writer = csv.DictWriter(users_file, LINK_TABLE_FIELDNAMES)
+    link_table_writer.writeheader()
+
+    for entries in pages:
+        for e in entries:
+            row = {}
+            for (p0, p1, default) in FILTER_PARAMS:
+                if p0 in e:
+                    row[p1] = e[p0]
+                else:
+                    row[p1] = default
+
+            calls_writer.writerow(row)
+
+            for participant in e['participants']:
+                id = f'{e["session"]}_{participant["id"]}'
+                row = {
+                    'id': id,
+                    'call_id': e['session'],
+                    'user_id': participant['id'],
+                    'name': participant['name'],
+                    'isAnonymous': participant['isAnonymous'],
+                    'isExternal': participant['enterpriseId'] != f'{ENTERPRISE_ID}'
+                }
+                link_table_writer.writerow(row)
+
+
+def records_writer(pages, calls_file, users_file):
+    calls_writer = csv.writer(calls_file)
+    calls_writer.writerow(Resources.CALL_COLUMNS)
+    link_table_writer = csv.writer(users_file)
+    link_table_writer.writerow(LINK_TABLE_FIELDNAMES)
+
+    for entries in pages:
+        # what Calls.list().pages() hands write_calls in export_data.py
+        page = list(map(Resources.make_call, entries))
+        calls_writer.writerows(c[:-1] for c in page)
+        link_table_writer.writerows(Resources.call_user_rows(page, ENTERPRISE_ID))
+
+
+def run(name, fn, pages):
+    with open(os.devnull, 'w', newline='') as calls_file, open(os.devnull, 'w', newline='') as users_file:
+        start = time.perf_counter()
+        fn(pages, calls_file, users_file)
+        elapsed = time.perf_counter() - start
+    print(f'{name:>12}: {elapsed:.3f}s')
+    return elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--calls',
+        type=int,
+        default=1000000,
+        help='Number of synthetic calls'
+    )
+    parser.add_argument(
+        '--page-size',
+        type=int,
+        default=1000,
+        help='Number of calls per page'
+    )
+    args = parser.parse_args()
+
+    # Generate the pages up front so only the row building is timed
+    print(f'Generating {args.calls} calls...')
+    pages = list(generate_pages(args.calls, args.page_size))
+
+    baseline = run('DictWriter', dict_writer, pages)
+    records = run('Resources', records_writer, pages)
+    print(f'Speedup: {baseline / records:.2f}x')
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+#
+# Load generator for download-attachments.py. It starts the
+#  webhook server (MyServer + DownloadPool, or the --async
+#  engine) against the local mock API, fires signed attachment_created webhooks at it at
+#  a given rate and concurrency, and reports how fast they
+#  are accepted and how fast the attachments are downloaded.
+
+import argparse
+import concurrent.futures
+import contextlib
+import hashlib
+import hmac
+import http.client
+import importlib.util
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, 'mock-server'))
+import mock_server
+
+SECRET = 'bench-secret'
+
+
+def load_downloader(api_url):
+    """
+    Imports download-attachments.py with a siteconfig
+    pointing at the mock server.
+    """
+    siteconfig = types.ModuleType('siteconfig')
+    siteconfig.API_KEY = 'bench'
+    siteconfig.PARTNER_KEY = None
+    siteconfig.SITE_ID = 8888
+    siteconfig.HELPLIGHTNING_ENDPOINT = api_url
+    siteconfig.HELPLIGHTNING_URL = api_url
+    siteconfig.DEFAULT_TTL = 60 * 5
+    sys.modules['siteconfig'] = siteconfig
+
+    path = os.path.join(ROOT, 'download-attachments', 'download-attachments.py')
+    spec = importlib.util.spec_from_file_location('download_attachments', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    # the mock server accepts any token, so don't sign one
+    module.generate_token = lambda partner_key: 'bench-token'
+    return module
+
+
+def make_events(dataset, count, duplicate_rate, invalid_rate):
+    """
+    Builds (body, signature, kind) tuples for attachment_created
+    webhooks on the calls with attachments in the dataset.
+    """
+    attachments = []
+    i = 0
+    while len(attachments) < count and i < dataset.calls:
+        if dataset.has_attachments(i):
+            for j in range(dataset.attachments_per_call):
+                attachments.append((dataset.session(i), i * 10 + j + 1))
+        i += 1
+
+    events = []
+    sent = []
+    for n in range(count):
+        if sent and random.random() < duplicate_rate:
+            (call_id, attachment_id) = random.choice(sent)
+            kind = 'duplicate'
+        else:
+            (call_id, attachment_id) = attachments[len(sent) % len(attachments)]
+            sent.append((call_id, attachment_id))
+            kind = 'new'
+
+        body = json.dumps({
+            'category': 'attachment_created',
+            'data': {
+                'call_id': call_id,
+                'attachment': {'id': attachment_id}
+            }
+        }).encode('utf-8')
+        signature = 'sha256=' + hmac.new(SECRET.encode('utf-8'), msg=body, digestmod=hashlib.sha256).hexdigest()
+        if random.random() < invalid_rate:
+            signature = 'sha256=' + '0' * 64
+            kind = 'invalid'
+        events.append((body, signature, kind))
+    return events
+
+
+def post(port, body, signature):
+    """
+    Sends one webhook and returns (status, seconds).
+    The status is None if the delivery failed.
+    """
+    start = time.perf_counter()
+    try:
+        c = http.client.HTTPConnection('localhost', port, timeout=30)
+        c.request('POST', '/call', body=body, headers={
+            'Content-Type': 'application/json',
+            'x-helplightning-signature': signature
+        })
+        status = c.getresponse().status
+        c.close()
+    except (OSError, http.client.HTTPException):
+        status = None
+    return (status, time.perf_counter() - start)
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+def disk_usage(path):
+    (files, size) = (0, 0)
+    for (dirpath, dirnames, filenames) in os.walk(path):
+        for name in filenames:
+            files += 1
+            size += os.path.getsize(os.path.join(dirpath, name))
+    return (files, size)
+
+
+def download_latencies(path, sent_at, small_file_size):
+    """
+    The seconds from sending the webhook to the file being
+    complete (its mtime), for the small and the large files.
+    """
+    (small, large) = ([], [])
+    for (dirpath, dirnames, filenames) in os.walk(path):
+        for name in filenames:
+            filename = os.path.join(dirpath, name)
+            (call_id, attachment_id) = os.path.relpath(dirpath, path).split(os.sep)[:2]
+            sent = sent_at.get((call_id, int(attachment_id)))
+            if sent is None or name.endswith('.part'):
+                continue
+            st = os.stat(filename)
+            (small if st.st_size <= small_file_size else large).append(st.st_mtime - sent)
+    return (small, large)
+
+
+def latency_summary(values):
+    if not values:
+        return None
+    return {'count': len(values), 'p50': percentile(values, 50), 'p90': percentile(values, 90), 'max': max(values)}
+
+
+def run(args):
+    api = mock_server.from_arguments(args).start()
+    module = load_downloader(api.api_url)
+
+    cwd = tempfile.mkdtemp()
+    os.chdir(cwd)
+
+    class QuietHandler(module.MyHandler):
+        def log_message(self, format, *args):
+            # Don't log every webhook to stderr
+            pass
+
+    small_file_size = int(args.small_file_mb * 1024 * 1024)
+    scheduling = {
+        'small_workers': args.small_workers,
+        'jobs': module.libhelplightning.DownloadQueue(small_file_size, args.large_per_host),
+        'limiter': None
+    }
+    if args.bandwidth_limit:
+        scheduling['limiter'] = module.libhelplightning.RateLimiter(args.bandwidth_limit * 1024 * 1024)
+
+    if args.engine == 'async':
+        # the event loop accepts the webhooks too
+        pool = module.async_pool(args.workers, **scheduling)
+        port = pool.serve('localhost', 0, SECRET)
+        server = None
+    else:
+        pool = module.DownloadPool(size=args.workers, **scheduling)
+        server = module.MyServer('localhost', 0, pool, SECRET, QuietHandler)
+        port = server.server_address[1]
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    events = make_events(api.dataset, args.events, args.duplicate_rate, args.invalid_rate)
+    expected_files = len({body for (body, signature, kind) in events if kind != 'invalid'})
+
+    # sample the download queue depth while the test runs
+    depth = []
+    sampling = threading.Event()
+
+    def sample():
+        start = time.perf_counter()
+        while not sampling.is_set():
+            depth.append((round(time.perf_counter() - start, 2), pool.qsize()))
+            time.sleep(args.sample_interval)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+
+    # when each attachment was first sent, to measure how long
+    #  it took to download
+    sent_at = {}
+
+    results = []
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            futures = []
+            for (n, (body, signature, kind)) in enumerate(events):
+                # fire at a steady rate
+                due = start + n / args.rate
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                if kind != 'invalid':
+                    data = json.loads(body)['data']
+                    sent_at.setdefault((data['call_id'], data['attachment']['id']), time.time())
+                futures.append((kind, executor.submit(post, port, body, signature)))
+            for (kind, f) in futures:
+                results.append((kind,) + f.result())
+        send_time = time.perf_counter() - start
+
+        # wait for the downloads to finish
+        deadline = time.perf_counter() + args.drain_timeout
+        while time.perf_counter() < deadline:
+            (files, size) = disk_usage(os.path.join(cwd, 'attachments'))
+            if pool.qsize() == 0 and files >= expected_files:
+                break
+            time.sleep(0.1)
+        total_time = time.perf_counter() - start
+
+        sampling.set()
+        sampler.join()
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        pool.stop()
+
+    (files, size) = disk_usage(os.path.join(cwd, 'attachments'))
+    (small_latency, large_latency) = download_latencies(os.path.join(cwd, 'attachments'), sent_at, small_file_size)
+    os.chdir(HERE)
+    shutil.rmtree(cwd, ignore_errors=True)
+    stats = api.snapshot()
+    api.stop()
+
+    latencies = [r[2] for r in results if r[1] is not None]
+    report = {
+        'events': len(events),
+        'send_seconds': send_time,
+        'achieved_rate': len(events) / send_time if send_time else None,
+        'accepted': sum(1 for r in results if r[1] == 200),
+        'rejected_invalid_signature': sum(1 for r in results if r[0] == 'invalid' and r[1] == 403),
+        'failed_deliveries': sum(1 for r in results if r[1] is None or (r[1] != 200 and r[0] != 'invalid')),
+        'duplicates_sent': sum(1 for r in results if r[0] == 'duplicate'),
+        'accept_latency_ms': {
+            'p50': percentile(latencies, 50) * 1000 if latencies else None,
+            'p90': percentile(latencies, 90) * 1000 if latencies else None,
+            'p99': percentile(latencies, 99) * 1000 if latencies else None,
+            'max': max(latencies) * 1000 if latencies else None
+        },
+        'files_expected': expected_files,
+        'files_downloaded': files,
+        'bytes_downloaded': size,
+        'blob_requests': stats['routes'].get('blob', 0),
+        'download_seconds': total_time,
+        'download_mb_per_second': size / total_time / (1024 * 1024) if total_time else None,
+        'small_file_seconds': latency_summary(small_latency),
+        'large_file_seconds': latency_summary(large_latency),
+        'max_queue_depth': max((d for (t, d) in depth), default=0),
+        'queue_depth': depth
+    }
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=500, help='Number of webhooks to send')
+    parser.add_argument('--rate', type=float, default=100, help='Webhooks per second')
+    parser.add_argument('--concurrency', type=int, default=16, help='Webhooks in flight at once')
+    parser.add_argument('--workers', type=int, default=2, help='Concurrent downloads in the pool')
+    parser.add_argument('--engine', choices=['threads', 'async'], default='threads',
+                        help='Benchmark the threaded server or the --async engine (requires aiohttp)')
+    parser.add_argument('--small-workers', type=int, help='Workers reserved for small files')
+    parser.add_argument('--small-file-mb', type=float, default=16, help='Largest small file in MB')
+    parser.add_argument('--large-per-host', type=int, default=4, help='Large downloads at once per host')
+    parser.add_argument('--bandwidth-limit', type=float, help='Total download bandwidth in MB/s')
+    parser.add_argument('--duplicate-rate', type=float, default=0.05, help='Fraction of events that repeat an earlier one')
+    parser.add_argument('--invalid-rate', type=float, default=0.05, help='Fraction of events with a bad signature')
+    parser.add_argument('--sample-interval', type=float, default=0.25, help='Seconds between queue depth samples')
+    parser.add_argument('--drain-timeout', type=float, default=300, help='Seconds to wait for the downloads to finish')
+    parser.add_argument('--output', default='bench_webhooks.json', help='Where to write the results')
+    mock_server.add_arguments(parser)
+    args = parser.parse_args()
+
+    report = run(args)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    latency = report['accept_latency_ms']
+    print(f'Sent {report["events"]} webhooks in {report["send_seconds"]:.2f}s ({report["achieved_rate"]:.1f}/s)')
+    print(f'Accepted {report["accepted"]}, rejected {report["rejected_invalid_signature"]} invalid signatures, '
+          f'{report["failed_deliveries"]} failed deliveries, {report["duplicates_sent"]} duplicates')
+    if latency['p50'] is not None:
+        print(f'Accept latency p50 {latency["p50"]:.1f}ms p90 {latency["p90"]:.1f}ms '
+              f'p99 {latency["p99"]:.1f}ms max {latency["max"]:.1f}ms')
+    print(f'Downloaded {report["files_downloaded"]} of {report["files_expected"]} files '
+          f'({report["bytes_downloaded"] / (1024 * 1024):.1f} MB) in {report["download_seconds"]:.2f}s, '
+          f'{report["download_mb_per_second"]:.1f} MB/s')
+    for kind in ('small', 'large'):
+        summary = report[f'{kind}_file_seconds']
+        if summary is not None:
+            print(f'{summary["count"]} {kind} files done in p50 {summary["p50"]:.2f}s p90 {summary["p90"]:.2f}s '
+                  f'max {summary["max"]:.2f}s after their webhook')
+    print(f'Max queue depth {report["max_queue_depth"]}')
+    print(f'Results written to {args.output}')
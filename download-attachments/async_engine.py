@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+#
+# The --async engine of download-attachments.py. One asyncio
+#  event loop accepts the webhooks and streams the downloads,
+#  so the number of concurrent downloads isn't bound by the
+#  number of threads. It requires aiohttp.
+
+import asyncio
+import concurrent.futures
+import functools
+import hashlib
+import hmac
+import json
+import logging
+import os
+import tempfile
+import threading
+
+import aiohttp
+import aiohttp.web
+
+import libhelplightning
+
+CHUNK_SIZE = 64 * 1024
+
+logger = logging.getLogger('download-attachments')
+
+# Times a dropped download is resumed before giving up
+RETRIES = 3
+
+# Threads for the API calls that resolve attachments, which go
+#  through the (blocking) GaldrClient
+API_WORKERS = 8
+
+# Threads for the file and BlobStore work (writing and hashing
+#  chunks, links, the sqlite index), which would block the loop
+FILE_WORKERS = 8
+
+NOT_FOUND = '''
+<!DOCTYPE html>
+<html>
+  <body>
+    <h1>Not Found!</h1>
+  </body>
+</html>
+'''
+
+
+def verify_signature(secret, signature_header, body):
+    if signature_header is None:
+        return False
+    hash_object = hmac.new(secret.encode('utf-8'), msg=body, digestmod=hashlib.sha256)
+    return hmac.compare_digest('sha256=' + hash_object.hexdigest(), signature_header)
+
+
+class AsyncDownloadPool:
+    '''
+    A drop-in for DownloadPool that runs `size` download tasks on
+    an event loop in a background thread, instead of a thread per
+    download. Each download only holds one chunk in memory, so
+    hundreds can run at once. The jobs are scheduled the same way,
+    with `small_workers` of the tasks only downloading small files.
+
+    resolve(call_id, attachment_id) looks up an attachment,
+    path_for(call_id, attachment) is where it is saved, and
+    key_for(call_id, attachment) is its key in the store.
+    '''
+    def __init__(self, resolve, path_for, key_for, size = 256, store = None, small_workers = None, jobs = None,
+                 limiter = None):
+        self.resolve = resolve
+        self.path_for = path_for
+        self.key_for = key_for
+        self.size = size
+        self.store = store
+        self.small_workers = small_workers if small_workers is not None else max(1, size // 4)
+        self.jobs = jobs if jobs is not None else libhelplightning.DownloadQueue()
+        self.limiter = limiter
+        self.failed = []
+        self.stopping = False
+        self.site = None
+
+        self.loop = asyncio.new_event_loop()
+        self.api = concurrent.futures.ThreadPoolExecutor(max_workers = API_WORKERS)
+        self.files = concurrent.futures.ThreadPoolExecutor(max_workers = FILE_WORKERS)
+        self.thread = threading.Thread(target = self.loop.run_forever, daemon = True)
+        self.thread.start()
+        self.call(self._start())
+
+    def call(self, coroutine):
+        """
+        Runs a coroutine on the loop and waits for its result.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def _start(self):
+        # notified whenever a job may have become available
+        self.ready = asyncio.Condition()
+        self.http = aiohttp.ClientSession(
+            connector = aiohttp.TCPConnector(limit = self.size),
+            timeout = aiohttp.ClientTimeout(sock_connect = 60, sock_read = 60)
+        )
+        self.workers = [asyncio.ensure_future(self._work(x < self.small_workers)) for x in range(self.size)]
+
+    async def _notify(self):
+        async with self.ready:
+            self.ready.notify_all()
+
+    ###########################
+    # START DownloadPool interface
+    ###########################
+    def queue(self, attachment, priority = 0):
+        """
+        Queues a download, jobs with a lower priority go first.
+        """
+        self.jobs.put(attachment, priority)
+        asyncio.run_coroutine_threadsafe(self._notify(), self.loop)
+
+    def qsize(self):
+        return self.jobs.qsize()
+
+    def join(self):
+        """
+        Blocks until every queued download has finished.
+        """
+        self.jobs.join()
+
+    def stop(self):
+        self.call(self._stop())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.api.shutdown()
+        self.files.shutdown()
+    ###########################
+    # END DownloadPool interface
+    ###########################
+
+    async def _stop(self):
+        if self.site is not None:
+            await self.site.cleanup()
+        # like the Runners, finish the downloads in progress
+        #  and leave the rest of the queue
+        self.stopping = True
+        await self._notify()
+        await asyncio.gather(*self.workers)
+        await self.http.close()
+
+    async def _work(self, small_only):
+        while True:
+            # every change to the queue goes through queue(), the
+            #  webhooks or a worker, which all notify, and the loop
+            #  can't run one of them between take() and wait()
+            job = None
+
+            def ready():
+                nonlocal job
+                if self.stopping:
+                    return True
+                job = self.jobs.take(small_only)
+                return job is not None
+
+            async with self.ready:
+                await self.ready.wait_for(ready)
+            if job is None:
+                return
+
+            requeued = False
+            try:
+                if job.get('resolved') is None:
+                    # now that its size is known, put it back in
+                    #  line with the jobs of its size
+                    job['resolved'] = await self._resolve(job['data']['call_id'], job['data']['attachment']['id'])
+                    self.jobs.requeue(job)
+                    requeued = True
+                else:
+                    await self._run(job)
+            except Exception as e:
+                logger.error('Runner raised an exception: %s', e)
+                self.failed.append(job)
+            finally:
+                if not requeued:
+                    self.jobs.done(job)
+            # a large download finishing lets another start
+            await self._notify()
+
+    async def _run(self, job):
+        call_id = job['data']['call_id']
+        attachment_id = job['data']['attachment']['id']
+        a = job['resolved']
+
+        path = self.path_for(call_id, a)
+        await self._file(os.makedirs, os.path.dirname(path), exist_ok = True)
+
+        logger.info('Downloading %s', a.name)
+        try:
+            downloaded = await self._download(call_id, a, path)
+        except aiohttp.ClientResponseError as e:
+            if e.status != 403:
+                raise
+            # the signed url expired while the job was queued
+            a = await self._resolve(call_id, attachment_id)
+            downloaded = await self._download(call_id, a, path)
+        if downloaded:
+            logger.info('Completed download of %s', a.name)
+        else:
+            logger.info('%s is already stored', a.name)
+
+    async def _resolve(self, call_id, attachment_id):
+        return await self.loop.run_in_executor(self.api, self.resolve, call_id, attachment_id)
+
+    async def _file(self, fn, *args, **kwargs):
+        """
+        Runs blocking file or BlobStore work on the file threads.
+        """
+        return await self.loop.run_in_executor(self.files, functools.partial(fn, *args, **kwargs))
+
+    async def _download(self, call_id, a, path):
+        """
+        Saves the attachment to `path`, and returns whether it
+        had to be downloaded.
+        """
+        if self.store is None:
+            await self.fetch(a.signed_url, path)
+            return True
+
+        key = self.key_for(call_id, a)
+        if await self._file(self.store.reuse, key, path, size = a.size) is not None:
+            return False
+        tmp = self.store.tmp_path()
+        try:
+            blob_hash = await self.fetch(a.signed_url, tmp, hashed = True)
+            await self._file(self.store.put, tmp, blob_hash, key)
+        finally:
+            await self._file(_discard, tmp)
+        await self._file(self.store.link, blob_hash, path)
+        return True
+
+    async def fetch(self, url, output, hashed = False):
+        """
+        Streams `url` into a .part file of its own and renames it
+        to `output` once complete, like Downloader.download(),
+        resuming with a Range request if the connection drops.
+        Returns the sha256 of the file if `hashed` is set.
+        """
+        (fd, part) = await self._file(tempfile.mkstemp, suffix = '.part', prefix = os.path.basename(output) + '.',
+                                      dir = os.path.dirname(output) or '.')
+        f = open(fd, 'wb')
+        digest = hashlib.sha256() if hashed else None
+        offset = 0
+        attempt = 0
+        try:
+            while True:
+                headers = {'Range': f'bytes={offset}-'} if offset else {}
+                try:
+                    async with self.http.get(url, headers = headers) as r:
+                        if offset and r.status == 416:
+                            # the connection dropped after the last byte
+                            break
+                        r.raise_for_status()
+                        if offset and r.status != 206:
+                            # the server ignored our Range, start over
+                            await self._file(_rewind, f)
+                            offset = 0
+                            digest = hashlib.sha256() if hashed else None
+                        async for chunk in r.content.iter_chunked(CHUNK_SIZE):
+                            await self._file(_write, f, chunk, digest)
+                            offset += len(chunk)
+                            if self.limiter is not None:
+                                await asyncio.sleep(self.limiter.reserve(len(chunk)))
+                    break
+                except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError):
+                    attempt += 1
+                    if attempt > RETRIES:
+                        raise
+            await self._file(f.close)
+        except BaseException:
+            f.close()
+            os.remove(part)
+            raise
+
+        await self._file(os.replace, part, output)
+        return digest.hexdigest() if digest is not None else None
+
+    ###########################
+    # START Webhooks
+    ###########################
+    def serve(self, host, port, secret = None, ingester = None):
+        """
+        Starts accepting webhooks on the pool's event loop, and
+        returns the port it listens on. The calls of the webhooks
+        are passed to the `ingester` (a CallIngester), if any.
+        """
+        return self.call(self._serve(host, port, secret, ingester))
+
+    async def _serve(self, host, port, secret, ingester):
+        async def handle(request):
+            return await self._handle(request, secret, ingester)
+
+        app = aiohttp.web.Application()
+        app.router.add_route('*', '/{path:.*}', handle)
+        self.site = aiohttp.web.AppRunner(app, access_log = None)
+        await self.site.setup()
+        site = aiohttp.web.TCPSite(self.site, host, port)
+        await site.start()
+        return self.site.addresses[0][1]
+
+    async def _handle(self, request, secret, ingester):
+        if request.method != 'POST':
+            return aiohttp.web.Response(status = 404, text = NOT_FOUND, content_type = 'text/html')
+
+        # like the threaded server, every POST is verified first
+        data = await request.read()
+        if secret is not None:
+            if not verify_signature(secret, request.headers.get('x-helplightning-signature'), data):
+                return aiohttp.web.Response(status = 403, text = 'forbidden\n', content_type = 'application/json')
+
+        if request.path not in ('/call', '/session'):
+            return aiohttp.web.Response(status = 404, text = NOT_FOUND, content_type = 'text/html')
+
+        if request.path == '/call':
+            att = json.loads(data)
+            if att['category'] == 'attachment_created':
+                # queue up a download
+                self.jobs.put(att, libhelplightning.DownloadQueue.WEBHOOK)
+                await self._notify()
+            if ingester is not None:
+                ingester.add_event(att)
+        elif ingester is not None:
+            ingester.add_event(json.loads(data))
+        return aiohttp.web.Response(text = 'ok\n', content_type = 'application/json')
+    ###########################
+    # END Webhooks
+    ###########################
+
+
+def _write(f, chunk, digest):
+    f.write(chunk)
+    if digest is not None:
+        digest.update(chunk)
+
+
+def _rewind(f):
+    f.seek(0)
+    f.truncate()
+
+
+def _discard(path):
+    if os.path.exists(path):
+        os.remove(path)
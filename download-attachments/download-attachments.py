@@ -8,14 +8,15 @@ import http.server
 import json
 import threading
 import queue
-import jwt
 import datetime
 import logging
 import requests
 import sys
 import argparse
+import concurrent.futures
 import hashlib
 import hmac
+import time
 
 
 try:
@@ -29,18 +30,107 @@ except ImportError:
 
 PORT = 8080
 
+logger = logging.getLogger('download-attachments')
+
+# Backfill state, the time of the last complete backfill
+BACKFILL_LAST_RUN = 'backfill_last_run.json'
+
+# Seconds before the last backfill to start the next one from
+BACKFILL_OVERLAP = 24 * 60 * 60
+
+# Calls whose attachments are listed at once during a backfill
+LIST_WORKERS = 8
+
+# The backfill stops listing attachments while this many downloads
+#  are queued, so the signed urls don't expire before their turn
+MAX_QUEUED = 1000
+
+# Where --store cas keeps the blobs, under the attachments
+#  directory so the files can be hardlinks to them
+STORE_ROOT = os.path.join('.', 'attachments', '.store')
+
+# Times the ingester tries to fetch a call before dropping it
+INGEST_ATTEMPTS = 3
+
+# Calls the ingester fetches at once
+INGEST_WORKERS = 4
+
+def generate_token(partner_key):
+    # jwt (and the cryptography backend behind it) is slow to
+    #  import, and only needed when signing a token
+    import jwt
+
+    # create a date that expires in 1 hour
+    exp = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=3600)
+
+    # load our private key, which is in pkcs8 format
+    with open(partner_key) as f:
+        secret = f.read()
+
+    # generate a new JWT token that will be valid for one hour and sign it with our secret
+    payload = {
+        'iss': 'Ghazal',
+        'sub': f'Partner:{siteconfig.SITE_ID}',
+        'aud': 'Ghazal',
+        'exp': exp
+    }
+
+    token = jwt.encode(payload, key=secret, algorithm='RS256')
+
+    return token
+
+def attachment_path(call_id, attachment):
+    return os.path.join('.', 'attachments', str(call_id), str(attachment.id), attachment.name)
+
+def attachment_key(call_id, attachment):
+    return f'{call_id}/{attachment.id}'
+
+def resolve_attachment(e_client, call_id, attachment_id):
+    """
+    Looks up the attachment (and a fresh signed url for it).
+    """
+    attachments = libhelplightning.Resources.Calls(e_client).attachments(call_id)
+
+    # filter for the attachment we want
+    return [x for x in attachments if x.id == attachment_id][0]
+
 class DownloadPool:
-    def __init__(self, size = 2):
-        self.__queue = queue.Queue()
+    '''
+    Runs `size` Runner threads, `small_workers` of which (a
+    quarter by default) only download small files. `jobs` is
+    the DownloadQueue that decides which job runs next, and
+    `limiter` an optional RateLimiter on the bytes downloaded.
+    '''
+    def __init__(self, size = 2, store = None, small_workers = None, jobs = None, limiter = None):
+        self.__queue = jobs if jobs is not None else libhelplightning.DownloadQueue()
         self.__stop_queue = queue.Queue()
         self.__size = size
-        
-        self.__pool = [Runner(self.__queue, self.__stop_queue) for x in range(self.__size)]
+        self.failed = []
+        self.store = store
+
+        if small_workers is None:
+            small_workers = max(1, size // 4)
+        self.__pool = [
+            Runner(self.__queue, self.__stop_queue, self.failed, store, small_only = x < small_workers, limiter = limiter)
+            for x in range(self.__size)
+        ]
         for i in self.__pool:
             i.start()
 
-    def queue(self, attachment):
-        self.__queue.put(attachment)
+    def queue(self, attachment, priority = 0):
+        """
+        Queues a download, jobs with a lower priority go first.
+        """
+        self.__queue.put(attachment, priority)
+
+    def qsize(self):
+        return self.__queue.qsize()
+
+    def join(self):
+        """
+        Blocks until every queued download has finished.
+        """
+        self.__queue.join()
 
     def stop(self):
         self.__stop_queue.put(True)
@@ -49,95 +139,208 @@ class DownloadPool:
             p.join()
         
 class Runner(threading.Thread):
-    def __init__(self, job_queue, stop_queue):
+    def __init__(self, job_queue, stop_queue, failed = None, store = None, small_only = False, limiter = None):
         super().__init__()
         
         self.__job_queue = job_queue
         self.__stop_queue = stop_queue
+        self.__failed = failed if failed is not None else []
+        self.__store = store
+        self.__small_only = small_only
+        self.__limiter = limiter
 
-    def get_logger(self, level=logging.DEBUG):
-        """
-        Sets up logging to be shared across
-        all classes/functions.
-        """
-        root = logging.getLogger()
-        root.setLevel(level)
-        ch = logging.StreamHandler(sys.stdout)
-        ch.setLevel(level)
-        root.addHandler(ch)
-        return root
-
-        
     def run(self):
+        # One client for all jobs, it signs a new token
+        #  whenever the current one is about to expire
+        e_client = libhelplightning.GaldrClient(
+            logging.getLogger(),
+            siteconfig.HELPLIGHTNING_ENDPOINT,
+            siteconfig.API_KEY,
+            token_provider = lambda: generate_token(siteconfig.PARTNER_KEY)
+        )
+
+        session = requests.Session()
+
         while self.__stop_queue.empty():
+            job = self.__job_queue.get(small_only = self.__small_only, timeout = .1)
+            if job is None:
+                continue
+
+            requeued = False
             try:
-                job = self.__job_queue.get(timeout = .1)
                 # do something with job
                 call_id = job['data']['call_id']
                 attachment_id = job['data']['attachment']['id']
 
-                logger = self.get_logger(level=logging.INFO)
-                token = self.generate_token(siteconfig.PARTNER_KEY)
-                e_client = libhelplightning.GaldrClient(
-                    logger,
-                    siteconfig.HELPLIGHTNING_ENDPOINT,
-                    siteconfig.API_KEY,
-                    token = token
-                )
-                resp = e_client.get(f'/v1r1/enterprise/calls/{call_id}/attachments')
-
-                #print(resp)
-
-                # filter for the attachment we want
-                res = filter(lambda x: x['id'] == attachment_id, resp)
-                a = list(res)[0]
-
-                url = a['signed_url']
-                name = a['name']
-
-                path = os.path.join('.', 'attachments', str(call_id), str(attachment_id))
-                try: os.makedirs(path)
-                except OSError: pass
-
-                print(f'Downloading {name}')
-                with open(os.path.join(path, name), 'wb') as f:
-                    r = requests.get(url, stream = True)
-                    for l in r.iter_content(512):
-                        f.write(l)
-                print(f'Completed download of {name}')
-
-            except queue.Empty:
-                pass
+                # backfill jobs come with the attachment already resolved
+                a = job.get('resolved')
+                if a is None:
+                    # now that its size is known, put it back in
+                    #  line with the jobs of its size
+                    job['resolved'] = self.resolve(e_client, call_id, attachment_id)
+                    self.__job_queue.requeue(job)
+                    requeued = True
+                    continue
+
+                path = attachment_path(call_id, a)
+                os.makedirs(os.path.dirname(path), exist_ok = True)
+
+                logger.info('Downloading %s', a.name)
+                try:
+                    downloaded = self.download(call_id, a, path, session)
+                except requests.exceptions.HTTPError as e:
+                    if e.response is None or e.response.status_code != 403:
+                        raise
+                    # the signed url expired while the job was queued
+                    a = self.resolve(e_client, call_id, attachment_id)
+                    downloaded = self.download(call_id, a, path, session)
+                if downloaded:
+                    logger.info('Completed download of %s', a.name)
+                else:
+                    logger.info('%s is already stored', a.name)
+
             except Exception as e:
-                print('Runner raised an exception:', e)
-                pass
+                logger.error('Runner raised an exception: %s', e)
+                self.__failed.append(job)
+            finally:
+                if not requeued:
+                    self.__job_queue.done(job)
+
+    def download(self, call_id, a, path, session):
+        """
+        Saves the attachment to `path`, and returns whether it
+        had to be downloaded.
+        """
+        if self.__store is None:
+            libhelplightning.Downloader.download(a.signed_url, path, session = session, limiter = self.__limiter)
+            return True
+        (_, downloaded) = self.__store.fetch(a.signed_url, attachment_key(call_id, a), path,
+                                             size = a.size, session = session, limiter = self.__limiter)
+        return downloaded
+
+    def resolve(self, e_client, call_id, attachment_id):
+        return resolve_attachment(e_client, call_id, attachment_id)
 
     def generate_token(self, partner_key):
-        # create a date that expires in 1 hour
-        exp = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=3600)
+        return generate_token(partner_key)
+
+def event_call_id(event):
+    """
+    The call a /call or /session webhook is about, or None.
+    """
+    data = event.get('data') or {}
+    for key in ('call_id', 'session_id', 'session'):
+        if data.get(key):
+            return data[key]
+    return None
+
+class CallIngester(threading.Thread):
+    '''
+    Keeps a CallStore current from the /call and /session webhooks.
+    The calls they name are collected for `interval` seconds (or
+    until `batch_size` are waiting), then each is fetched once, and
+    the batch is upserted in one transaction. A call that fails to
+    fetch or store is tried again in the next batches.
+    '''
+    def __init__(self, store, interval = 2, batch_size = 100):
+        super().__init__()
 
-        # load our private key, which is in pkcs8 format
-        with open(partner_key) as f:
-            secret = f.read()
+        self.store = store
+        self.interval = interval
+        self.batch_size = batch_size
+        self.ingested = 0
+        self.__pending = {}
+        self.__cond = threading.Condition()
+        self.__stopping = False
 
-        # generate a new JWT token that will be valid for one hour and sign it with our secret
-        payload = {
-            'iss': 'Ghazal',
-            'sub': f'Partner:{siteconfig.SITE_ID}',
-            'aud': 'Ghazal',
-            'exp': exp
-        }
+    def add_event(self, event):
+        """
+        Ingests the call a webhook is about.
+        """
+        call_id = event_call_id(event)
+        if call_id is not None:
+            self.add(call_id)
 
-        token = jwt.encode(payload, key=secret, algorithm='RS256')
+    def add(self, call_id):
+        with self.__cond:
+            self.__pending.setdefault(call_id, 0)
+            # the first call starts a batch, a full one is sent at once
+            if len(self.__pending) == 1 or len(self.__pending) >= self.batch_size:
+                self.__cond.notify()
+
+    def stop(self):
+        with self.__cond:
+            self.__stopping = True
+            self.__cond.notify()
+        self.join()
 
-        return token
+    def run(self):
+        e_client = libhelplightning.GaldrClient(
+            logging.getLogger(),
+            siteconfig.HELPLIGHTNING_ENDPOINT,
+            siteconfig.API_KEY,
+            token_provider = lambda: generate_token(siteconfig.PARTNER_KEY)
+        )
+        calls = libhelplightning.Resources.Calls(e_client)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers = INGEST_WORKERS) as fetchers:
+            while True:
+                with self.__cond:
+                    # wait for the first call, then give the batch
+                    #  `interval` seconds to fill up
+                    self.__cond.wait_for(lambda: self.__pending or self.__stopping)
+                    self.__cond.wait_for(lambda: len(self.__pending) >= self.batch_size or self.__stopping,
+                                         self.interval)
+                    (batch, self.__pending) = (self.__pending, {})
+                    stopping = self.__stopping
+
+                if batch:
+                    try:
+                        self.ingest(calls, fetchers, batch)
+                    except Exception:
+                        # keep ingesting the next webhooks
+                        logger.exception('Failed to ingest %d calls', len(batch))
+                if stopping:
+                    break
+
+    def ingest(self, calls, fetchers, batch):
+        fetched = {}
+        futures = {call_id: fetchers.submit(calls.get, call_id) for call_id in batch}
+        for (call_id, f) in futures.items():
+            try:
+                fetched[call_id] = f.result()
+            except Exception as e:
+                self.retry(call_id, batch[call_id], f'Failed to fetch call {call_id}: {e}')
+
+        try:
+            self.ingested += self.store.upsert(list(fetched.values()))
+        except Exception as e:
+            # e.g. the database is locked by another process
+            logger.error('Failed to store %d calls: %s', len(fetched), e)
+            for call_id in fetched:
+                self.retry(call_id, batch[call_id], f'Gave up storing call {call_id}')
+            return
+        logger.info('Ingested %d calls', len(fetched))
+
+    def retry(self, call_id, attempts, message):
+        """
+        Puts a call back for the next batches, unless it has
+        failed INGEST_ATTEMPTS times.
+        """
+        attempts += 1
+        if attempts < INGEST_ATTEMPTS:
+            with self.__cond:
+                self.__pending.setdefault(call_id, attempts)
+        else:
+            logger.warning(message)
 
 class MyServer(http.server.HTTPServer):
-    def __init__(self, host, port, pool, verify_signature, handler):
+    def __init__(self, host, port, pool, verify_signature, handler, ingester = None):
         super().__init__((host, port), handler)
         self.pool = pool
         self.verify_signature = verify_signature != None
         self.signature = verify_signature
+        self.ingester = ingester
             
 class MyHandler(http.server.BaseHTTPRequestHandler):
     '''
@@ -145,9 +348,9 @@ class MyHandler(http.server.BaseHTTPRequestHandler):
     GET /call
     GET /session
 
-    However, it only currently takes action on
-    GET /call
-    when the category is an attachment_created
+    It downloads the attachment of a /call webhook whose
+    category is attachment_created, and with a call store,
+    ingests the call of every /call and /session webhook.
     '''
     def do_GET(self):
         self.do_404()
@@ -158,8 +361,10 @@ class MyHandler(http.server.BaseHTTPRequestHandler):
         data = self.rfile.read(content_length)
 
         if self.server.verify_signature:
-            self.verify_signature(self.headers['x-helplightning-signature'], data)
-        
+            if not self.verify_signature(self.headers.get('x-helplightning-signature'), data):
+                self.do_403()
+                return
+
         if path == '/call':
             self.do_calls(data)
         elif path == '/session':
@@ -170,14 +375,17 @@ class MyHandler(http.server.BaseHTTPRequestHandler):
     def do_calls(self, data):
         att = json.loads(data)
 
-        # TODO, validate the HMAC signature!!
-        
+        # the signature was checked in do_POST
         if att['category'] == 'attachment_created':
             # queue up a download
-            self.server.pool.queue(att)
+            self.server.pool.queue(att, libhelplightning.DownloadQueue.WEBHOOK)
+        if self.server.ingester is not None:
+            self.server.ingester.add_event(att)
         self.do_response()
 
     def do_sessions(self, data):
+        if self.server.ingester is not None:
+            self.server.ingester.add_event(json.loads(data))
         self.do_response()
 
     def do_response(self):
@@ -202,14 +410,132 @@ class MyHandler(http.server.BaseHTTPRequestHandler):
         
         self.wfile.write(bytes(msg, "utf-8"))
 
+    def do_403(self):
+        # Request signatures didn't match!
+        self.send_response(403)
+        self.send_header("Content-type", "application/json")
+        self.end_headers()
+        self.wfile.write(bytes("forbidden\n", "utf-8"))
+
     def verify_signature(self, signature_header, body):
         # calculate the signature to validate its
         #  authenticity
         hash_object = hmac.new(self.server.signature.encode('utf-8'), msg=body, digestmod=hashlib.sha256)
         expected_signature = "sha256=" + hash_object.hexdigest()
 
-        if not hmac.compare_digest(expected_signature, signature_header):
-            raise http.client.HTTPException(status_code=403, detail="Request signatures didn't match!")
+        if signature_header is None:
+            return False
+        return hmac.compare_digest(expected_signature, signature_header)
+
+def async_pool(size, store = None, **scheduling):
+    """
+    An AsyncDownloadPool, which downloads on an event loop
+    instead of Runner threads. `scheduling` are the small_workers,
+    jobs and limiter arguments of DownloadPool.
+    """
+    # aiohttp is optional, so only import it for --async
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    import async_engine
+
+    e_client = libhelplightning.GaldrClient(
+        logging.getLogger(),
+        siteconfig.HELPLIGHTNING_ENDPOINT,
+        siteconfig.API_KEY,
+        token_provider = lambda: generate_token(siteconfig.PARTNER_KEY)
+    )
+    return async_engine.AsyncDownloadPool(
+        lambda call_id, attachment_id: resolve_attachment(e_client, call_id, attachment_id),
+        attachment_path,
+        attachment_key,
+        size = size,
+        store = store,
+        **scheduling
+    )
+
+def backfill(pool, fetch_all):
+    """
+    Downloads the attachments of past calls, either all of them or
+    those of the calls since the last backfill. Only calls with
+    attachments are looked up, and attachments already on disk
+    are skipped. Returns whether everything was downloaded.
+    """
+    e_client = libhelplightning.GaldrClient(
+        logging.getLogger(),
+        siteconfig.HELPLIGHTNING_ENDPOINT,
+        siteconfig.API_KEY,
+        token_provider = lambda: generate_token(siteconfig.PARTNER_KEY),
+        page_size = 'auto'
+    )
+    calls = libhelplightning.Resources.Calls(e_client)
+
+    from_date = None
+    if not fetch_all:
+        try:
+            with open(BACKFILL_LAST_RUN, 'r') as f:
+                # go back a day, attachments can be added to a call
+                #  after it ended
+                from_date = json.load(f)['timestamp'] - BACKFILL_OVERLAP
+        except FileNotFoundError:
+            logger.info('%s not found, backfilling all calls', BACKFILL_LAST_RUN)
+    started = int(time.time())
+
+    def list_and_queue(call_id):
+        """
+        Queues the attachments of a call that aren't on disk yet,
+        and returns (queued, skipped), or None if the listing failed.
+        """
+        try:
+            attachments = calls.attachments(call_id)
+        except Exception as e:
+            logger.warning('Failed to list the attachments of %s: %s', call_id, e)
+            return None
+
+        (queued, skipped) = (0, 0)
+        for a in attachments:
+            path = attachment_path(call_id, a)
+            if os.path.exists(path) and (a.size is None or os.path.getsize(path) == a.size):
+                skipped += 1
+                continue
+            if pool.store is not None:
+                blob_hash = pool.store.find(attachment_key(call_id, a), a.size)
+                if blob_hash is not None:
+                    # stored, but its link was removed
+                    pool.store.link(blob_hash, path)
+                    skipped += 1
+                    continue
+            pool.queue({'data': {'call_id': call_id, 'attachment': {'id': a.id}}, 'resolved': a},
+                       libhelplightning.DownloadQueue.BACKFILL)
+            queued += 1
+        return (queued, skipped)
+
+    (calls_seen, queued, skipped, list_failures) = (0, 0, 0, 0)
+    with concurrent.futures.ThreadPoolExecutor(max_workers = LIST_WORKERS) as listers:
+        for page in calls.list(from_date = from_date).pages():
+            calls_seen += len(page)
+            call_ids = [c.id for c in page if c.has_attachments]
+            for result in listers.map(list_and_queue, call_ids):
+                if result is None:
+                    list_failures += 1
+                else:
+                    queued += result[0]
+                    skipped += result[1]
+
+            # let the downloads catch up
+            while pool.qsize() > MAX_QUEUED:
+                time.sleep(.1)
+
+    pool.join()
+    logger.info(f'Backfill walked {calls_seen} calls: downloaded {queued - len(pool.failed)} attachments, '
+                f'skipped {skipped} already on disk')
+
+    if pool.failed or list_failures:
+        logger.error(f'{len(pool.failed)} downloads and {list_failures} listings failed, '
+                     'run the backfill again to retry them')
+        return False
+
+    with open(BACKFILL_LAST_RUN, 'w') as f:
+        f.write(json.dumps({'timestamp': started}))
+    return True
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -217,12 +543,130 @@ if __name__ == '__main__':
         '--verify-signature',
         help='Secret used to verify webhook signature'
     )
+    parser.add_argument(
+        '--backfill',
+        action='store_true',
+        help='Download the attachments of past calls and exit, instead of listening for webhooks'
+    )
+    parser.add_argument(
+        '--fetch-all',
+        action='store_true',
+        help='With --backfill, walk all calls instead of the calls since the last backfill'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        help='Number of concurrent downloads (Default is 2, or 16 with --backfill, or 256 with --async)'
+    )
+    parser.add_argument(
+        '--async',
+        dest='use_async',
+        action='store_true',
+        help='Accept webhooks and download on one asyncio event loop instead of a thread per download (requires aiohttp)'
+    )
+    parser.add_argument(
+        '--small-workers',
+        type=int,
+        help='Number of the --workers reserved for small files (Default is a quarter of them, at least 1)'
+    )
+    parser.add_argument(
+        '--small-file-mb',
+        type=float,
+        default=16,
+        help='Largest attachment, in MB, that counts as a small file (Default is 16)'
+    )
+    parser.add_argument(
+        '--large-per-host',
+        type=int,
+        default=4,
+        help='Number of large files downloaded at once from each storage host (Default is 4)'
+    )
+    parser.add_argument(
+        '--bandwidth-limit',
+        type=float,
+        help='Total download bandwidth in MB/s (Default is unlimited)'
+    )
+    parser.add_argument(
+        '--store',
+        choices=['files', 'cas'],
+        default='files',
+        help='Save every attachment as its own file, or once per distinct content with links to it (Default is files)'
+    )
+    parser.add_argument(
+        '--link',
+        choices=['hardlink', 'symlink'],
+        default='hardlink',
+        help='With --store cas, how attachment paths point at the stored content (Default is hardlink)'
+    )
+    parser.add_argument(
+        '--call-store',
+        help='Keep the calls of the /call and /session webhooks up to date in this sqlite file'
+    )
+    parser.add_argument(
+        '--ingest-interval',
+        type=float,
+        default=2,
+        help='With --call-store, seconds to collect webhooks for before fetching their calls (Default is 2)'
+    )
+    libhelplightning.Logging.add_arguments(parser)
     args = parser.parse_args()
+
+    libhelplightning.Logging.from_arguments(args)
+
+    store = None
+    if args.store == 'cas':
+        store = libhelplightning.BlobStore(STORE_ROOT, link = args.link)
     
+    scheduling = {
+        'small_workers': args.small_workers,
+        'jobs': libhelplightning.DownloadQueue(
+            small_file_size = int(args.small_file_mb * 1024 * 1024),
+            max_large_per_host = args.large_per_host
+        ),
+        'limiter': None
+    }
+    if args.bandwidth_limit:
+        scheduling['limiter'] = libhelplightning.RateLimiter(args.bandwidth_limit * 1024 * 1024)
+
     # create a pool
-    pool = DownloadPool()
+    if args.use_async:
+        try:
+            pool = async_pool(args.workers or 256, store, **scheduling)
+        except ImportError as e:
+            sys.exit(f'--async requires aiohttp (pip install aiohttp): {e}')
+    else:
+        pool = DownloadPool(size = args.workers or (16 if args.backfill else 2), store = store, **scheduling)
+
+    if args.backfill:
+        try:
+            ok = backfill(pool, args.fetch_all)
+        finally:
+            pool.stop()
+        if store is not None:
+            logger.info(f'Store: {store.summary()}')
+        sys.exit(0 if ok else 1)
     
-    s = MyServer("localhost", PORT, pool, args.verify_signature, MyHandler)
+    ingester = None
+    if args.call_store:
+        ingester = CallIngester(
+            libhelplightning.CallStore(args.call_store, siteconfig.SITE_ID),
+            interval = args.ingest_interval
+        )
+        ingester.start()
+
+    if args.use_async:
+        pool.serve("localhost", PORT, args.verify_signature, ingester)
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            pool.stop()
+            if ingester is not None:
+                ingester.stop()
+        sys.exit(0)
+
+    s = MyServer("localhost", PORT, pool, args.verify_signature, MyHandler, ingester)
     try:
         s.serve_forever()
     except KeyboardInterrupt:
@@ -230,4 +674,6 @@ if __name__ == '__main__':
     finally:
         s.server_close()
         pool.stop()
+        if ingester is not None:
+            ingester.stop()
 
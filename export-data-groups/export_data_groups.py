@@ -1,13 +1,11 @@
 #!/usr/bin/env python3
 
 import argparse
-import csv
+import contextlib
 import datetime
-import getpass
-import hashlib
 import json
-import jwt
 import logging
+import operator
 import os
 import requests
 import sys
@@ -16,28 +14,21 @@ import tempfile
 try:
     sys.path.append('.')
     import libhelplightning
+    from libhelplightning import Resources, TableWriter
     import siteconfig
 except ImportError:
     sys.path.append('..')
     import libhelplightning
+    from libhelplightning import Resources, TableWriter
     import siteconfig
 
 
-def get_logger(level=logging.DEBUG):
-    """
-    Sets up logging to be shared across
-    all classes/functions.
-    """
-    root = logging.getLogger()
-    root.setLevel(level)
-    ch = logging.StreamHandler(sys.stdout)
-    ch.setLevel(level)
-    root.addHandler(ch)
-    return root
-
 
+def generate_token(partner_key, site_id):
+    # jwt (and the cryptography backend behind it) is slow to
+    #  import, and only needed when signing a token
+    import jwt
 
-def generate_token(partner_key):
     # create a date that expires in 1 hour
     exp = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=3600)
 
@@ -48,7 +39,7 @@ def generate_token(partner_key):
     # generate a new JWT token that will be valid for one hour and sign it with our secret
     payload = {
         'iss': 'Ghazal',
-        'sub': f'Partner:{siteconfig.SITE_ID}',
+        'sub': f'Partner:{site_id}',
         'aud': 'Ghazal',
         'exp': exp
     }
@@ -58,16 +49,13 @@ def generate_token(partner_key):
     return token
 
 
-def write_users(e_client, group_id, start_date, base):
-    def query_params():
-        if not start_date:
-            return {}
-        else:
-            # updates since the last run
-            s = start_date.isoformat().replace('+00:00', 'Z')
-            return {'filter': f'updated_at>{s}'}
-
-    params = query_params()
+def write_users(e_client, group_id, start_date, base, fmt='csv', tracker=None):
+    # With a change index every user of the group is listed, and the
+    #  index drops the ones that didn't change. The ids of all of them
+    #  are returned, or the pod memberships of the unchanged users
+    #  would be filtered out, and look deleted.
+    since = start_date if tracker is None else None
+    users = Resources.Users(e_client).in_pod(group_id, since=since)
 
     filter_params = [
         'id',
@@ -94,236 +82,159 @@ def write_users(e_client, group_id, start_date, base):
         'username'
     ]
 
-    with open(os.path.join(base, 'users.csv'), 'w', newline='') as users_csv:
-        # Set up csv writer
-        fieldnames = [p for p in filter_params]
-        writer = csv.DictWriter(users_csv, fieldnames)
-        writer.writeheader()
+    # Set up table writer
+    user_ids = []
+    with TableWriter.open_table(base, 'users', filter_params, fmt) as writer:
+        project = operator.attrgetter(*filter_params)
 
-        def cb(entries):
-            results = []
-            for e in entries:
-                row = {}
-                for p in filter_params:
-                    row[p] = e[p]
+        for page in users.pages():
+            rows = map(project, page)
+            if tracker is not None:
+                rows = tracker.changes('users', rows)
+            writer.writerows(rows)
+            user_ids.extend(u.id for u in page)
 
-                writer.writerow(row)
-                
-                results.append(e['id'])
+    return user_ids
 
-            return results
 
-        user_ids = e_client.get_all_cb(cb, f'/v1/enterprise/pods/{group_id}/users', params)
-
-        return user_ids
-
-
-def write_pods(e_client, user_ids, start_date, base):
-    def query_params():
-        if not start_date:
-            return {}
-        else:
-            # updates since the last run
-            s = start_date.isoformat().replace('+00:00', 'Z')
-            return {'filter': f'updated_at>{s}'}
+def write_pods(e_client, user_ids, start_date, base, fmt='csv', tracker=None):
+    user_ids = set(user_ids)
+    pods = Resources.Pods(e_client).list(since=start_date)
 
-    params = query_params()
-    results = e_client.get_all('/v1r1/enterprise/pods', params)
-
-    filter_params = [
-        "id",
-        "admin_count",
-        "default",
-        "description",
-        "email",
-        "expert",
-        "manage",
-        "name",
-        "user_count"
-    ]
-
-
-    # Create csv files for the main table and linking tables
-    pods_csv = open(os.path.join(base, 'pods.csv'), 'w', newline='')
-    pods_users_csv = open(os.path.join(base, 'pods_users.csv'), 'w', newline='')
-    pods_admins_csv = open(os.path.join(base, 'pods_admins.csv'), 'w', newline='')
-    pods_pods_csv = open(os.path.join(base, 'pods_pods.csv'), 'w', newline='')
-    pods_on_call_pods_csv = open(os.path.join(base, 'pods_on_call_pods.csv'), 'w', newline='')
-
-    with pods_csv, pods_users_csv, pods_admins_csv, pods_pods_csv, pods_on_call_pods_csv:
-        pods_writer = csv.DictWriter(pods_csv, filter_params)
-        pods_writer.writeheader()
+    # Create tables for the main table and linking tables
+    pods_writer = TableWriter.open_table(base, 'pods', Resources.POD_FIELDS, fmt)
+    pods_users_writer = TableWriter.open_table(base, 'pods_users', ['id', 'pod_id', 'user_id'], fmt)
+    pods_admins_writer = TableWriter.open_table(base, 'pods_admins', ['id', 'pod_id', 'user_id'], fmt)
+    pods_pods_writer = TableWriter.open_table(base, 'pods_pods', ['id', 'pod_id', 'included_pod_id'], fmt)
+    pods_on_call_pods_writer = TableWriter.open_table(base, 'pods_on_call_pods', ['id', 'pod_id', 'on_call_pod_id'], fmt)
 
+    with pods_writer, pods_users_writer, pods_admins_writer, pods_pods_writer, pods_on_call_pods_writer:
         # Get a function for creating linking tables for this enterprise.
         write_link_tables = get_pods_link_tables_writer(
             e_client,
-            user_ids, 
-            base,
-            pods_users_csv,
-            pods_admins_csv,
-            pods_pods_csv,
-            pods_on_call_pods_csv
+            user_ids,
+            pods_users_writer,
+            pods_admins_writer,
+            pods_pods_writer,
+            pods_on_call_pods_writer,
+            tracker
         )
 
-        for r in results:
-            row = {p: r[p] for p in filter_params}
-            pods_writer.writerow(row)
-            write_link_tables(row['id'])
+        for pod in pods:
+            if tracker is None or tracker.changes('pods', [pod]):
+                pods_writer.writerow(pod)
+            write_link_tables(pod.id)
 
 
-def get_pods_link_tables_writer(e_client, user_ids, base, users_file, admins_file, subpods_file, on_call_pods_file):
-    # Create the csv writers
-    pods_users_writer = csv.DictWriter(users_file, ['id', 'pod_id', 'user_id'])
-    pods_admins_writer = csv.DictWriter(admins_file, ['id', 'pod_id', 'user_id'])
-    pods_pods_writer = csv.DictWriter(subpods_file, ['id', 'pod_id', 'included_pod_id'])
-    pods_on_call_pods_writer = csv.DictWriter(on_call_pods_file, ['id', 'pod_id', 'on_call_pod_id'])
+def get_pods_link_tables_writer(e_client, user_ids, pods_users_writer, pods_admins_writer, pods_pods_writer, pods_on_call_pods_writer,
+                                tracker=None):
+    pods = Resources.Pods(e_client)
 
-    pods_users_writer.writeheader()
-    pods_admins_writer.writeheader()
-    pods_pods_writer.writeheader()
-    pods_on_call_pods_writer.writeheader()
+    def write(writer, table, pod_id, rows):
+        # only the memberships that changed, the ones that
+        #  are gone become tombstones
+        if tracker is not None:
+            rows = tracker.changes(table, rows, scope=pod_id)
+        writer.writerows(rows)
 
     def fetch_and_write(pod_id):
-        results = e_client.get(f'/v1r1/enterprise/pods/{pod_id}')
+        members = pods.members(pod_id)
 
         # first the pods_users
-        for u in results['users']:
-            u_row = {
-                'id': f'{pod_id}_{u["id"]}',
-                'pod_id': pod_id,
-                'user_id': u['id']
-            }
-            if u['id'] in user_ids:
-                pods_users_writer.writerow(u_row)
+        write(pods_users_writer, 'pods_users', pod_id, (
+            (f'{pod_id}_{u}', pod_id, u)
+            for u in members.users if u in user_ids
+        ))
 
         # now the pods_admins
-        for u in results['admins']:
-            a_row = {
-                'id': f'{pod_id}_{u["id"]}',
-                'pod_id': pod_id,
-                'user_id': u['id']
-            }
-            if u['id'] in user_ids:
-                pods_admins_writer.writerow(a_row)
+        write(pods_admins_writer, 'pods_admins', pod_id, (
+            (f'{pod_id}_{u}', pod_id, u)
+            for u in members.admins if u in user_ids
+        ))
 
         # now the pods_pods (subpods)
-        for u in results['subpods']:
-            p_row = {
-                'id': f'{pod_id}_{u["id"]}',
-                'pod_id': pod_id,
-                'included_pod_id': u['id']
-            }
-            pods_pods_writer.writerow(p_row)
+        write(pods_pods_writer, 'pods_pods', pod_id, (
+            (f'{pod_id}_{p}', pod_id, p)
+            for p in members.subpods
+        ))
 
         # now the pods_on_call_pods (on call pods)
-        for u in results['on_call_pods']:
-            o_row = {
-                'id': f'{pod_id}_{u["id"]}',
-                'pod_id': pod_id,
-                'on_call_pod_id': u['id']
-            }
-            pods_on_call_pods_writer.writerow(o_row)
+        write(pods_on_call_pods_writer, 'pods_on_call_pods', pod_id, (
+            (f'{pod_id}_{p}', pod_id, p)
+            for p in members.on_call_pods
+        ))
 
     return fetch_and_write
 
 
-def write_calls(e_client, enterprise_id, user_ids, start_date, base):
+def write_calls(e_client, enterprise_id, user_ids, start_date, base, fmt='csv', shards=1):
     # convert ids to strings
-    user_ids = [f'{x}' for x in user_ids]
-    
-    def url_query_params():
-        if not start_date:
-            return ('/v1/enterprise/calls', {})
-        else:
-            # updates since the last run
-            s = int(start_date.timestamp())
-            return ('/v1/enterprise/calls/range', {'from_date': s})
+    user_ids = {f'{x}' for x in user_ids}
+    calls = Resources.Calls(e_client)
 
-    url, params = url_query_params()
+    # Set up table writers for the call data
+    calls_writer = TableWriter.open_table(base, 'calls', Resources.CALL_COLUMNS, fmt, Resources.CALL_DEFAULTS)
 
-    filter_params = [
-        ('session', 'id', ''),
-        ('has_attachments', 'has_attachments', False),
-        ('callDuration', 'call_duration', 0),
-        ('dialerId', 'dialer_id', '-1'),
-        ('dialerName', 'dialer_name', ''),
-        ('intraEnterpriseCall', 'intra_enterprise_call', True),
-        ('reasonCallEnded', 'reason_call_ended', ''),
-        ('receiverId', 'receiver_id', '-1'),
-        ('receiverName', 'receiver_name', ''),
-        ('recordingStatus', 'recording_status', ''),
-        ('timestamp', 'timestamp', ''),
-        ('timeCallStarted', 'time_call_started', 0),
-        ('timeCallEnded', 'time_call_ended', 0)
-    ]
+    link_table_writer = TableWriter.open_table(base, 'calls_users', Resources.CALL_USER_COLUMNS, fmt)
+
+    with calls_writer, link_table_writer:
+        def write(page):
+            # verify at least one of the participant ids is in our user_ids list
+            page = [c for c in page if any(f'{p.id}' in user_ids for p in c.participants)]
+
+            # everything but the participants is a row of the calls table
+            calls_writer.writerows(c[:-1] for c in page)
+
+            # write out linking tables
+            link_table_writer.writerows(Resources.call_user_rows(page, enterprise_id))
+
+        # only the calls since the last run, if there was one
+        calls.each_page(write, start_date, shards)
+
+
+def go(zip_password, group_id, fetch_all, fmt='csv', page_size=50, shards=1, profile=False, cache_dir=None,
+       site=None, output_dir='.', session=None, limiter=None, logger=None, change_index=None,
+       codec=None, level=None, threads=None, volume_size=None):
+    # Export the site of siteconfig.py unless given one of its SITES
+    if site is None:
+        site = libhelplightning.Sites.default_site(siteconfig)
+
+    # Collect a profile of the whole run if asked to, the
+    #  profiler (and cProfile) is only loaded then
+    profiler = None
+    if profile:
+        profiler = libhelplightning.Profiler(True)
+        profiler.start()
+
+    def stage(name):
+        return profiler.stage(name) if profiler is not None else contextlib.nullcontext()
 
-    # Open csv files for writing user data
-    calls_csv = open(os.path.join(base, 'calls.csv'), 'w', newline='')
-    calls_users_csv = open(os.path.join(base, 'calls_users.csv'), 'w', newline='')
-
-    with calls_csv, calls_users_csv:
-        # Set up csv writers
-        calls_fieldnames = [p[1] for p in filter_params]
-        calls_writer = csv.DictWriter(calls_csv, calls_fieldnames)
-        calls_writer.writeheader()
-
-        link_table_fieldnames = ['id', 'call_id', 'user_id', 'name', 'isAnonymous', 'isExternal']
-        link_table_writer = csv.DictWriter(calls_users_csv, link_table_fieldnames)
-        link_table_writer.writeheader()
-
-        def cb(entries):
-            for e in entries:
-                # verify at least one of the participant ids is in our user_ids list
-                p_ids = [f'{x["id"]}' for x in e['participants']]
-                def any_ids(iterable, f):
-                    for element in iterable:
-                        if f(element):
-                            return True
-                    return False
-                if not any_ids(p_ids, lambda x: x in user_ids):
-                    # skip
-                    continue
-                
-                row = {}
-                for (p0, p1, default) in filter_params:
-                    if p0 in e:
-                        row[p1] = e[p0]
-                    else:
-                        row[p1] = default
-
-                calls_writer.writerow(row)
-
-                # write out linking tables
-                for participant in e['participants']:
-                    id = f'{e["session"]}_{participant["id"]}'
-                    row = {
-                        'id': id,
-                        'call_id': e['session'],
-                        'user_id': participant['id'],
-                        'name': participant['name'],
-                        'isAnonymous': participant['isAnonymous'],
-                        'isExternal': participant['enterpriseId'] != f'{enterprise_id}'
-                    }
-                    link_table_writer.writerow(row)
-
-            return []
-
-        e_client.get_all_cb(cb, url, params)
-
-
-def go(zip_password, group_id, fetch_all):
     # We'll write this timestamp out to a file at the end of the run
     utc_now = datetime.datetime.now(datetime.timezone.utc)
 
     # Set up the Help Lightning API client 
-    logger = get_logger(level=logging.INFO)
-    token = generate_token(siteconfig.PARTNER_KEY)
+    if logger is None:
+        logger = libhelplightning.Logging.setup(logging.INFO)
+    # Optionally cache responses between runs, so resources that
+    #  haven't changed cost a 304 (or nothing within their TTL)
+    cache = None
+    if cache_dir is not None:
+        cache = libhelplightning.ResponseCache(cache_dir, ttls = getattr(siteconfig, 'CACHE_TTLS', {}))
+
+    # Partner tokens are valid for an hour, so for long exports the
+    #  client signs a new one when the current one is about to expire
     e_client = libhelplightning.GaldrClient(
         logger,
-        siteconfig.HELPLIGHTNING_ENDPOINT,
-        siteconfig.API_KEY,
-        token = token
+        site.endpoint,
+        site.api_key,
+        token_provider = lambda: generate_token(site.partner_key, site.site_id),
+        page_size = page_size,
+        page_size_tuner = libhelplightning.PageSizeTuner(state_file=os.path.join(output_dir, 'page_sizes.json')),
+        cache = cache,
+        session = session,
+        limiter = limiter
     )
+    last_run_file = os.path.join(output_dir, 'last_run.json')
 
     if fetch_all:
         start_date = ''
@@ -331,7 +242,7 @@ def go(zip_password, group_id, fetch_all):
         # Look for last_run.json file and only pull data that has changed since the
         # last run, otherwise pull everything
         try:
-            with open('last_run.json', 'r') as f:
+            with open(last_run_file, 'r') as f:
                 last_run = json.load(f)
         except FileNotFoundError:
             # If we can't find a last_run file, the individual write_* functions
@@ -343,11 +254,21 @@ def go(zip_password, group_id, fetch_all):
             start_date = datetime.datetime.strptime(last_run_date,'%Y-%m-%dT%H:%M:%S.%fZ')
             start_date = start_date.replace(tzinfo = datetime.timezone.utc)
 
+    # Optionally only export the users and pods that changed
+    tracker = None
+    if change_index is not None:
+        tracker = libhelplightning.ChangeTracker(change_index, full=not start_date)
+
     # Make a temporary directory to store export files before they are archived
     with tempfile.TemporaryDirectory() as base:
-        user_ids = write_users(e_client, group_id, start_date, base)
-        write_pods(e_client, user_ids, start_date, base)
-        write_calls(e_client, siteconfig.SITE_ID, user_ids, start_date, base)
+        with stage('users'):
+            user_ids = write_users(e_client, group_id, start_date, base, fmt, tracker)
+        with stage('pods'):
+            write_pods(e_client, user_ids, start_date, base, fmt, tracker)
+            if tracker is not None:
+                tracker.write_deleted(base, fmt)
+        with stage('calls'):
+            write_calls(e_client, site.site_id, user_ids, start_date, base, fmt, shards)
 
         # Output an encrypted 7zip file
         timestamp = utc_now.strftime('%Y%m%dT%H:%M:%SZ')
@@ -355,20 +276,49 @@ def go(zip_password, group_id, fetch_all):
             filename = f'hl_export_partial_{timestamp}'
         else:
             filename = f'hl_export_full_{timestamp}'
+        filename = os.path.join(output_dir, filename)
 
-        os.system(f'7z a -p"{zip_password}" "{filename}.7z" "{base}"')
+        with stage('archive'):
+            archiver = libhelplightning.Archiver(zip_password, codec, level, threads, volume_size, logger)
+            archives = archiver.archive(base, filename)
 
-    # Calculate a checksum for the zip and write it to a checksum file
-    m = open(f'{filename}.md5', 'w')
-    z = open(f'{filename}.7z', 'rb')
-    with m, z:
-        checksum = hashlib.md5(z.read()).hexdigest()
-        m.write(checksum)
+    # Calculate a checksum for each archive and write it to a checksum file
+    with stage('checksum'):
+        archiver.checksum(archives)
+
+    # The next export only needs the changes since this one
+    if tracker is not None:
+        tracker.commit()
+        tracker.close()
+        logger.info(f'Changes: {tracker.summary()}')
 
     # Update last_run.json with the datetime of this run
-    with open('last_run.json', 'w') as f:
+    with open(last_run_file, 'w') as f:
         f.write(json.dumps({'timestamp': utc_now.strftime('%Y-%m-%dT%H:%M:%S.%fZ')}))
 
+    if cache is not None:
+        logger.info(f'Response cache: {cache.summary()}')
+
+    # Write the profile next to the archive
+    if profiler is not None:
+        profiler.stop()
+        print(profiler.write(filename))
+
+
+def go_sites(zip_password, group_id, fetch_all, sites, parallel=4, max_connections=16, max_rps=None, **options):
+    """
+    Exports the group of each of the `sites` (see Sites.load_sites)
+    to its own directory, `parallel` sites at once, like
+    export_data.go_sites(). A site's group_id in SITES overrides
+    the `group_id` given.
+    """
+    def export(site, **site_options):
+        go(zip_password, site.settings.get('group_id', group_id), fetch_all, site=site, **site_options)
+
+    logger = libhelplightning.Logging.setup(logging.INFO)
+    if libhelplightning.Sites.export_sites(sites, export, parallel, max_connections, max_rps, logger, **options):
+        sys.exit(1)
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -385,7 +335,96 @@ if __name__ == '__main__':
         action='store_true',
         help='Pull all data for all time'
     )
+    parser.add_argument(
+        '--format',
+        choices=TableWriter.FORMATS,
+        default='csv',
+        help='Output format of the exported tables (parquet and arrow require pyarrow)'
+    )
+    parser.add_argument(
+        '--page-size',
+        type=lambda v: v if v == 'auto' else int(v),
+        default=50,
+        help="Number of records per page, or 'auto' to tune the page size toward a target latency"
+    )
+    parser.add_argument(
+        '--shards',
+        type=int,
+        default=1,
+        help='Split the calls into this many time ranges and fetch them in parallel'
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Profile the run and write a flamegraph and a summary next to the archive'
+    )
+    parser.add_argument(
+        '--cache-dir',
+        help='Cache API responses in this directory and revalidate them on later runs'
+    )
+    parser.add_argument(
+        '--sites',
+        nargs='+',
+        metavar='NAME',
+        help='Export only these of the SITES in siteconfig.py (all of them by default)'
+    )
+    parser.add_argument(
+        '--parallel-sites',
+        type=int,
+        default=4,
+        help='Number of sites to export at once'
+    )
+    parser.add_argument(
+        '--max-connections',
+        type=int,
+        default=16,
+        help='Maximum connections to each API endpoint, shared by all the sites'
+    )
+    parser.add_argument(
+        '--max-rps',
+        type=float,
+        help='Maximum API requests a second, across all the sites'
+    )
+    parser.add_argument(
+        '--codec',
+        choices=libhelplightning.Archiver.CODECS,
+        help='Compression method of the archive (7z uses lzma2 by default)'
+    )
+    parser.add_argument(
+        '--level',
+        type=int,
+        choices=range(10),
+        metavar='0-9',
+        help='Compression level of the archive, from 0 (store) to 9 (ultra)'
+    )
+    parser.add_argument(
+        '--threads',
+        type=int,
+        help='Number of threads compressing the archive (all the cores by default)'
+    )
+    parser.add_argument(
+        '--volume-mb',
+        type=int,
+        help='Split the export into separate archives of about this many MB (before compression), '
+             'compressed in parallel, each with its own checksum'
+    )
+    parser.add_argument(
+        '--change-index',
+        help='Keep a hash of every user, pod and pod membership in this sqlite file, and only export '
+             'the ones that changed since the last run, plus a deleted table of the ones removed'
+    )
+    libhelplightning.Logging.add_arguments(parser)
 
     args = parser.parse_args()
-
-    go(args.zip_password, args.group_id, args.fetch_all)
+    libhelplightning.Logging.from_arguments(args)
+
+    try:
+        sites = libhelplightning.Sites.load_sites(siteconfig, args.sites)
+    except ValueError as e:
+        parser.error(str(e))
+
+    go_sites(args.zip_password, args.group_id, args.fetch_all, sites, args.parallel_sites, args.max_connections,
+             args.max_rps, fmt=args.format, page_size=args.page_size, shards=args.shards, profile=args.profile,
+             cache_dir=args.cache_dir, change_index=args.change_index,
+             codec=args.codec, level=args.level, threads=args.threads,
+             volume_size=args.volume_mb * 1024 * 1024 if args.volume_mb else None)
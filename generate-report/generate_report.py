@@ -1,15 +1,14 @@
 #!/usr/bin/env python3
 
 import argparse
+import contextlib
+import concurrent.futures
 import datetime
-import getpass
+import functools
 import json
-import jwt
 import logging
-import requests
+import os
 import sys
-import time
-import urllib
 
 try:
     sys.path.append('.')
@@ -20,20 +19,11 @@ except ImportError:
     import libhelplightning
     import siteconfig
 
-def get_logger(level=logging.DEBUG):
-    """
-    Sets up logging to be shared across
-    all classes/functions.
-    """
-    root = logging.getLogger()
-    root.setLevel(level)
-    ch = logging.StreamHandler(sys.stdout)
-    ch.setLevel(level)
-    root.addHandler(ch)
-    return root
+def generate_token(partner_key, site_id=None):
+    # jwt (and the cryptography backend behind it) is slow to
+    #  import, and only needed when signing a token
+    import jwt
 
-
-def generate_token(partner_key):
     # create a date that expires in 1 minutes
     # It is best to use tokens with short-expirations and generate
     #  them before each call. These cannot be revoked, so if you
@@ -46,10 +36,13 @@ def generate_token(partner_key):
     with open(partner_key) as f:
         secret = f.read()
 
+    if site_id is None:
+        site_id = siteconfig.SITE_ID
+
     # generate a new JWT token that will be valid for one hour and sign it with our secret
     payload = {
         'iss': 'Ghazal',
-        'sub': f'Partner:{siteconfig.SITE_ID}',
+        'sub': f'Partner:{site_id}',
         'aud': 'Ghazal',
         'exp': exp
     }
@@ -59,71 +52,172 @@ def generate_token(partner_key):
     return token
 
 def generate_report(client, csv):
-    report_url = '/v1r1/enterprise/reports/calls'
-    if not csv:
-        report_url = report_url + '.json'
+    report = libhelplightning.Resources.Reports(client).create(csv)
+    return report.uuid
 
-    r = client.post(report_url, {})
-    return r['uuid']
-
-def poll(partner_key, report_uuid):
-    logger = get_logger(level = logging.INFO)
+def poll(e_client, report_uuid, timeout):
     print('Waiting on report to complete: ', end = '', flush = True)
-    while True:
+
+    def on_poll():
         print('.', end = '', flush = True)
-        token = generate_token(partner_key)
-        e_client = libhelplightning.GaldrClient(
-            logger,
-            siteconfig.HELPLIGHTNING_ENDPOINT,
-            siteconfig.API_KEY,
-            token = token
-        )
-        r = e_client.get(f'/v1r1/enterprise/reports/calls/{report_uuid}')
-        if r['status'] == 'complete':
-            print('')
-            return r['url']
-        elif r['status'] == 'failed':
-            raise Exception('Report failed to generate!')
-        else:
-            time.sleep(5)
 
-def go(output, csv):
-    logger = get_logger(level = logging.INFO)
-    token = generate_token(siteconfig.PARTNER_KEY)
+    waiter = libhelplightning.ReportWaiter(e_client, timeout = timeout)
+    url = waiter.wait(report_uuid, on_poll = on_poll)
+    print('')
+    return url
+
+def go(output, csv, timeout, count_rows, profile=False):
+    # Collect a profile of the whole run if asked to, the
+    #  profiler (and cProfile) is only loaded then
+    profiler = None
+    if profile:
+        profiler = libhelplightning.Profiler(True)
+        profiler.start()
+
+    def stage(name):
+        return profiler.stage(name) if profiler is not None else contextlib.nullcontext()
+
+    logger = libhelplightning.Logging.setup(logging.INFO)
+    # our tokens are only valid for a minute, so the client
+    #  signs a fresh one whenever the current one is about to expire
     e_client = libhelplightning.GaldrClient(
         logger,
         siteconfig.HELPLIGHTNING_ENDPOINT,
         siteconfig.API_KEY,
-        token = token
+        token_provider = lambda: generate_token(siteconfig.PARTNER_KEY)
     )
 
     # start the generation of our report
-    report_uuid = generate_report(e_client, csv)
+    with stage('generate'):
+        report_uuid = generate_report(e_client, csv)
 
-    # now poll every 15 seconds to check if the report is done
-    url = poll(siteconfig.PARTNER_KEY, report_uuid)
+    # now poll (less often the longer it takes) to check if the report is done
+    with stage('poll'):
+        url = poll(e_client, report_uuid, timeout)
 
     print('Downloading')
-    u = urllib.parse.urlparse(url)
-    path = f'{u.scheme}://{u.hostname}{u.path}'
-    params = urllib.parse.parse_qs(u.query)
 
-    r = requests.get(path, params = params)
-    with open(output, 'wb') as f:
-        f.write(r.content)
+    def progress(done, total):
+        if total:
+            print(f'\r{done * 100 // total}% of {total} bytes', end = '', flush = True)
+        else:
+            print(f'\r{done} bytes', end = '', flush = True)
+
+    # stream it to disk (resuming if the connection drops)
+    with stage('download'):
+        libhelplightning.Downloader.download(url, output, progress = progress)
+    print('')
+
+    if count_rows:
+        with stage('count rows'):
+            rows = sum(1 for _ in libhelplightning.ReportReader(output))
+        print(f'The report has {rows} rows')
+
+    # Write the profile next to the report
+    if profiler is not None:
+        profiler.stop()
+        print(profiler.write(os.path.splitext(output)[0]))
+
+def go_batch(batch_file, timeout):
+    """
+    Generates every report listed in `batch_file` at once. The
+    reports are all requested up front, polled together, and each
+    one is downloaded as soon as it is ready.
+    """
+    logger = libhelplightning.Logging.setup(logging.INFO)
+    with open(batch_file) as f:
+        jobs = json.load(f)
+
+    # Each job can override the site settings from siteconfig
+    for job in jobs:
+        job['site_id'] = job.get('site_id', siteconfig.SITE_ID)
+        job['partner_key'] = job.get('partner_key', siteconfig.PARTNER_KEY)
+        job['client'] = libhelplightning.GaldrClient(
+            logger,
+            job.get('endpoint', siteconfig.HELPLIGHTNING_ENDPOINT),
+            job.get('api_key', siteconfig.API_KEY),
+            token_provider = functools.partial(generate_token, job['partner_key'], job['site_id'])
+        )
+
+    failed = []
+
+    def on_failed(job, e):
+        print(f'Failed to generate {job["output"]}: {e}')
+        failed.append(job['output'])
+
+    # start the generation of all of the reports, a report that
+    #  can't be created doesn't stop the others
+    batch = libhelplightning.ReportBatch(timeout = timeout)
+    with concurrent.futures.ThreadPoolExecutor(max_workers = 8) as pool:
+        futures = [pool.submit(generate_report, job['client'], job.get('csv', False)) for job in jobs]
+        for (job, f) in zip(jobs, futures):
+            try:
+                report_uuid = f.result()
+            except Exception as e:
+                on_failed(job, e)
+                continue
+            print(f'Requested report {report_uuid} for {job["output"]}')
+            batch.add(job['client'], report_uuid, context = job)
+
+    def download(job, url):
+        try:
+            libhelplightning.Downloader.download(url, job['output'])
+            print(f'Downloaded {job["output"]}')
+        except Exception as e:
+            print(f'Failed to download {job["output"]}: {e}')
+            failed.append(job['output'])
+
+    # the downloads run in the background while we keep polling
+    with concurrent.futures.ThreadPoolExecutor(max_workers = 4) as downloads:
+        def on_complete(job, url):
+            print(f'Report for {job["output"]} is ready, downloading')
+            downloads.submit(download, job, url)
+
+        batch.run(on_complete, on_failed)
+
+    if failed:
+        sys.exit(f'{len(failed)} of {len(jobs)} reports failed')
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument(
         'output',
+        nargs='?',
         help='The name of the output file to generate (will be a zip file)'
     )
+    parser.add_argument(
+        '--batch',
+        help='A json file listing many reports to generate at once (see the README)'
+    )
     parser.add_argument(
         '--csv',
         action='store_true',
         help='Generate a CSV report (Default is JSON)'
     )
+    parser.add_argument(
+        '--timeout',
+        type=int,
+        default=60 * 60,
+        help='Give up if the report is not ready after this many seconds (Default is 3600)'
+    )
+    parser.add_argument(
+        '--count-rows',
+        action='store_true',
+        help='Read the downloaded report and print how many rows it has'
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Profile the run and write a flamegraph and a summary next to the report'
+    )
+    libhelplightning.Logging.add_arguments(parser)
 
     args = parser.parse_args()
-
-    go(args.output, args.csv)
+    libhelplightning.Logging.from_arguments(args)
+
+    if args.batch:
+        go_batch(args.batch, args.timeout)
+    elif args.output:
+        go(args.output, args.csv, args.timeout, args.count_rows, args.profile)
+    else:
+        parser.error('either an output file or --batch is required')
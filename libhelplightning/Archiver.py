@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+#
+# Compresses an export into encrypted 7-Zip archives. Large
+#  exports can be split into volumes of a bounded size, which
+#  are compressed in parallel and each get a checksum.
+
+import concurrent.futures
+import hashlib
+import os
+import subprocess
+
+SEVEN_ZIP = '7z'
+
+# Bytes read at a time when checksumming or splitting
+CHUNK_SIZE = 1024 * 1024
+
+
+def md5_file(path):
+    """
+    The md5 of a file, read a chunk at a time.
+    """
+    m = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            m.update(chunk)
+    return m.hexdigest()
+
+
+def split_csv(path, max_size):
+    """
+    Splits a csv file into parts of about max_size bytes, each
+    starting with the header row, and returns their paths. Rows
+    are never split, even when a quoted field spans lines.
+    """
+    (root, ext) = os.path.splitext(path)
+    parts = []
+    out = None
+    with open(path, 'rb') as f:
+        header = f.readline()
+        row = b''
+        for line in f:
+            row += line
+            # an odd number of quotes leaves a quoted field open
+            if row.count(b'"') % 2:
+                continue
+            if out is None or out.tell() + len(row) > max_size:
+                if out is not None:
+                    out.close()
+                parts.append(f'{root}.part{len(parts) + 1:03d}{ext}')
+                out = open(parts[-1], 'wb')
+                out.write(header)
+            out.write(row)
+            row = b''
+    if row:
+        # a quote left open at the end of the file
+        if out is None:
+            parts.append(f'{root}.part{len(parts) + 1:03d}{ext}')
+            out = open(parts[-1], 'wb')
+            out.write(header)
+        out.write(row)
+    if out is not None:
+        out.close()
+    else:
+        # only a header, keep the file as it is
+        return [path]
+    os.remove(path)
+    return parts
+
+
+class Archiver:
+    '''
+    Runs 7z to compress a directory into `filename`.7z, with the
+    given codec, compression level (0-9) and threads. Without a
+    volume_size everything goes in that one archive, as before.
+
+    With a volume_size (in bytes, before compression) the files are
+    packed into volumes `filename`_001.7z, `filename`_002.7z, ... of
+    about that size, splitting csv files that are larger (repeating
+    their header). Each volume is a complete archive of its own, so
+    they can be uploaded, verified and extracted one at a time, and
+    they are compressed in parallel, sharing the threads.
+    '''
+    # The -m0 methods of 7z
+    CODECS = ['lzma2', 'lzma', 'ppmd', 'bzip2', 'deflate', 'copy']
+
+    def __init__(self, password, codec=None, level=None, threads=None, volume_size=None, logger=None):
+        self.password = password
+        self.codec = codec
+        self.level = level
+        self.threads = threads or os.cpu_count() or 1
+        self.volume_size = volume_size
+        self.lg = logger
+
+    def archive(self, base, filename):
+        """
+        Compresses the files in `base`, and returns the paths
+        of the archives written.
+        """
+        if self.volume_size is None:
+            output = f'{filename}.7z'
+            self._compress(output, [base], self.threads)
+            return [output]
+
+        volumes = self.volumes(base)
+        paths = [f'{filename}_{i + 1:03d}.7z' for i in range(len(volumes))]
+        workers = max(1, min(len(volumes), self.threads))
+        threads = max(1, self.threads // workers)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            # 7z runs in `base`, so the files are stored without it
+            futures = [
+                pool.submit(self._compress, os.path.abspath(path), files, threads, base)
+                for (path, files) in zip(paths, volumes)
+            ]
+            for f in futures:
+                f.result()
+        return paths
+
+    def volumes(self, base):
+        """
+        Packs the files in `base` into lists of files of at most
+        volume_size bytes (unless a file can't be split), in the
+        order of their names.
+        """
+        files = []
+        for name in sorted(os.listdir(base)):
+            path = os.path.join(base, name)
+            if name.endswith('.csv') and os.path.getsize(path) > self.volume_size:
+                files.extend(os.path.basename(p) for p in split_csv(path, self.volume_size))
+            else:
+                files.append(name)
+
+        volumes = []
+        size = 0
+        for name in files:
+            file_size = os.path.getsize(os.path.join(base, name))
+            if not volumes or size + file_size > self.volume_size:
+                volumes.append([])
+                size = 0
+            volumes[-1].append(name)
+            size += file_size
+        return volumes
+
+    def checksum(self, paths):
+        """
+        Writes the md5 of each archive next to it, in parallel.
+        """
+        def write(path):
+            checksum = md5_file(path)
+            with open(os.path.splitext(path)[0] + '.md5', 'w') as m:
+                m.write(checksum)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(len(paths), self.threads))) as pool:
+            for f in [pool.submit(write, p) for p in paths]:
+                f.result()
+
+    def _compress(self, output, files, threads, cwd=None):
+        command = [SEVEN_ZIP, 'a', '-bd', f'-p{self.password}', f'-mmt={threads}']
+        if self.codec is not None:
+            command.append(f'-m0={self.codec}')
+        if self.level is not None:
+            command.append(f'-mx={self.level}')
+        command += [output, *files]
+
+        r = subprocess.run(command, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        if r.returncode != 0:
+            raise RuntimeError(f'7z failed to create {output}: {r.stdout.decode(errors="replace").strip()}')
+        if self.lg is not None:
+            self.lg.info(f'Wrote {output} ({os.path.getsize(output)} bytes)')
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+#
+# A content-addressed store for downloaded files. Each file
+#  is stored once under the sha256 of its content, and the
+#  paths it is known by are links to that one copy.
+
+import os
+import sqlite3
+import threading
+import uuid
+
+from . import Downloader
+
+
+class BlobStore:
+    '''
+    Blobs live in root/blobs/ab/cd/<sha256>, and are hashed while
+    they are downloaded, so a file that is downloaded again under
+    another key (the same attachment in two calls, or a duplicate
+    webhook) only takes up space once.
+
+    An index maps each key to the blob it was stored as, with the
+    size and etag it had, so find() can tell that a file is
+    already stored without downloading it. The paths files are
+    saved to are hardlinks to their blob, or symlinks with
+    link='symlink' (or if root is on another filesystem).
+    '''
+    def __init__(self, root, link='hardlink'):
+        if link not in ('hardlink', 'symlink'):
+            raise ValueError(f'Unknown link type {link}')
+        self.root = root
+        self.link_type = link
+        self.lock = threading.Lock()
+        self.stored = 0
+        self.deduplicated = 0
+        self.skipped = 0
+
+        os.makedirs(os.path.join(root, 'tmp'), exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(root, 'index.sqlite'), check_same_thread=False)
+        with self.db:
+            self.db.execute('''
+                CREATE TABLE IF NOT EXISTS blobs (
+                    hash TEXT PRIMARY KEY,
+                    size INTEGER
+                )
+            ''')
+            self.db.execute('''
+                CREATE TABLE IF NOT EXISTS keys (
+                    key TEXT PRIMARY KEY,
+                    hash TEXT,
+                    size INTEGER,
+                    etag TEXT
+                )
+            ''')
+
+    def blob_path(self, blob_hash):
+        return os.path.join(self.root, 'blobs', blob_hash[:2], blob_hash[2:4], blob_hash)
+
+    def find(self, key, size=None, etag=None):
+        """
+        The hash of the blob stored for `key`, or None if there is
+        none, or if the size or etag given don't match the stored
+        ones (so the file has changed).
+        """
+        with self.lock:
+            row = self.db.execute('SELECT hash, size, etag FROM keys WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        (blob_hash, stored_size, stored_etag) = row
+        if size is not None and size != stored_size:
+            return None
+        if etag is not None and stored_etag is not None and etag != stored_etag:
+            return None
+        if not os.path.exists(self.blob_path(blob_hash)):
+            return None
+        return blob_hash
+
+    def fetch(self, url, key, path, size=None, etag=None, session=None, limiter=None):
+        """
+        Saves `url` to `path` as a link to its blob, downloading
+        it unless find() says `key` is already stored. Returns
+        (hash, downloaded).
+        """
+        blob_hash = self.reuse(key, path, size, etag)
+        if blob_hash is not None:
+            return (blob_hash, False)
+
+        tmp = self.tmp_path()
+        try:
+            blob_hash = Downloader.download_hashed(url, tmp, session=session, limiter=limiter)
+            self.put(tmp, blob_hash, key, etag)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self.link(blob_hash, path)
+        return (blob_hash, True)
+
+    def reuse(self, key, path, size=None, etag=None):
+        """
+        Links `path` to the blob stored for `key` and returns its
+        hash, or returns None if it has to be downloaded.
+        """
+        blob_hash = self.find(key, size, etag)
+        if blob_hash is not None:
+            self.link(blob_hash, path)
+            with self.lock:
+                self.skipped += 1
+        return blob_hash
+
+    def tmp_path(self):
+        """
+        A new file name to download a blob to before put().
+        """
+        return os.path.join(self.root, 'tmp', uuid.uuid4().hex)
+
+    def put(self, filename, blob_hash, key, etag=None):
+        """
+        Moves `filename`, whose sha256 is `blob_hash`, into the
+        store as the blob for `key`.
+        """
+        blob = self.blob_path(blob_hash)
+        size = os.path.getsize(filename)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        try:
+            # only creates the blob if there is none yet, so a blob
+            #  that paths are already linked to is never replaced
+            os.link(filename, blob)
+            deduplicated = False
+        except FileExistsError:
+            deduplicated = True
+        except OSError:
+            # no hardlinks on this filesystem
+            with self.lock:
+                deduplicated = os.path.exists(blob)
+                if not deduplicated:
+                    os.replace(filename, blob)
+        if os.path.exists(filename):
+            os.remove(filename)
+
+        with self.lock, self.db:
+            self.db.execute('INSERT OR IGNORE INTO blobs VALUES (?, ?)', (blob_hash, size))
+            self.db.execute('INSERT OR REPLACE INTO keys VALUES (?, ?, ?, ?)', (key, blob_hash, size, etag))
+            if deduplicated:
+                self.deduplicated += 1
+            else:
+                self.stored += 1
+
+    def link(self, blob_hash, path):
+        """
+        Points `path` at a blob, replacing whatever is there.
+        """
+        blob = self.blob_path(blob_hash)
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        if self.link_type == 'hardlink' and os.path.exists(path) and os.path.samefile(blob, path):
+            return
+
+        tmp = os.path.join(directory, f'.{uuid.uuid4().hex}.link')
+        if self.link_type == 'hardlink':
+            try:
+                os.link(blob, tmp)
+            except OSError:
+                # another filesystem, or no hardlinks
+                self.link_type = 'symlink'
+        if self.link_type == 'symlink':
+            os.symlink(os.path.relpath(blob, directory), tmp)
+        os.replace(tmp, path)
+
+    def summary(self):
+        with self.lock:
+            (blobs, size) = self.db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs').fetchone()
+            (keys, key_size) = self.db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM keys').fetchone()
+        return (f'{self.stored} stored, {self.deduplicated} deduplicated, {self.skipped} already stored; '
+                f'{keys} files in {blobs} blobs, {size / (1024 * 1024):.1f} MB '
+                f'({key_size / (1024 * 1024):.1f} MB without deduplication)')
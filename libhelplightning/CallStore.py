@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+#
+# A sqlite copy of the calls and calls_users tables of the
+#  export, kept current by upserting calls as they change.
+
+import sqlite3
+import threading
+import time
+
+from . import Resources
+
+
+class CallStore:
+    '''
+    The calls and calls_users tables, with the same columns as the
+    export, plus the time each call was last fetched (fetched_at).
+    Upserting a call replaces its row and its participants, so the
+    same call can be upserted any number of times.
+    '''
+    def __init__(self, path, enterprise_id):
+        self.enterprise_id = enterprise_id
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+
+        columns = ', '.join(f'"{c}"' for c in Resources.CALL_COLUMNS[1:])
+        user_columns = ', '.join(f'"{c}"' for c in Resources.CALL_USER_COLUMNS[1:])
+        with self.db:
+            self.db.execute(f'CREATE TABLE IF NOT EXISTS calls (id TEXT PRIMARY KEY, {columns}, fetched_at REAL)')
+            self.db.execute(f'CREATE TABLE IF NOT EXISTS calls_users (id TEXT PRIMARY KEY, {user_columns})')
+            self.db.execute('CREATE INDEX IF NOT EXISTS calls_users_call_id ON calls_users (call_id)')
+
+        self.insert_call = 'INSERT OR REPLACE INTO calls VALUES ({})'.format(
+            ', '.join('?' * (len(Resources.CALL_COLUMNS) + 1))
+        )
+        self.insert_call_user = 'INSERT OR REPLACE INTO calls_users VALUES ({})'.format(
+            ', '.join('?' * len(Resources.CALL_USER_COLUMNS))
+        )
+
+    def upsert(self, calls):
+        """
+        Inserts or replaces Resources.Call records, all in one
+        transaction.
+        """
+        calls = list(calls)
+        now = time.time()
+        with self.lock, self.db:
+            self.db.executemany(self.insert_call, ((*c[:-1], now) for c in calls))
+            # a participant may have left the call since it was stored
+            self.db.executemany('DELETE FROM calls_users WHERE call_id = ?', ((c.id,) for c in calls))
+            self.db.executemany(self.insert_call_user, Resources.call_user_rows(calls, self.enterprise_id))
+        return len(calls)
+
+    def count(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM calls').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+#
+# A one-shot local web server that receives the token at the
+#  end of the OAuth 2 login flow. It is only imported when a
+#  user logs in with OAuth 2.
+
+import http.server
+import urllib.parse
+
+
+class OAuthCallbackHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        req_url = urllib.parse.urlsplit(self.path)
+        if req_url.path == '/callback':
+            params = urllib.parse.parse_qs(req_url.query)
+            if params['state'][0] !=  self.server.state:
+                raise ValueError(f"Generated OAuth 2 state doesn't match returned state!")
+            self.send_success()
+            self.server.token = params['primary_token'][0]
+        else:
+            self.send_error(404)
+            raise ValueError(f'Request path {req_url.path} not recognized')
+
+    def send_success(self):
+        self.send_response(200)
+        self.send_header('Content-type', 'text/html')
+        self.end_headers()
+        msg = '''
+<!DOCTYPE html>
+<html>
+  <body>
+    <h1>You may close this window.</h1>
+  </body>
+</html>
+'''
+        self.wfile.write(bytes(msg, "utf-8"))
+
+    def log_request(self, code='-', size='-'):
+        # Don't log incoming requests to stdout
+        pass
+
+class CallbackServer(http.server.HTTPServer):
+    def __init__(self, host, port, state, handler):
+        super().__init__((host, port), handler)
+        self.state = state
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+#
+# Remembers a hash of every row an export wrote, so the next
+#  export only writes the rows that were inserted, updated or
+#  deleted since.
+
+import hashlib
+import sqlite3
+import threading
+
+from . import TableWriter
+
+# Rows looked up per query
+BATCH_SIZE = 500
+
+
+def row_hash(row):
+    return hashlib.blake2b(repr(tuple(row)).encode('utf-8'), digest_size=16).digest()
+
+
+class ChangeTracker:
+    '''
+    A sqlite index of the id (the first column) and the hash of
+    every row exported, per table. changes() drops the rows that
+    are the same as last time, and collects the ids of the rows
+    that are gone, which are written to a `deleted` table.
+
+    The changes only become the new baseline on commit(), once
+    the export has been archived, so a failed export is redone
+    in full by the next one.
+
+    In a `full` export every row is written, and any row of a
+    tracked table that wasn't seen is deleted.
+    '''
+    # Columns of the table of deleted rows (tombstones)
+    DELETED_COLUMNS = ['table', 'id']
+
+    def __init__(self, path, full=False):
+        self.full = full
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS rows (tbl TEXT, id TEXT, scope TEXT, hash BLOB, PRIMARY KEY (tbl, id))')
+            self.db.execute('CREATE INDEX IF NOT EXISTS rows_scope ON rows (tbl, scope)')
+
+        # table -> ids seen, for finding the deleted rows of a full export
+        self.seen = {}
+        self.deleted = []
+        self.counts = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0}
+
+    def changes(self, table, rows, scope=None):
+        """
+        The rows of `table` that are new or changed. With a `scope`
+        (e.g. the pod of a pod's members), `rows` are all of the
+        rows of that scope, and the ones it had before that are
+        missing are deleted.
+        """
+        rows = list(rows)
+        scope = str(scope) if scope is not None else None
+        with self.lock:
+            seen = self.seen.setdefault(table, set())
+            if scope is not None:
+                stored = dict(self.db.execute('SELECT id, hash FROM rows WHERE tbl = ? AND scope = ?', (table, scope)))
+            else:
+                stored = self._lookup(table, [str(r[0]) for r in rows])
+
+            changed = []
+            upserts = []
+            ids = set()
+            for row in rows:
+                row_id = str(row[0])
+                h = row_hash(row)
+                ids.add(row_id)
+                old = stored.get(row_id)
+                if old == h:
+                    self.counts['unchanged'] += 1
+                    if self.full:
+                        changed.append(row)
+                    continue
+                self.counts['updated' if old is not None else 'inserted'] += 1
+                changed.append(row)
+                upserts.append((table, row_id, scope, h))
+            seen.update(ids)
+
+            self.db.executemany('INSERT OR REPLACE INTO rows VALUES (?, ?, ?, ?)', upserts)
+            if scope is not None:
+                self._delete(table, [i for i in stored if i not in ids])
+            return changed
+
+    def finish(self):
+        """
+        Deletes the rows a full export didn't see, and returns
+        the (table, id) rows of everything deleted.
+        """
+        with self.lock:
+            if self.full:
+                for (table, seen) in self.seen.items():
+                    missing = [i for (i,) in self.db.execute('SELECT id FROM rows WHERE tbl = ?', (table,))
+                               if i not in seen]
+                    self._delete(table, missing)
+            return list(self.deleted)
+
+    def write_deleted(self, base, fmt='csv'):
+        """
+        Writes the (table, id) of every row deleted since the last
+        export to the `deleted` table in `base`.
+        """
+        with TableWriter.open_table(base, 'deleted', self.DELETED_COLUMNS, fmt) as writer:
+            writer.writerows(self.finish())
+
+    def commit(self):
+        with self.lock:
+            self.db.commit()
+
+    def close(self):
+        """
+        Closes the index, dropping any changes not committed.
+        """
+        with self.lock:
+            self.db.close()
+
+    def summary(self):
+        return ', '.join(f'{n} {k}' for (k, n) in self.counts.items())
+
+    def _lookup(self, table, ids):
+        stored = {}
+        for i in range(0, len(ids), BATCH_SIZE):
+            batch = ids[i:i + BATCH_SIZE]
+            stored.update(self.db.execute(
+                'SELECT id, hash FROM rows WHERE tbl = ? AND id IN ({})'.format(', '.join('?' * len(batch))),
+                (table, *batch)
+            ))
+        return stored
+
+    def _delete(self, table, ids):
+        self.db.executemany('DELETE FROM rows WHERE tbl = ? AND id = ?', ((table, i) for i in ids))
+        self.deleted.extend((table, i) for i in ids)
+        self.counts['deleted'] += len(ids)
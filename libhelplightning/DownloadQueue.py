@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+#
+# A queue of attachment downloads that is ordered by priority
+#  and size, so a few large recordings can't hold up the
+#  small files queued behind them.
+
+import collections
+import heapq
+import itertools
+import threading
+import urllib.parse
+
+SMALL = 'small'
+LARGE = 'large'
+
+
+class DownloadQueue:
+    '''
+    Jobs are taken in order of priority (lower first), then in the
+    order they were put. A job is a webhook payload, and once its
+    attachment has been looked up (job['resolved']) it is classed
+    as SMALL or LARGE by its size, or its content type if the size
+    is unknown:
+    - take(small_only=True) only returns small jobs, and jobs still
+      to be resolved, so the workers reserved for small files never
+      start a large download
+    - at most max_large_per_host large downloads run at once per
+      host serving the files
+
+    Each job taken must be finished with done(), or put back in its
+    place in line with requeue() (after resolving it). It is thread
+    safe, and get() blocks until a job can be taken.
+    '''
+    # Priorities of the producers: attachments announced by a
+    #  webhook go ahead of the ones a backfill finds
+    WEBHOOK = 0
+    BACKFILL = 10
+    def __init__(self, small_file_size=16 * 1024 * 1024, max_large_per_host=4):
+        self.small_file_size = small_file_size
+        self.max_large_per_host = max_large_per_host
+        self.cond = threading.Condition()
+        self.order = itertools.count()
+        self.unresolved = []
+        self.small = []
+        # host -> heap of large jobs
+        self.large = collections.defaultdict(list)
+        self.running_large = collections.Counter()
+        # id(job) -> (priority, order, size class, host) of the jobs taken
+        self.taken = {}
+        self.unfinished = 0
+
+    def classify(self, attachment):
+        """
+        The (size class, host) of an attachment.
+        """
+        host = urllib.parse.urlsplit(attachment.signed_url or '').netloc
+        if attachment.size is not None:
+            small = attachment.size <= self.small_file_size
+        else:
+            small = (attachment.content_type or '').startswith('image/')
+        return (SMALL if small else LARGE, host)
+
+    def put(self, job, priority=0):
+        with self.cond:
+            self.unfinished += 1
+            self._push(job, priority, next(self.order))
+            self.cond.notify_all()
+
+    def requeue(self, job):
+        with self.cond:
+            (priority, order, size_class, host) = self._release(job)
+            self._push(job, priority, order)
+            self.cond.notify_all()
+
+    def done(self, job):
+        with self.cond:
+            self._release(job)
+            self.unfinished -= 1
+            self.cond.notify_all()
+
+    def take(self, small_only=False):
+        """
+        The next job this worker can run, or None.
+        """
+        with self.cond:
+            heaps = [self.unresolved, self.small]
+            if not small_only:
+                heaps += [h for (host, h) in self.large.items()
+                          if self.running_large[host] < self.max_large_per_host]
+            heaps = [h for h in heaps if h]
+            if not heaps:
+                return None
+
+            heap = min(heaps, key=lambda h: h[0][:2])
+            (priority, order, job, size_class, host) = heapq.heappop(heap)
+            if size_class == LARGE:
+                self.running_large[host] += 1
+            self.taken[id(job)] = (priority, order, size_class, host)
+            return job
+
+    def get(self, small_only=False, timeout=None):
+        """
+        Blocks until a job can be taken, and returns it, or
+        None after `timeout` seconds.
+        """
+        with self.cond:
+            job = self.take(small_only)
+            if job is None and self.cond.wait_for(lambda: self._can_take(small_only), timeout):
+                job = self.take(small_only)
+            return job
+
+    def qsize(self):
+        with self.cond:
+            return len(self.unresolved) + len(self.small) + sum(len(h) for h in self.large.values())
+
+    def join(self):
+        """
+        Blocks until every job put has been done.
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: self.unfinished == 0)
+
+    def _can_take(self, small_only):
+        if self.unresolved or self.small:
+            return True
+        return not small_only and any(
+            h and self.running_large[host] < self.max_large_per_host for (host, h) in self.large.items()
+        )
+
+    def _push(self, job, priority, order):
+        attachment = job.get('resolved')
+        if attachment is None:
+            heapq.heappush(self.unresolved, (priority, order, job, None, None))
+            return
+        (size_class, host) = self.classify(attachment)
+        heap = self.small if size_class == SMALL else self.large[host]
+        heapq.heappush(heap, (priority, order, job, size_class, host))
+
+    def _release(self, job):
+        taken = self.taken.pop(id(job))
+        (priority, order, size_class, host) = taken
+        if size_class == LARGE:
+            self.running_large[host] -= 1
+        return taken
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+#
+# Streams large downloads (reports, attachments) straight
+#  to disk. Partial downloads are kept next to the output
+#  file and resumed with a Range request.
+
+import hashlib
+import os
+import re
+import tempfile
+
+import requests
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def download(url, output, chunk_size=CHUNK_SIZE, progress=None, resume=False, retries=3, session=None, timeout=60,
+             limiter=None):
+    """
+    Downloads `url` into `output`. The data is written to a
+    .part file of its own next to `output`, and renamed to
+    `output` once complete, so `output` never holds a partial
+    file, and downloads to the same `output` can run at once.
+
+    If the connection drops, the download is resumed with a
+    Range request, up to `retries` times. With `resume` set, the
+    data is written to `output`.part instead, and one left over
+    from an earlier call for the same url is resumed too.
+
+    `progress` is called with (bytes_done, bytes_total) after every
+    chunk, where bytes_total is None if the server didn't say,
+    or sent the data compressed.
+    The url is used as is, so signed urls stay intact.
+
+    `limiter` is an optional RateLimiter of bytes a second, which
+    can be shared to cap the bandwidth of several downloads.
+    """
+    _download(url, output, chunk_size, progress, resume, retries, session, timeout, limiter)
+    return output
+
+
+def download_hashed(url, output, algorithm='sha256', chunk_size=CHUNK_SIZE, progress=None, resume=False,
+                    retries=3, session=None, timeout=60, limiter=None):
+    """
+    Like download(), but also hashes the data while it is
+    written, and returns the hex digest of the file.
+    """
+    digest = _Digest(algorithm)
+    _download(url, output, chunk_size, progress, resume, retries, session, timeout, limiter, digest)
+    return digest.hash.hexdigest()
+
+
+def _download(url, output, chunk_size, progress, resume, retries, session, timeout, limiter, digest=None):
+    if resume:
+        # the part of an earlier call can only be found by its name
+        part = output + '.part'
+    else:
+        (fd, part) = tempfile.mkstemp(suffix='.part', prefix=os.path.basename(output) + '.',
+                                      dir=os.path.dirname(output) or '.')
+        os.close(fd)
+
+    try:
+        attempt = 0
+        while True:
+            try:
+                _download_part(url, part, chunk_size, progress, session, timeout, limiter, digest)
+                break
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.Timeout):
+                attempt += 1
+                if attempt > retries:
+                    raise
+    except BaseException:
+        # nothing else will ever resume a part of its own
+        if not resume and os.path.exists(part):
+            os.remove(part)
+        raise
+
+    os.replace(part, output)
+
+
+def _download_part(url, part, chunk_size, progress, session, timeout, limiter, digest):
+    """
+    Appends the rest of `url` to the `part` file.
+    """
+    offset = 0
+    if os.path.exists(part):
+        offset = os.path.getsize(part)
+
+    headers = {}
+    if offset:
+        headers['Range'] = f'bytes={offset}-'
+
+    get = session.get if session is not None else requests.get
+    with get(url, headers=headers, stream=True, timeout=timeout) as r:
+        if offset and r.status_code == 416 and _content_range_total(r) == offset:
+            # the .part file already holds the whole file
+            if digest is not None:
+                digest.catch_up(part, offset)
+            return
+        r.raise_for_status()
+
+        if offset and r.status_code == 206:
+            mode = 'ab'
+        else:
+            # the server ignored our Range, start over
+            mode = 'wb'
+            offset = 0
+
+        if digest is not None:
+            digest.catch_up(part, offset)
+
+        # Content-Length counts the bytes sent, which are fewer
+        #  than the bytes written if they are compressed (gzip)
+        length = None
+        if 'Content-Length' in r.headers:
+            length = int(r.headers['Content-Length'])
+        encoded = r.headers.get('Content-Encoding', 'identity') != 'identity'
+        total = offset + length if length is not None and not encoded else None
+
+        with open(part, mode) as f:
+            for chunk in r.iter_content(chunk_size):
+                f.write(chunk)
+                offset += len(chunk)
+                if digest is not None:
+                    digest.update(chunk)
+                if limiter is not None:
+                    limiter.acquire(len(chunk))
+                if progress is not None:
+                    progress(offset, total)
+
+        received = r.raw.tell()
+        if length is not None and received != length:
+            raise requests.exceptions.ChunkedEncodingError(f'Download stopped after {received} of {length} bytes')
+
+
+class _Digest:
+    '''
+    The hash of a .part file, kept up to date as it is written
+    to, restarted and resumed.
+    '''
+    def __init__(self, algorithm):
+        self.algorithm = algorithm
+        self.restart()
+
+    def restart(self):
+        self.hash = hashlib.new(self.algorithm)
+        self.size = 0
+
+    def update(self, chunk):
+        self.hash.update(chunk)
+        self.size += len(chunk)
+
+    def catch_up(self, part, offset):
+        """
+        Makes the hash cover the first `offset` bytes of `part`,
+        which were written before this attempt.
+        """
+        if offset < self.size:
+            self.restart()
+        if offset == self.size:
+            return
+        with open(part, 'rb') as f:
+            f.seek(self.size)
+            while self.size < offset:
+                chunk = f.read(min(CHUNK_SIZE, offset - self.size))
+                if not chunk:
+                    break
+                self.update(chunk)
+
+
+def _content_range_total(r):
+    m = re.match(r'bytes \*/(\d+)', r.headers.get('Content-Range', ''))
+    if m is None:
+        return None
+    return int(m.group(1))
@@ -4,40 +4,80 @@
 #  and writes them to the analytics db.
 
 import requests
+import email.utils
 import json
-import csv
+import logging
 import urllib.parse
-import http.server
-import webbrowser
-import base64
-import hashlib
 import os
-import webbrowser
-import getpass
 import sys
+import threading
+import time
+
+from .JsonDecoder import JsonDecoder
+from .Logging import REQUESTS_LOGGER
+from .PageSizeTuner import PageSizeTuner
 
 OAUTH_REDIRECT_PORT = 56824
 OAUTH_REDIRECT_PATH = '/callback'
 
+# Failed pages are retried after 1, 2, 4, ... seconds, up to this
+#  long (or after the Retry-After of a 429)
+MAX_RETRY_DELAY = 60
+
 class GaldrClient:
-    def __init__(self, logger, url, api_key, username=None, password=None, token=None, refreshToken=None):
+    def __init__(self, logger, url, api_key, username=None, password=None, token=None, refreshToken=None, json_backend='auto',
+                 page_size=50, page_size_tuner=None, cache=None, token_provider=None, token_refresh_margin=30,
+                 session=None, limiter=None):
         self.lg = logger
         self.url = url
         self.base_url = self._get_base_url(url)
         self.api_key = api_key
+        self.json = JsonDecoder(json_backend)
+
+        # page_size may be 'auto' to tune the page size per endpoint
+        self.page_size = page_size
+        if page_size_tuner is None:
+            page_size_tuner = PageSizeTuner()
+        self.page_size_tuner = page_size_tuner
+
+        # an optional ResponseCache for GET requests
+        self.cache = cache
+
+        # Requests go through `session` (a requests.Session, which may
+        #  be shared with other clients of the same endpoint to reuse
+        #  its connections), and each takes a unit from `limiter` (a
+        #  RateLimiter, which may be shared to cap the request rate)
+        self.http = session if session is not None else requests
+        self.limiter = limiter
+        # every request is logged here at DEBUG (see Logging.setup)
+        self.request_log = logging.getLogger(REQUESTS_LOGGER)
+
+        # Where new tokens come from when the current one expires:
+        #  token_provider() (e.g. signing a partner token), the
+        #  refresh token, or the password
+        self.token_provider = token_provider
+        self.token_refresh_margin = token_refresh_margin
+        self._refresh_token = None
+        self._username = None
+        self._password = None
+        self._auth_lock = threading.Lock()
+        self._claims = (None, {})
+
         if token is not None:
             self.token = token
+        elif token_provider is not None:
+            self.token = token_provider()
         elif refreshToken is not None:
             self.token = self.refresh_token(refreshToken)
         elif username is not None:
             r = self._federate(username)
             auth_provider = r['type']
             if auth_provider == 'password':
-                if password is not None:
-                    self.token = self.auth_password(username, password)
-                else:
-                    self.password = getpass.getpass()
-                    self.token = self.auth_password(username, self.password)
+                if password is None:
+                    import getpass
+                    self.password = password = getpass.getpass()
+                self.token = self.auth_password(username, password)
+                (self._username, self._password) = (username, password)
             elif auth_provider == 'oauth2':
                 self.token = self._oauth2_flow(r['oauth2'])
             else:
@@ -45,6 +85,9 @@ class GaldrClient:
         else:
             self.lg.error('GaldrClient: no valid authentication credentials provided')
 
+    def set_json_backend(self, backend):
+        self.json = JsonDecoder(backend)
+
     def _get_base_url(self, url):
         parts = urllib.parse.urlsplit(url)
         base_parts = [parts.scheme, parts.hostname, '', '', '']
@@ -61,13 +104,13 @@ class GaldrClient:
         body = {
             'email': username
         }
-        r = requests.post(
+        r = self.http.post(
             self.base_url + '/auth/federate',
             data=json.dumps(body),
             headers=headers
         )
         r.raise_for_status()
-        return r.json()
+        return self.json.loads(r.content)
 
     def auth_password(self, username, password):
         body = {
@@ -78,6 +121,13 @@ class GaldrClient:
         return data['token']
 
     def _oauth2_flow(self, oauth2_params):
+        # only the interactive flow needs these, so don't pay for
+        #  importing them on every run of the scripts
+        import base64
+        import hashlib
+        import webbrowser
+        from .CallbackServer import CallbackServer, OAuthCallbackHandler
+
         k = hashlib.sha256(os.urandom(1024)).hexdigest()
         state = {'redirect_uri': f'http://localhost:{OAUTH_REDIRECT_PORT}{OAUTH_REDIRECT_PATH}', 'k': k}
         b64_state = base64.urlsafe_b64encode(json.dumps(state).encode('UTF-8')).decode('UTF-8')
@@ -100,7 +150,61 @@ class GaldrClient:
             'refresh_token': token
         }
         data = self.post_no_token('/v1/auth/refresh', body)
+        # keep it for refreshing again later (the server may rotate it)
+        self._refresh_token = data.get('refresh_token', token)
         return data['token']
+
+    def _can_reauthenticate(self):
+        return self.token_provider is not None or self._refresh_token is not None or self._password is not None
+
+    def _reauthenticate(self, stale_token):
+        """
+        Replaces `stale_token` with a new token. Threads that find
+        the token expired at the same time wait for one refresh
+        instead of each starting their own.
+        """
+        with self._auth_lock:
+            if self.token != stale_token:
+                # another thread already refreshed it
+                return
+            self.lg.info('GaldrClient: token expired or expiring, getting a new one')
+            if self.token_provider is not None:
+                self.token = self.token_provider()
+            elif self._refresh_token is not None:
+                self.token = self.refresh_token(self._refresh_token)
+            else:
+                self.token = self.auth_password(self._username, self._password)
+
+    def _token_claims(self, token):
+        """
+        The (unverified) claims of a JWT, or {} if the
+        token isn't one.
+        """
+        if self._claims[0] == token:
+            return self._claims[1]
+        import base64
+        try:
+            payload = token.split('.')[1]
+            claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+            if not isinstance(claims, dict):
+                claims = {}
+        except (AttributeError, IndexError, TypeError, ValueError):
+            claims = {}
+        self._claims = (token, claims)
+        return claims
+
+    def _token_expiring(self, token):
+        exp = self._token_claims(token).get('exp')
+        return isinstance(exp, (int, float)) and exp - time.time() < self.token_refresh_margin
+
+    def _identity(self):
+        """
+        Who requests are made as, for keying cached responses.
+        Tokens are reissued often, so this is the API key and
+        the subject of the token rather than the token itself.
+        """
+        subject = self._token_claims(self.token).get('sub', self.token)
+        return f'{self.api_key}:{subject}'
     ###########################
     # END Auth Methods
     ###########################
@@ -108,61 +212,137 @@ class GaldrClient:
     ###########################
     # START Pagination Methods
     ###########################
-    def get_all(self, path, data={}, extra_headers={}, page_size=50):
+    def get_all(self, path, data={}, extra_headers={}, page_size=None):
         """
         Paginates through server data until
         all records are fetched.
         """
-        page = 1
-        resp = self.get(
-            path + '?page={}&page_size={}'.format(page, page_size),
-            data,
-            extra_headers
-        )
-        entries = resp.get('entries')
-        while resp['total_entries'] > page * page_size:
-            page += 1
-            resp = self.get(
-                path + '?page={}&page_size={}'.format(page, page_size),
-                data,
-                extra_headers
-            )
-            entries = entries + resp.get('entries')
+        entries = []
+        for page in self._pages(path, data, extra_headers, page_size, retry=False):
+            entries.extend(page)
         return entries
 
-    def get_all_cb(self, callback, path, data={}, extra_headers={}, page_size=50):
+    def get_all_cb(self, callback, path, data={}, extra_headers={}, page_size=None):
         """
         Paginates through server data until
         all records are fetched, but calls the callback
         function with the results for each page.
         """
         results = []
-        
-        page = 1
-        resp = self.get(
-            path + '?page={}&page_size={}'.format(page, page_size),
-            data,
-            extra_headers
-        )
-        entries = resp.get('entries')
-        results.extend(callback(entries))
-        while resp.get('total_entries', 0) > page * page_size:
+        for page in self._pages(path, data, extra_headers, page_size, retry=True):
+            results.extend(callback(page))
+        return results
+
+    def iter_pages(self, path, data={}, extra_headers={}, page_size=None, retry=True):
+        """
+        Lazily paginates through server data, yielding
+        the list of entries of each page.
+        """
+        return self._pages(path, data, extra_headers, page_size, retry)
+
+    def _pages(self, path, data, extra_headers, page_size, retry):
+        """
+        Yields the entries of each page. When the page size
+        is 'auto', the page size tuner picks the size of
+        each page from the latency of the previous ones.
+        Failed pages (other than the first) are retried
+        when `retry` is set.
+        """
+        if page_size is None:
+            page_size = self.page_size
+
+        tuner = None
+        timeout = None
+        if page_size == 'auto':
+            tuner = self.page_size_tuner
+            page_size = tuner.initial(path)
+            timeout = tuner.timeout()
+
+        offset = 0
+        first = True
+        attempt = 0
+        while True:
+            page = offset // page_size + 1
             try:
-                resp = self.get(
-                    path + '?page={}&page_size={}'.format(page+1, page_size),
+                start = time.monotonic()
+                r = self._get_response(
+                    path + '?page={}&page_size={}'.format(page, page_size),
                     data,
-                    extra_headers
+                    extra_headers,
+                    timeout
                 )
-                entries = resp.get('entries')
-                results.extend(callback(entries))
-                page += 1
+                elapsed = time.monotonic() - start
+                resp = self.json.loads(r.content)
             except requests.exceptions.RequestException as e:
-                # retry
-                print('Error making request', e)
-                print('Retrying...')
-                pass
+                if tuner is not None and self._page_rejected(e):
+                    smaller = tuner.reject(path, page_size, offset)
+                    if smaller is not None:
+                        self.lg.info(f'GaldrClient: page size {page_size} failed for {path}, retrying with {smaller}')
+                        page_size = smaller
+                        continue
+                throttled = isinstance(e, requests.exceptions.HTTPError) and e.response is not None \
+                    and e.response.status_code == 429
+                if (first or not retry) and not throttled:
+                    raise
+                # retry, once the server is ready for it
+                delay = self._retry_delay(e, attempt)
+                attempt += 1
+                self.lg.warning(f'GaldrClient: error making request {e}, retrying in {delay:.1f}s')
+                time.sleep(delay)
+                continue
+            attempt = 0
 
-        return results
+            entries = resp.get('entries')
+            total_entries = resp.get('total_entries', 0)
+            if tuner is not None and 0 < len(entries) < page_size and offset + len(entries) < total_entries:
+                capped = tuner.cap(path, len(entries), offset)
+                if capped < page_size:
+                    # the server has a smaller maximum page size, refetch this page
+                    page_size = capped
+                    continue
+                # the server's maximum is below the smallest size the
+                #  tuner picks, so keep to the server's size from here
+                page_size = len(entries)
+                offset = (page - 1) * page_size
+                tuner.save()
+                tuner = None
+
+            first = False
+            yield entries
+
+            offset += page_size
+            if not entries or total_entries <= offset:
+                break
+            # pages from the cache say nothing about the server
+            if tuner is not None and not getattr(r, 'from_cache', False):
+                page_size = tuner.observe(path, page_size, offset, elapsed, len(r.content), len(entries))
+
+        if tuner is not None:
+            tuner.save()
+
+    def _retry_delay(self, e, attempt):
+        """
+        Seconds to wait before retrying a failed page: the
+        Retry-After of the response if it has one, otherwise
+        a backoff doubling with every `attempt`.
+        """
+        delay = None
+        if isinstance(e, requests.exceptions.HTTPError) and e.response is not None:
+            delay = retry_after(e.response)
+        if delay is None:
+            delay = 2 ** attempt
+        return min(delay, MAX_RETRY_DELAY)
+
+    def _page_rejected(self, e):
+        """
+        Whether a failed page request is worth retrying
+        with a smaller page size.
+        """
+        if isinstance(e, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+            return True
+        if isinstance(e, requests.exceptions.HTTPError) and e.response is not None:
+            return e.response.status_code in (400, 413, 414, 422, 500, 502, 503, 504)
+        return False
     
     ###########################
     # END Pagination Methods
@@ -172,30 +352,50 @@ class GaldrClient:
     # START HTTP methods
     ###########################
     def get(self, path, data={}, extra_headers={}):
-        self.lg.debug('GET {}'.format(path))
+        r = self._get_response(path, data, extra_headers)
+        return self.json.loads(r.content)
+
+    def _get_response(self, path, data={}, extra_headers={}, timeout=None):
         headers = {
             'x-helplightning-api-key': self.api_key,
-            'Authorization': self.token,
             'Content-Type': 'application/json'
         }
         headers.update(extra_headers)
-        r = requests.get(
-            self.url + path,
+
+        entry = None
+        cache = self.cache if self.cache is not None and self.cache.caches(path) else None
+        if cache is not None:
+            key = cache.key(self.url + path, data, self._identity())
+            entry = cache.lookup(key)
+            if entry is not None:
+                if cache.fresh(entry, path):
+                    return cache.response(entry)
+                headers.update(cache.validators(entry))
+
+        r = self._send(
+            'GET',
+            path,
+            headers,
             params=data,
-            headers=headers
+            timeout=timeout
         )
+        if entry is not None and r.status_code == 304:
+            return cache.revalidate(entry)
         r.raise_for_status()
-        return r.json()
+        if cache is not None:
+            cache.store(key, path, r)
+        return r
 
     def post(self, path, data, extra_headers = {}):
         headers = {
-            'x-helplightning-api-key': self.api_key,
-            'Authorization': self.token
+            'x-helplightning-api-key': self.api_key
         }
+        headers.update(extra_headers)
         return self._post_minimal(
             path,
             data,
-            extra_headers=headers
+            extra_headers=headers,
+            authenticated=True
         )
 
     def post_no_token(self, path, data, extra_headers = {}):
@@ -207,85 +407,116 @@ class GaldrClient:
             }
         )
 
-    def _post_minimal(self, path, data, extra_headers = {}):
+    def _post_minimal(self, path, data, extra_headers = {}, authenticated=False):
         headers = {
             'Content-Type': 'application/json'
         }
         headers.update(extra_headers)
-        r = requests.post(
-            self.url + path,
-            data=json.dumps(data),
-            headers=headers
+        r = self._send(
+            'POST',
+            path,
+            headers,
+            authenticated,
+            data=json.dumps(data)
         )
         r.raise_for_status()
-        return r.json()
+        return self.json.loads(r.content)
 
     def put(self, path, data, extra_headers = {}):
         headers = {
             'x-helplightning-api-key': self.api_key,
-            'Authorization': self.token,
             'Content-Type': 'application/json'
         }
         headers.update(extra_headers)
-        r = requests.put(
-            self.url + path,
-            data=json.dumps(data),
-            headers=headers
+        r = self._send(
+            'PUT',
+            path,
+            headers,
+            data=json.dumps(data)
         )
         r.raise_for_status()
-        return r.json()
+        return self.json.loads(r.content)
 
     def delete(self, path, extra_headers = {}):
         headers = {
             'x-helplightning-api-key': self.api_key,
-            'Authorization': self.token,
             'Content-Type': 'application/json'
         }
         headers.update(extra_headers)
-        r = requests.delete(
-            self.url + path,
-            headers=headers
+        r = self._send(
+            'DELETE',
+            path,
+            headers
         )
         r.raise_for_status()
-        return r.json()
+        return self.json.loads(r.content)
+
+    def _send(self, method, path, headers, authenticated=True, **kwargs):
+        """
+        Makes a request. Authenticated requests carry the current
+        token. If it is about to expire, or the server rejects it
+        with a 401, a new token is fetched and the request is
+        replayed with it.
+        """
+        start = time.monotonic()
+        r = self._request(method, path, headers, authenticated, **kwargs)
+        if self.request_log.isEnabledFor(logging.DEBUG):
+            elapsed_ms = round((time.monotonic() - start) * 1000)
+            self.request_log.debug(
+                '%s %s %s %sms', method, path, r.status_code, elapsed_ms,
+                extra={'method': method, 'path': path, 'status': r.status_code, 'elapsed_ms': elapsed_ms}
+            )
+        return r
+
+    def _request(self, method, path, headers, authenticated, **kwargs):
+        if self.limiter is not None:
+            self.limiter.acquire()
+        if not authenticated:
+            return self.http.request(method, self.url + path, headers=headers, **kwargs)
+
+        token = self.token
+        if self._can_reauthenticate() and self._token_expiring(token):
+            self._reauthenticate(token)
+            token = self.token
+
+        r = self.http.request(method, self.url + path, headers={'Authorization': token, **headers}, **kwargs)
+        if r.status_code == 401 and self._can_reauthenticate():
+            self._reauthenticate(token)
+            if self.limiter is not None:
+                self.limiter.acquire()
+            r = self.http.request(method, self.url + path, headers={'Authorization': self.token, **headers}, **kwargs)
+        if r.status_code == 429 and self.limiter is not None:
+            # the clients sharing the limiter all slow down
+            self.limiter.pause(retry_after(r) or 1)
+        return r
 
     ###########################
     # END HTTP methods
     ###########################
 
 
-class OAuthCallbackHandler(http.server.BaseHTTPRequestHandler):
-    def do_GET(self):
-        req_url = urllib.parse.urlsplit(self.path)
-        if req_url.path == '/callback':
-            params = urllib.parse.parse_qs(req_url.query)
-            if params['state'][0] !=  self.server.state:
-                raise ValueError(f"Generated OAuth 2 state doesn't match returned state!")
-            self.send_success()
-            self.server.token = params['primary_token'][0]
-        else:
-            self.send_error(404)
-            raise ValueError(f'Request path {req_url.path} not recognized')
-
-    def send_success(self):
-        self.send_response(200)
-        self.send_header('Content-type', 'text/html')
-        self.end_headers()
-        msg = '''
-<!DOCTYPE html>
-<html>
-  <body>
-    <h1>You may close this window.</h1>
-  </body>
-</html>
-'''
-        self.wfile.write(bytes(msg, "utf-8"))
-
-    def log_request(self, code='-', size='-'):
-        # Don't log incoming requests to stdout
+def retry_after(response):
+    """
+    The seconds the Retry-After header of `response` asks to
+    wait, or None if it has none.
+    """
+    value = response.headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
         pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(when.timestamp() - time.time(), 0)
+
 
-class CallbackServer(http.server.HTTPServer):
-    def __init__(self, host, port, state, handler):
-        super().__init__((host, port), handler)
-        self.state = state
+def __getattr__(name):
+    # The OAuth callback server used to live in this module
+    if name in ('CallbackServer', 'OAuthCallbackHandler'):
+        from . import CallbackServer
+        return getattr(CallbackServer, name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+#
+# Pluggable JSON decoding for API responses. Uses
+#  orjson or ujson when they are installed, and falls
+#  back to the standard library otherwise.
+
+import json
+
+BACKENDS = ['auto', 'orjson', 'ujson', 'json']
+
+
+class JsonDecoder:
+    '''
+    Decodes response bodies straight from the raw bytes,
+    without decoding them to text first.
+
+    backend is one of BACKENDS. 'auto' picks the fastest
+    installed backend.
+    '''
+    def __init__(self, backend='auto'):
+        if backend not in BACKENDS:
+            raise ValueError(f'Unknown JSON backend {backend}')
+
+        if backend == 'auto':
+            for b in ['orjson', 'ujson']:
+                loads = self._load_backend(b)
+                if loads is not None:
+                    self.name = b
+                    self.loads = loads
+                    return
+            backend = 'json'
+
+        loads = self._load_backend(backend)
+        if loads is None:
+            raise ValueError(f'JSON backend {backend} is not installed')
+        self.name = backend
+        self.loads = loads
+
+    def _load_backend(self, backend):
+        try:
+            if backend == 'orjson':
+                import orjson
+                return orjson.loads
+            elif backend == 'ujson':
+                import ujson
+                return ujson.loads
+        except ImportError:
+            return None
+        return json.loads
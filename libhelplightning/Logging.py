@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+#
+# Logging shared by all the scripts. Records are handed to a
+#  queue, and written out by one background thread, so threads
+#  logging on hot paths never wait on stdout.
+
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+FORMATS = ['text', 'json']
+
+# Where the clients log every request they make, at DEBUG
+REQUESTS_LOGGER = 'libhelplightning.requests'
+
+# Per-request log lines allowed a second, by default
+REQUESTS_RATE = 10
+
+# The attributes every LogRecord has, anything else was passed in `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_lock = threading.Lock()
+_listener = None
+
+
+class TextFormatter(logging.Formatter):
+    '''
+    Formats a record as just its message, followed by how many
+    records a RateLimitFilter dropped before it, if any.
+    '''
+    def __init__(self):
+        super().__init__('%(message)s')
+
+    def formatMessage(self, record):
+        message = super().formatMessage(record)
+        if getattr(record, 'dropped', 0):
+            message += f' ({record.dropped} similar messages dropped)'
+        return message
+
+
+class JsonFormatter(logging.Formatter):
+    '''
+    Formats a record as one json object per line, with the fields
+    passed in `extra` (e.g. the status of a request) as keys.
+    '''
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage()
+        }
+        for (key, value) in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    '''
+    Lets through `rate` records a second on average, in bursts of
+    up to `burst`, and drops the rest. The next record let through
+    has the number dropped in record.dropped, which the formatters
+    write out.
+    '''
+    def __init__(self, rate, burst=None):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                self.dropped += 1
+                return False
+            self.tokens -= 1
+            if self.dropped:
+                record.dropped = self.dropped
+                self.dropped = 0
+            return True
+
+
+def setup(level=logging.INFO, fmt='text', stream=None, log_requests=False, requests_rate=REQUESTS_RATE):
+    """
+    Sets up the root logger, and returns it. The first call installs
+    a QueueHandler on the root logger, and a QueueListener writing
+    to `stream` (stdout by default) in `fmt` ('text' is a
+    TextFormatter, 'json' is a JsonFormatter). Later calls only
+    change the level, so records are never written twice.
+
+    With log_requests, every request of a GaldrClient is logged,
+    at most `requests_rate` a second. They are left off otherwise,
+    without the cost of formatting them.
+    """
+    global _listener
+    root = logging.getLogger()
+    root.setLevel(level)
+
+    if log_requests:
+        requests_logger = logging.getLogger(REQUESTS_LOGGER)
+        requests_logger.setLevel(logging.DEBUG)
+        if not any(isinstance(f, RateLimitFilter) for f in requests_logger.filters):
+            requests_logger.addFilter(RateLimitFilter(requests_rate))
+
+    with _lock:
+        if _listener is not None:
+            return root
+
+        handler = logging.StreamHandler(stream if stream is not None else sys.stdout)
+        handler.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+
+        records = queue.SimpleQueue()
+        root.addHandler(logging.handlers.QueueHandler(records))
+        _listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+        _listener.start()
+        # write out whatever is still queued when the script exits
+        atexit.register(_listener.stop)
+    return root
+
+
+def add_arguments(parser):
+    """
+    Adds the logging options to an argparse parser.
+    """
+    parser.add_argument(
+        '--log-format',
+        choices=FORMATS,
+        default='text',
+        help='Write log lines as plain text or as json objects'
+    )
+    parser.add_argument(
+        '--log-requests',
+        action='store_true',
+        help=f'Log every API request, with its status and latency (at most {REQUESTS_RATE} lines a second)'
+    )
+
+
+def from_arguments(args, level=logging.INFO):
+    """
+    Sets up logging from the options of add_arguments().
+    """
+    return setup(level, args.log_format, log_requests=args.log_requests)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+#
+# Picks page sizes for paginated endpoints. It starts
+#  large and adjusts the page size of each endpoint toward
+#  a target response latency, and can remember the best
+#  value per endpoint between runs.
+
+import json
+import os
+import threading
+
+MIN_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+
+
+class PageSizeTuner:
+    '''
+    Page sizes are MIN_PAGE_SIZE times a power of two, plus
+    max_page_size itself. Pages are fetched by number, so the
+    page size only changes to one the offset of the next record
+    is a whole number of.
+
+    target_latency is the response time (in seconds) to aim for,
+    and max_page_bytes limits the size of a single response body.
+    '''
+    def __init__(self, target_latency=2.0, min_page_size=MIN_PAGE_SIZE, max_page_size=MAX_PAGE_SIZE,
+                 max_page_bytes=8 * 1024 * 1024, state_file=None):
+        self.target_latency = target_latency
+        self.max_page_bytes = max_page_bytes
+        self.state_file = state_file
+        self.lock = threading.Lock()
+
+        self.ladder = [min_page_size]
+        while self.ladder[-1] * 2 <= max_page_size:
+            self.ladder.append(self.ladder[-1] * 2)
+        # the maximum is a size too, rounded down to a whole
+        #  number of the smallest pages
+        top = max_page_size - max_page_size % min_page_size
+        if top > self.ladder[-1]:
+            self.ladder.append(top)
+
+        # endpoint -> best page size, and the largest size the endpoint accepts
+        self.sizes = {}
+        self.limits = {}
+        if state_file is not None:
+            self.load()
+
+    def timeout(self):
+        """
+        Requests that take this long are given up on, and
+        retried with a smaller page.
+        """
+        return self.target_latency * 10
+
+    def initial(self, endpoint):
+        return self.sizes.get(endpoint, self._limit(endpoint))
+
+    def observe(self, endpoint, page_size, offset, elapsed, nbytes, entries):
+        """
+        Records the latency and payload size of a page of `entries`
+        records fetched with `page_size`, and returns the page size
+        to use for the page starting at `offset`.
+        """
+        if entries == 0:
+            return page_size
+
+        # assume latency and payload grow linearly with the page size
+        per_entry_latency = max(elapsed, 0.001) / entries
+        per_entry_bytes = max(nbytes, 1) / entries
+        wanted = min(
+            self.target_latency / per_entry_latency,
+            self.max_page_bytes / per_entry_bytes
+        )
+
+        best = self.ladder[0]
+        for size in self.ladder:
+            if size <= wanted and size <= self._limit(endpoint):
+                best = size
+
+        # don't change more than one step at a time, and only grow
+        #  when the offset is a whole number of the bigger pages
+        i = self.ladder.index(page_size) if page_size in self.ladder else 0
+        if best > page_size:
+            bigger = self.ladder[min(i + 1, len(self.ladder) - 1)]
+            if offset % bigger == 0 and bigger <= self._limit(endpoint):
+                page_size = bigger
+        elif best < page_size:
+            page_size = self._fit(self.ladder[max(i - 1, 0)], offset)
+
+        self.sizes[endpoint] = page_size
+        return page_size
+
+    def reject(self, endpoint, page_size, offset=0):
+        """
+        The server rejected or timed out a page of `page_size`
+        starting at `offset`. Returns a smaller page size to retry
+        with, or None if there is nothing smaller to try.
+        """
+        smaller = [s for s in self.ladder if s < page_size]
+        if not smaller:
+            return None
+        self.limits[endpoint] = smaller[-1]
+        self.sizes[endpoint] = smaller[-1]
+        return self._fit(smaller[-1], offset)
+
+    def cap(self, endpoint, server_max, offset=0):
+        """
+        The server returned fewer records than requested, so it has
+        a lower maximum page size. Returns the page size to refetch
+        the page at `offset` with, which is the smallest size if
+        the server's maximum is below it.
+        """
+        allowed = [s for s in self.ladder if s <= server_max] or self.ladder[:1]
+        self.limits[endpoint] = allowed[-1]
+        self.sizes[endpoint] = allowed[-1]
+        return self._fit(allowed[-1], offset)
+
+    def _fit(self, page_size, offset):
+        """
+        The largest size up to `page_size` that `offset` is a
+        whole number of pages of.
+        """
+        sizes = [s for s in self.ladder if s <= page_size and offset % s == 0] or self.ladder[:1]
+        return sizes[-1]
+
+    def _limit(self, endpoint):
+        return self.limits.get(endpoint, self.ladder[-1])
+
+    def load(self):
+        try:
+            with open(self.state_file, 'r') as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        self.sizes = {e: s for (e, s) in state.get('sizes', {}).items() if s in self.ladder}
+        self.limits = {e: s for (e, s) in state.get('limits', {}).items() if s in self.ladder}
+
+    def save(self):
+        if self.state_file is None:
+            return
+        # paginations running in parallel may save at the same time
+        with self.lock:
+            tmp = self.state_file + '.tmp'
+            with open(tmp, 'w') as f:
+                f.write(json.dumps({'sizes': self.sizes, 'limits': self.limits}))
+            os.replace(tmp, self.state_file)
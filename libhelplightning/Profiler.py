@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+#
+# Profiling support for the sample scripts. Collects a
+#  cProfile profile of the main thread, samples the stacks of
+#  every thread (for flamegraphs), and times each stage of
+#  a script in wall-clock and CPU time.
+
+import contextlib
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+
+# Files that a thread is blocked in when it is waiting on I/O
+#  (the network, or the output of 7z) rather than running Python code
+IO_WAIT_FILES = (
+    'socket.py',
+    'ssl.py',
+    'selectors.py',
+    'subprocess.py'
+)
+
+# Files that a thread is blocked in when it is waiting on a lock,
+#  or is an idle worker (or the log writer) waiting for work
+LOCK_WAIT_FILES = (
+    'threading.py',
+    'queue.py'
+)
+
+
+class Profiler:
+    '''
+    When not enabled every method is a no-op, so scripts can
+    always wrap their stages in profiler.stage(name).
+
+    write(base) creates:
+    - base.prof: the cProfile stats (for pstats/snakeviz)
+    - base.folded: sampled stacks of all threads in the collapsed
+      format used by flamegraph.pl and speedscope
+    - base.profile.txt: a short text summary
+    '''
+    def __init__(self, enabled=False, sample_interval=0.005):
+        self.enabled = enabled
+        self.sample_interval = sample_interval
+        self.stages = []
+        self.samples = {}
+        self.io_samples = 0
+        self.lock_samples = 0
+        self.python_samples = 0
+        self.profile = None
+        self.sampler = None
+        self.stopping = threading.Event()
+
+    def start(self):
+        if not self.enabled:
+            return
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        self.sampler = threading.Thread(target=self._sample, daemon=True)
+        self.sampler.start()
+
+    def stop(self):
+        if not self.enabled or self.profile is None:
+            return
+        self.profile.disable()
+        self.stopping.set()
+        self.sampler.join()
+        self.wall = time.perf_counter() - self.start_wall
+        self.cpu = time.process_time() - self.start_cpu
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Times the code in the with block as one stage.
+        """
+        if not self.enabled:
+            yield
+            return
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield
+        finally:
+            self.stages.append((
+                name,
+                time.perf_counter() - start_wall,
+                time.process_time() - start_cpu
+            ))
+
+    def _sample(self):
+        me = threading.get_ident()
+        while not self.stopping.is_set():
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for (ident, frame) in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                top = frame
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                key = ';'.join(reversed(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
+
+                filename = os.path.basename(top.f_code.co_filename)
+                if filename in IO_WAIT_FILES:
+                    self.io_samples += 1
+                elif filename in LOCK_WAIT_FILES:
+                    self.lock_samples += 1
+                else:
+                    self.python_samples += 1
+            time.sleep(self.sample_interval)
+
+    def write(self, base):
+        """
+        Writes the profile next to `base` (e.g. the archive name
+        without its extension) and returns the summary text.
+        """
+        if not self.enabled:
+            return None
+
+        self.profile.dump_stats(base + '.prof')
+
+        with open(base + '.folded', 'w') as f:
+            for (stack, count) in sorted(self.samples.items()):
+                f.write(f'{stack} {count}\n')
+
+        summary = self.summary()
+        with open(base + '.profile.txt', 'w') as f:
+            f.write(summary)
+        return summary
+
+    def summary(self, top=20):
+        out = io.StringIO()
+        out.write(f'Total: {self.wall:.2f}s wall, {self.cpu:.2f}s CPU\n\n')
+
+        out.write('{:<20} {:>10} {:>10} {:>10}\n'.format('Stage', 'Wall (s)', 'CPU (s)', 'Wait (s)'))
+        for (name, wall, cpu) in self.stages:
+            out.write('{:<20} {:>10.2f} {:>10.2f} {:>10.2f}\n'.format(name, wall, cpu, max(wall - cpu, 0)))
+
+        samples = self.io_samples + self.lock_samples + self.python_samples
+        if samples:
+            out.write(f'\nSampled thread time: {self.io_samples * 100 / samples:.0f}% waiting on I/O, '
+                      f'{self.lock_samples * 100 / samples:.0f}% waiting on locks or idle, '
+                      f'{self.python_samples * 100 / samples:.0f}% running Python ({samples} samples)\n')
+
+        out.write(f'\nTop {top} functions of the main thread by own time:\n')
+        stats = pstats.Stats(self.profile, stream=out)
+        stats.sort_stats('tottime').print_stats(top)
+        return out.getvalue()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+#
+# A token bucket, for limiting bandwidth (or requests) across
+#  threads.
+
+import threading
+import time
+
+
+class RateLimiter:
+    '''
+    Allows `rate` units a second on average (bytes, requests, ...),
+    in bursts of up to `burst` units (one second's worth by
+    default). It is shared by all the threads or tasks it limits.
+    '''
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, n=1):
+        """
+        Takes `n` units and returns the seconds to wait before
+        using them. Units are handed out in the order they are
+        asked for, even if that puts the bucket in debt, so the
+        callers that wait as told never go over the rate.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= n
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+    def acquire(self, n=1):
+        """
+        Blocks until `n` units can be used.
+        """
+        delay = self.reserve(n)
+        if delay > 0:
+            time.sleep(delay)
+
+    def pause(self, seconds):
+        """
+        Holds back every unit for at least `seconds`, e.g. after
+        the server asked to slow down.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate, -seconds * self.rate)
+            self.updated = now
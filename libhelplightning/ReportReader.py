@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+#
+# Reads the rows of a downloaded report. Reports are zip
+#  files with a csv or json file inside; the rows are
+#  parsed straight out of the zip without extracting it.
+
+import csv
+import io
+import json
+import re
+import zipfile
+
+# Characters of a json report read at a time
+CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = re.compile(r'\s*')
+
+
+class ReportReader:
+    '''
+    Iterates over the rows of every csv or json file in a
+    report zip. csv rows are dicts keyed by the header. Both
+    csv files and json arrays (what the reports hold) are
+    streamed a row at a time; any other json file is loaded
+    whole, and its `entries` are the rows if it has them.
+    '''
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        with zipfile.ZipFile(self.path) as z:
+            for info in z.infolist():
+                if info.is_dir():
+                    continue
+                name = info.filename.lower()
+                with z.open(info) as f:
+                    if name.endswith('.csv'):
+                        yield from csv.DictReader(io.TextIOWrapper(f, encoding='utf-8', newline=''))
+                    elif name.endswith('.json'):
+                        yield from self._json_rows(io.TextIOWrapper(f, encoding='utf-8'))
+
+    def _json_rows(self, f):
+        buf = ''
+        while not buf:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            buf = chunk.lstrip()
+        if not buf.startswith('['):
+            data = json.loads(buf + f.read())
+            if isinstance(data, dict) and isinstance(data.get('entries'), list):
+                yield from data['entries']
+            else:
+                yield data
+            return
+
+        decoder = json.JSONDecoder()
+        pos = 1
+        # whether the next thing is an element (after [ or a comma)
+        element = True
+        first = True
+        while True:
+            pos = _WHITESPACE.match(buf, pos).end()
+            if pos == len(buf) or element and buf[pos] != ']':
+                if pos == len(buf):
+                    (buf, pos) = self._more(f, buf, pos)
+                    continue
+                try:
+                    (row, end) = decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    # the element continues in the next chunk
+                    (buf, pos) = self._more(f, buf, pos)
+                    continue
+                if end == len(buf):
+                    # so may a number that ends the chunk
+                    more = f.read(CHUNK_SIZE)
+                    if more:
+                        (buf, pos) = (buf[pos:] + more, 0)
+                        continue
+                yield row
+                (pos, element, first) = (end, False, False)
+            elif buf[pos] == ']':
+                if element and not first:
+                    raise ValueError('Trailing comma in a json report')
+                return
+            elif buf[pos] == ',':
+                (pos, element) = (pos + 1, True)
+            else:
+                raise ValueError(f'Unexpected {buf[pos]!r} in a json report')
+
+    def _more(self, f, buf, pos):
+        """
+        Drops the parsed part of the buffer and reads more, at
+        least as much as is left, so a large element is parsed
+        in a few attempts.
+        """
+        more = f.read(max(CHUNK_SIZE, len(buf) - pos))
+        if not more:
+            raise ValueError('Unexpected end of a json report')
+        return (buf[pos:] + more, 0)
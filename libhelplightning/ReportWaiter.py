@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+#
+# Waits for server side reports to be generated, polling
+#  with an increasing interval so that small reports are
+#  picked up quickly while large ones don't cause a flood
+#  of status requests.
+
+import heapq
+import itertools
+import random
+import time
+
+import requests
+
+from . import Resources
+
+# Statuses of a failed poll that are worth polling again
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class ReportFailed(Exception):
+    pass
+
+
+class ReportTimeout(Exception):
+    pass
+
+
+class ReportWaiter:
+    '''
+    Polls the status of a report with a single client.
+
+    The first poll happens right away, then the interval starts
+    at initial_interval seconds and grows by `backoff` after every
+    poll, up to max_interval. A ReportTimeout is raised if the
+    report isn't done after `timeout` seconds. Polls that fail
+    with a connection error or a 429/5xx are retried until then.
+    '''
+    def __init__(self, client, initial_interval=1.0, max_interval=30.0, backoff=1.5, timeout=60 * 60):
+        self.client = client
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.timeout = timeout
+
+    def status(self, report_uuid, kind='calls'):
+        return Resources.Reports(self.client, kind).get(report_uuid)
+
+    def poll(self, report_uuid, kind='calls'):
+        """
+        Checks on the report once. Returns its download url once
+        it is complete, or None while it is still generating.
+        """
+        r = self.status(report_uuid, kind)
+        if r.status == 'complete':
+            return r.url
+        elif r.status == 'failed':
+            raise ReportFailed(f'Report {report_uuid} failed to generate!')
+        return None
+
+    def next_interval(self, interval):
+        return min(interval * self.backoff, self.max_interval)
+
+    def wait(self, report_uuid, kind='calls', on_poll=None):
+        """
+        Blocks until the report is complete and returns its
+        download url. `on_poll` is called before every poll.
+        """
+        deadline = time.monotonic() + self.timeout
+        interval = self.initial_interval
+        while True:
+            if on_poll is not None:
+                on_poll()
+
+            try:
+                url = self.poll(report_uuid, kind)
+            except requests.exceptions.RequestException as e:
+                if not _retryable(e) or time.monotonic() >= deadline:
+                    raise
+                url = None
+            if url is not None:
+                return url
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise ReportTimeout(f'Report {report_uuid} was not ready after {self.timeout} seconds')
+
+            time.sleep(min(_jitter(interval), remaining))
+            interval = self.next_interval(interval)
+
+
+class ReportBatch:
+    '''
+    Waits for many reports at once, from one loop. Every report
+    is polled on its own schedule (by a ReportWaiter, with its
+    backoff), and the loop sleeps until the next report is due,
+    so the whole batch takes about as long as the slowest report.
+
+    Reports are added with a client and a `context` (anything),
+    which is handed back to the callbacks of run().
+    '''
+    def __init__(self, initial_interval=1.0, max_interval=30.0, backoff=1.5, timeout=60 * 60):
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.timeout = timeout
+        self.pending = []
+        self.counter = itertools.count()
+
+    def add(self, client, report_uuid, kind='calls', context=None):
+        now = time.monotonic()
+        job = {
+            'waiter': ReportWaiter(client, self.initial_interval, self.max_interval, self.backoff, self.timeout),
+            'uuid': report_uuid,
+            'kind': kind,
+            'context': context,
+            'interval': self.initial_interval,
+            'deadline': now + self.timeout
+        }
+        heapq.heappush(self.pending, (now, next(self.counter), job))
+
+    def run(self, on_complete, on_failed=None, before_poll=None):
+        """
+        Polls until every report is complete or has failed.
+        on_complete(context, url) is called as soon as a report is
+        ready, so it should hand long work (downloads) off to other
+        threads. on_failed(context, exception) is called for failed
+        or timed out reports, and for polls that failed for good
+        (e.g. a 404, or errors until the timeout); without it the
+        exception is raised. before_poll(context) is called before
+        every poll.
+        """
+        while self.pending:
+            (due, n, job) = heapq.heappop(self.pending)
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+            try:
+                if before_poll is not None:
+                    before_poll(job['context'])
+                try:
+                    url = job['waiter'].poll(job['uuid'], job['kind'])
+                except requests.exceptions.RequestException as e:
+                    if not _retryable(e) or time.monotonic() >= job['deadline']:
+                        raise
+                    # poll again after the backoff
+                    url = None
+                if url is not None:
+                    on_complete(job['context'], url)
+                    continue
+                elif time.monotonic() >= job['deadline']:
+                    raise ReportTimeout(f'Report {job["uuid"]} was not ready after {self.timeout} seconds')
+            except (ReportFailed, ReportTimeout, requests.exceptions.RequestException) as e:
+                if on_failed is None:
+                    raise
+                on_failed(job['context'], e)
+                continue
+
+            due = min(time.monotonic() + _jitter(job['interval']), job['deadline'])
+            job['interval'] = job['waiter'].next_interval(job['interval'])
+            heapq.heappush(self.pending, (due, n, job))
+
+
+def _retryable(e):
+    """
+    Whether a failed poll is worth polling again.
+    """
+    if isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(e, requests.exceptions.HTTPError) and e.response is not None:
+        return e.response.status_code in RETRY_STATUSES
+    return False
+
+
+def _jitter(interval):
+    # a little jitter keeps many waiters from polling in lockstep
+    return interval * random.uniform(0.9, 1.1)
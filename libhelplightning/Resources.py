@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+#
+# Typed access to the Help Lightning API resources used by
+#  the sample scripts. Listings are paginated lazily, and
+#  records are namedtuples holding only the fields the
+#  scripts use, which take a fraction of the memory of the
+#  decoded json dicts.
+
+import collections
+import concurrent.futures
+import datetime
+import threading
+import time
+
+# Calls listed in ranges (shards) start at this date, older
+#  calls all end up in the first range.
+CALLS_EPOCH = datetime.datetime(2015, 1, 1, tzinfo=datetime.timezone.utc)
+
+###########################
+# START Records
+###########################
+USER_FIELDS = [
+    'id',
+    'active',
+    'available',
+    'confirmation_sent_at',
+    'confirmed_at',
+    'created_at',
+    'email',
+    'email_confirmed',
+    'enterprise_id',
+    'first_call_at',
+    'invitation_sent_at',
+    'is_confirmed',
+    'is_first_login',
+    'last_used_at',
+    'license',
+    'location',
+    'manage',
+    'name',
+    'provider',
+    'provider_uid',
+    'role_id',
+    'role_name',
+    'status',
+    'status_message',
+    'title',
+    'unavailable_expires_at',
+    'updated_at',
+    'username'
+]
+
+POD_FIELDS = [
+    'id',
+    'admin_count',
+    'default',
+    'description',
+    'email',
+    'expert',
+    'manage',
+    'name',
+    'user_count'
+]
+
+# (api name, field name, default) of the call fields
+CALL_FIELDS = [
+    ('session', 'id', ''),
+    ('has_attachments', 'has_attachments', False),
+    ('callDuration', 'call_duration', 0),
+    ('dialerId', 'dialer_id', '-1'),
+    ('dialerName', 'dialer_name', ''),
+    ('intraEnterpriseCall', 'intra_enterprise_call', True),
+    ('reasonCallEnded', 'reason_call_ended', ''),
+    ('receiverId', 'receiver_id', '-1'),
+    ('receiverName', 'receiver_name', ''),
+    ('recordingStatus', 'recording_status', ''),
+    ('timestamp', 'timestamp', ''),
+    ('timeCallStarted', 'time_call_started', 0),
+    ('timeCallEnded', 'time_call_ended', 0)
+]
+
+PARTICIPANT_FIELDS = [
+    ('id', 'id'),
+    ('name', 'name'),
+    ('isAnonymous', 'is_anonymous'),
+    ('enterpriseId', 'enterprise_id')
+]
+
+User = collections.namedtuple('User', USER_FIELDS)
+Pod = collections.namedtuple('Pod', POD_FIELDS)
+# the ids of the members of a pod
+PodMembers = collections.namedtuple('PodMembers', ['id', 'users', 'admins', 'subpods', 'on_call_pods'])
+Participant = collections.namedtuple('Participant', [p[1] for p in PARTICIPANT_FIELDS])
+# the participants are last, so call[:-1] is a row of the calls table
+Call = collections.namedtuple('Call', [p[1] for p in CALL_FIELDS] + ['participants'])
+Attachment = collections.namedtuple('Attachment', ['id', 'name', 'content_type', 'size', 'signed_url'])
+Report = collections.namedtuple('Report', ['uuid', 'status', 'url'])
+
+CALL_COLUMNS = Call._fields[:-1]
+CALL_DEFAULTS = [p[2] for p in CALL_FIELDS]
+
+# the calls_users table, linking calls to their participants
+CALL_USER_COLUMNS = ['id', 'call_id', 'user_id', 'name', 'isAnonymous', 'isExternal']
+
+_new = tuple.__new__
+
+
+def _maker(cls, keys, defaults=None):
+    """
+    Returns a function that builds a `cls` record
+    from the `keys` of a json entry.
+    """
+    if defaults is None:
+        defaults = [None] * len(keys)
+
+    def make(entry):
+        return _new(cls, map(entry.get, keys, defaults))
+    return make
+
+
+make_user = _maker(User, USER_FIELDS)
+make_pod = _maker(Pod, POD_FIELDS)
+make_participant = _maker(Participant, [p[0] for p in PARTICIPANT_FIELDS])
+make_attachment = _maker(Attachment, Attachment._fields)
+make_report = _maker(Report, Report._fields)
+
+_CALL_KEYS = [p[0] for p in CALL_FIELDS]
+
+
+def make_call(entry):
+    participants = tuple(map(make_participant, entry.get('participants') or ()))
+    return _new(Call, (*map(entry.get, _CALL_KEYS, CALL_DEFAULTS), participants))
+
+
+def call_user_rows(calls, enterprise_id):
+    """
+    The calls_users rows of `calls`. Participants from another
+    enterprise than `enterprise_id` are external.
+    """
+    enterprise = f'{enterprise_id}'
+    return (
+        (f'{c.id}_{p.id}', c.id, p.id, p.name, p.is_anonymous, p.enterprise_id != enterprise)
+        for c in calls
+        for p in c.participants
+    )
+
+
+def make_pod_members(entry):
+    return PodMembers(
+        entry['id'],
+        tuple(u['id'] for u in entry.get('users', ())),
+        tuple(u['id'] for u in entry.get('admins', ())),
+        tuple(u['id'] for u in entry.get('subpods', ())),
+        tuple(u['id'] for u in entry.get('on_call_pods', ()))
+    )
+###########################
+# END Records
+###########################
+
+
+class Listing:
+    '''
+    A paginated list of records. Nothing is fetched until it is
+    iterated, and only one page is held at a time. pages() yields
+    a list of records per page, iterating yields the records.
+    '''
+    def __init__(self, client, path, params, make, page_size=None):
+        self.client = client
+        self.path = path
+        self.params = params
+        self.make = make
+        self.page_size = page_size
+
+    def pages(self):
+        for entries in self.client.iter_pages(self.path, self.params, page_size=self.page_size):
+            yield list(map(self.make, entries))
+
+    def __iter__(self):
+        for page in self.pages():
+            yield from page
+
+
+def updated_since(start_date):
+    """
+    Query params for records updated after start_date
+    (no filter if start_date is empty).
+    """
+    if not start_date:
+        return {}
+    s = start_date.isoformat().replace('+00:00', 'Z')
+    return {'filter': f'updated_at>{s}'}
+
+
+class Users:
+    def __init__(self, client):
+        self.client = client
+
+    def list(self, since=None, page_size=None):
+        return Listing(self.client, '/v1r1/enterprise/users', updated_since(since), make_user, page_size)
+
+    def in_pod(self, pod_id, since=None, page_size=None):
+        return Listing(self.client, f'/v1/enterprise/pods/{pod_id}/users', updated_since(since), make_user, page_size)
+
+
+class Pods:
+    def __init__(self, client):
+        self.client = client
+
+    def list(self, since=None, page_size=None):
+        return Listing(self.client, '/v1r1/enterprise/pods', updated_since(since), make_pod, page_size)
+
+    def members(self, pod_id):
+        return make_pod_members(self.client.get(f'/v1r1/enterprise/pods/{pod_id}'))
+
+
+class Calls:
+    def __init__(self, client):
+        self.client = client
+
+    def list(self, from_date=None, to_date=None, page_size=None):
+        """
+        Lists every call, or the calls in a time range
+        (unix timestamps) if either bound is given.
+        """
+        if from_date is None and to_date is None:
+            return Listing(self.client, '/v1/enterprise/calls', {}, make_call, page_size)
+
+        params = {'from_date': from_date or 0}
+        if to_date is not None:
+            params['to_date'] = to_date
+        return Listing(self.client, '/v1/enterprise/calls/range', params, make_call, page_size)
+
+    def each_page(self, fn, since=None, shards=1):
+        """
+        Calls fn(page) for every page of the calls started since
+        the datetime `since` (every call if it's empty). With more
+        than one shard, the time is split into `shards` ranges
+        listed at once by as many threads, and fn is called under
+        a lock, with only the calls not already handed to it.
+        """
+        if shards <= 1:
+            from_date = int(since.timestamp()) if since else None
+            for page in self.list(from_date=from_date).pages():
+                fn(page)
+            return
+
+        # A call on the boundary of two shards can be returned
+        #  by both, so only pass on calls we haven't seen yet.
+        lock = threading.Lock()
+        seen = set()
+
+        def list_shard(shard_params):
+            for page in self.list(**shard_params).pages():
+                with lock:
+                    page = [c for c in page if c.id not in seen]
+                    seen.update(c.id for c in page)
+                    fn(page)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=shards) as pool:
+            futures = [pool.submit(list_shard, shard_params) for shard_params in call_shards(since, shards)]
+            for f in futures:
+                f.result()
+
+    def get(self, call_id):
+        return make_call(self.client.get(f'/v1r1/enterprise/calls/{call_id}'))
+
+    def attachments(self, call_id):
+        return list(map(make_attachment, self.client.get(f'/v1r1/enterprise/calls/{call_id}/attachments')))
+
+
+def call_shards(since, shards):
+    """
+    Splits the time from `since` (or CALLS_EPOCH for a full
+    export) until now into Calls.list() params for `shards`
+    ranges. Without `since` the first range starts at 0, and
+    the last range is left open, so every call falls in one.
+    """
+    start = int((since or CALLS_EPOCH).timestamp())
+    step = max((int(time.time()) - start) // shards, 1)
+    bounds = [start + i * step for i in range(shards)]
+
+    results = []
+    for (i, from_date) in enumerate(bounds):
+        if i == 0 and not since:
+            from_date = 0
+        params = {'from_date': from_date}
+        if i < shards - 1:
+            params['to_date'] = bounds[i + 1]
+        results.append(params)
+    return results
+
+
+class Reports:
+    def __init__(self, client, kind='calls'):
+        self.client = client
+        self.kind = kind
+
+    def create(self, csv=False):
+        """
+        Starts generating a report, as csv or json.
+        """
+        path = f'/v1r1/enterprise/reports/{self.kind}'
+        if not csv:
+            path = path + '.json'
+        return make_report(self.client.post(path, {}))
+
+    def get(self, report_uuid):
+        return make_report(self.client.get(f'/v1r1/enterprise/reports/{self.kind}/{report_uuid}'))
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+#
+# An on-disk cache of GET responses. Cached responses are
+#  revalidated with If-None-Match/If-Modified-Since, so a
+#  resource that hasn't changed costs a 304 instead of the
+#  whole body, or no request at all within its TTL.
+
+import collections
+import fnmatch
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+CacheEntry = collections.namedtuple('CacheEntry', ['key', 'etag', 'last_modified', 'stored_at', 'body'])
+
+
+class CachedResponse:
+    '''
+    Stands in for a requests.Response when the body
+    comes from the cache.
+    '''
+    __slots__ = ['content', 'status_code']
+    from_cache = True
+
+    def __init__(self, content):
+        self.content = content
+        self.status_code = 200
+
+
+class ResponseCache:
+    '''
+    Entries are keyed by the url, the query parameters and the
+    identity the request is made as, so different API keys or
+    users never share a response.
+
+    Only the paths matching `paths` (fnmatch style, PATHS by
+    default) are cached: the users, pods and pod members, which
+    are small and mostly the same from one run to the next. Calls
+    and other large listings would only churn the cache.
+
+    ttls maps path patterns (fnmatch style, like
+    '/v1r1/enterprise/pods/*') to the number of seconds a response
+    is used without asking the server. Other paths use default_ttl,
+    and a TTL of 0 revalidates on every request. Once the cache
+    holds more than max_bytes, the least recently used entries
+    are evicted.
+    '''
+    # The paths cached by default
+    PATHS = [
+        '/v1r1/enterprise/users',
+        '/v1r1/enterprise/pods',
+        '/v1r1/enterprise/pods/*',
+        '/v1/enterprise/pods/*/users'
+    ]
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024, ttls=None, default_ttl=0, paths=None):
+        self.max_bytes = max_bytes
+        self.paths = paths if paths is not None else self.PATHS
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(directory, 'responses.sqlite'), check_same_thread=False)
+        with self.db:
+            self.db.execute('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    etag TEXT,
+                    last_modified TEXT,
+                    stored_at REAL,
+                    used_at REAL,
+                    size INTEGER,
+                    body BLOB
+                )
+            ''')
+            self.db.execute('CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at)')
+        self.size = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def key(self, url, params, identity):
+        raw = json.dumps([identity, url, sorted((params or {}).items())], default=str)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def caches(self, path):
+        """
+        Whether responses for `path` are cached.
+        """
+        path = path.split('?', 1)[0]
+        return any(fnmatch.fnmatchcase(path, pattern) for pattern in self.paths)
+
+    def ttl(self, path):
+        path = path.split('?', 1)[0]
+        for (pattern, seconds) in self.ttls.items():
+            if fnmatch.fnmatchcase(path, pattern):
+                return seconds
+        return self.default_ttl
+
+    def lookup(self, key):
+        with self.lock:
+            row = self.db.execute(
+                'SELECT key, etag, last_modified, stored_at, body FROM responses WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            with self.db:
+                self.db.execute('UPDATE responses SET used_at = ? WHERE key = ?', (time.time(), key))
+            return CacheEntry(*row)
+
+    def fresh(self, entry, path):
+        """
+        Whether the entry can be used without revalidating it.
+        """
+        if time.time() - entry.stored_at < self.ttl(path):
+            with self.lock:
+                self.hits += 1
+            return True
+        return False
+
+    def validators(self, entry):
+        """
+        The headers that make the request conditional on
+        the cached entry.
+        """
+        headers = {}
+        if entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+        return headers
+
+    def revalidate(self, entry):
+        """
+        The server answered 304, so the entry is good for
+        another TTL.
+        """
+        with self.lock:
+            self.revalidated += 1
+            with self.db:
+                self.db.execute('UPDATE responses SET stored_at = ? WHERE key = ?', (time.time(), entry.key))
+        return CachedResponse(entry.body)
+
+    def response(self, entry):
+        return CachedResponse(entry.body)
+
+    def store(self, key, path, r):
+        """
+        Caches a 200 response, if it can ever be reused.
+        """
+        etag = r.headers.get('ETag')
+        last_modified = r.headers.get('Last-Modified')
+        if r.status_code != 200 or len(r.content) > self.max_bytes:
+            return
+        if etag is None and last_modified is None and self.ttl(path) <= 0:
+            return
+
+        now = time.time()
+        with self.lock, self.db:
+            old = self.db.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            if old is not None:
+                self.size -= old[0]
+            self.db.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, etag, last_modified, now, now, len(r.content), r.content)
+            )
+            self.size += len(r.content)
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        rows = self.db.execute('SELECT key, size FROM responses ORDER BY used_at').fetchall()
+        for (key, size) in rows:
+            if self.size <= self.max_bytes:
+                break
+            self.db.execute('DELETE FROM responses WHERE key = ?', (key,))
+            self.size -= size
+
+    def clear(self):
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM responses')
+            self.size = 0
+
+    def summary(self):
+        return (f'{self.hits} fresh hits, {self.revalidated} revalidated, {self.misses} misses, '
+                f'{self.size / (1024 * 1024):.1f} MB cached')
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+#
+# Running a script for several Help Lightning sites (workspaces)
+#  at once. The sites are listed in siteconfig.SITES, and each
+#  gets its own partner token and output directory, while the
+#  connections to each regional endpoint are shared.
+
+import collections
+import concurrent.futures
+import logging
+import os
+import threading
+import urllib.parse
+
+import requests
+import requests.adapters
+
+from .RateLimiter import RateLimiter
+
+Site = collections.namedtuple('Site', ['name', 'site_id', 'partner_key', 'endpoint', 'api_key', 'settings'])
+
+# Options of the export scripts that are paths, relative ones
+#  are in the directory of each site
+SITE_PATHS = ['cache_dir', 'call_store', 'change_index']
+
+
+def default_site(siteconfig):
+    """
+    The one site of SITE_ID, PARTNER_KEY and HELPLIGHTNING_ENDPOINT.
+    It has no name, and its output goes in the current directory.
+    """
+    return Site(None, siteconfig.SITE_ID, siteconfig.PARTNER_KEY, siteconfig.HELPLIGHTNING_ENDPOINT,
+                siteconfig.API_KEY, {})
+
+
+def load_sites(siteconfig, names=None):
+    """
+    The sites listed in siteconfig.SITES, or just the default_site()
+    if there is no such list. Each entry of SITES needs a name, a
+    site_id and a partner_key, and the endpoint and api_key default
+    to HELPLIGHTNING_ENDPOINT and API_KEY. Any other keys are kept
+    in the settings of the site. `names` selects some of the sites.
+    """
+    entries = getattr(siteconfig, 'SITES', None)
+    if not entries:
+        if names:
+            raise ValueError('Selecting sites requires a SITES list in siteconfig.py')
+        return [default_site(siteconfig)]
+
+    sites = []
+    for entry in entries:
+        for key in ('name', 'site_id', 'partner_key'):
+            if key not in entry:
+                raise ValueError(f'Site {entry.get("name", entry)} in SITES has no {key}')
+        sites.append(Site(
+            entry['name'],
+            entry['site_id'],
+            entry['partner_key'],
+            entry.get('endpoint', siteconfig.HELPLIGHTNING_ENDPOINT),
+            entry.get('api_key', siteconfig.API_KEY),
+            entry
+        ))
+
+    by_name = {s.name: s for s in sites}
+    if len(by_name) != len(sites):
+        raise ValueError('The names of the SITES must be unique')
+    if names:
+        unknown = [n for n in names if n not in by_name]
+        if unknown:
+            raise ValueError(f'Unknown sites: {", ".join(unknown)}')
+        sites = [by_name[n] for n in names]
+    return sites
+
+
+def site_dir(site):
+    """
+    The directory the output and state files of a site go in.
+    """
+    return site.name if site.name is not None else '.'
+
+
+class _SiteLogger(logging.LoggerAdapter):
+    def process(self, msg, kwargs):
+        return (f'[{self.extra["site"]}] {msg}', kwargs)
+
+
+def site_logger(logger, site):
+    """
+    A logger that prefixes every message with the site name.
+    """
+    if site.name is None:
+        return logger
+    return _SiteLogger(logger, {'site': site.name})
+
+
+class SessionPool:
+    '''
+    One requests.Session per API endpoint host (the US and EU
+    environments), shared by all the clients of that endpoint so
+    their connections are reused. Each session keeps at most
+    max_connections connections, and requests wait for a free one
+    beyond that, which caps the requests in flight to an endpoint
+    across every site.
+    '''
+    def __init__(self, max_connections=16):
+        self.max_connections = max_connections
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def get(self, endpoint):
+        parts = urllib.parse.urlsplit(endpoint)
+        key = (parts.scheme, parts.netloc)
+        with self.lock:
+            if key not in self.sessions:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=self.max_connections,
+                    pool_block=True
+                )
+                session.mount(f'{parts.scheme}://{parts.netloc}', adapter)
+                self.sessions[key] = session
+            return self.sessions[key]
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions = {}
+
+
+def run_sites(sites, fn, parallel=4, logger=None):
+    """
+    Calls fn(site) for every site, `parallel` sites at a time. A
+    site that fails doesn't stop the others, and the {name:
+    exception} of the sites that failed is returned.
+    """
+    logger = logger or logging.getLogger()
+    failed = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(parallel, 1)) as pool:
+        futures = {pool.submit(fn, site): site for site in sites}
+        for f in concurrent.futures.as_completed(futures):
+            site = futures[f]
+            try:
+                f.result()
+            except Exception as e:
+                logger.exception(f'Site {site.name or site.site_id} failed')
+                failed[site.name or site.site_id] = e
+    return failed
+
+
+def export_sites(sites, export, parallel=4, max_connections=16, max_rps=None, logger=None, **options):
+    """
+    Runs export(site, **options) for each of the `sites`, with its
+    own output_dir (see site_dir()), so it has its own state files
+    and archives, running `parallel` sites at once. The sites share
+    a pool of connections to each endpoint, of at most
+    `max_connections`, and all their requests together are limited
+    to `max_rps` a second. The session, limiter and a site_logger()
+    are passed to export too, and the relative SITE_PATHS options
+    are made per site. Returns the {name: exception} of the sites
+    that failed, like run_sites().
+    """
+    logger = logger or logging.getLogger()
+    sessions = SessionPool(max_connections)
+    limiter = RateLimiter(max_rps) if max_rps else None
+    if options.get('profile') and len(sites) > 1:
+        # there is one profiler per process
+        parallel = 1
+    if options.get('threads') is None:
+        # share the cores between the sites compressing at once
+        options['threads'] = max(1, (os.cpu_count() or 1) // max(1, min(parallel, len(sites))))
+
+    def run(site):
+        output_dir = site_dir(site)
+        os.makedirs(output_dir, exist_ok=True)
+        site_options = dict(options)
+        for key in SITE_PATHS:
+            if site_options.get(key) is not None:
+                site_options[key] = os.path.join(output_dir, site_options[key])
+        export(site, output_dir=output_dir, session=sessions.get(site.endpoint), limiter=limiter,
+               logger=site_logger(logger, site), **site_options)
+
+    try:
+        failed = run_sites(sites, run, parallel, logger)
+    finally:
+        sessions.close()
+    if failed:
+        logger.error(f'Export failed for: {", ".join(str(name) for name in failed)}')
+    return failed
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+#
+# Table writers used by the export scripts. Every
+#  table is written through the same interface so the
+#  exporters do not care whether the output is a csv file
+#  or a typed columnar (parquet/arrow) file.
+
+import csv
+import datetime
+import os
+
+# pyarrow is slow to import, so it is only imported
+#  once a parquet or arrow table is opened
+pyarrow = None
+
+FORMATS = ['csv', 'parquet', 'arrow']
+
+EXTENSIONS = {
+    'csv': 'csv',
+    'parquet': 'parquet',
+    'arrow': 'arrow'
+}
+
+# Number of rows buffered before a row group is flushed
+ROW_GROUP_SIZE = 64 * 1024
+
+# Columns whose type can't be derived from their name or default value
+COLUMN_TYPES = {
+    'id': 'string',
+    'active': 'bool',
+    'available': 'bool',
+    'default': 'bool',
+    'email_confirmed': 'bool',
+    'expert': 'bool',
+    'is_confirmed': 'bool',
+    'is_first_login': 'bool',
+    'manage': 'bool',
+    'isAnonymous': 'bool',
+    'isExternal': 'bool',
+    'enterprise_id': 'int',
+    'role_id': 'int',
+    'admin_count': 'int',
+    'user_count': 'int',
+    'pod_id': 'int',
+    'user_id': 'int',
+    'included_pod_id': 'int',
+    'on_call_pod_id': 'int'
+}
+
+
+def column_type(name, default=None):
+    """
+    Derives the type of a column from its name, or from
+    the default value used in the exporter's filter_params.
+    """
+    if name in COLUMN_TYPES:
+        return COLUMN_TYPES[name]
+    if name.endswith('_at'):
+        return 'timestamp'
+    if isinstance(default, bool):
+        return 'bool'
+    if isinstance(default, int):
+        return 'int'
+    return 'string'
+
+
+def schema_for(fieldnames, defaults=None):
+    """
+    Builds a list of (name, type) pairs for a table. `defaults`
+    is an optional list of default values (one per field), as
+    found in the calls filter_params.
+    """
+    if defaults is None:
+        defaults = [None] * len(fieldnames)
+    return [(n, column_type(n, d)) for (n, d) in zip(fieldnames, defaults)]
+
+
+def open_table(base, name, fieldnames, fmt='csv', defaults=None):
+    """
+    Opens a writer for the table `name` in the directory `base`.
+    The header (if any) is written immediately.
+    """
+    path = os.path.join(base, '{}.{}'.format(name, EXTENSIONS[fmt]))
+    if fmt == 'csv':
+        writer = CsvTableWriter(path, fieldnames)
+    else:
+        writer = ArrowTableWriter(path, schema_for(fieldnames, defaults), fmt)
+    writer.writeheader()
+    return writer
+
+
+class CsvTableWriter:
+    '''
+    Writes row tuples (in fieldnames order) into a csv file.
+    '''
+    def __init__(self, path, fieldnames):
+        self.fieldnames = fieldnames
+        self.f = open(path, 'w', newline='')
+        self.writer = csv.writer(self.f)
+
+    def writeheader(self):
+        self.writer.writerow(self.fieldnames)
+
+    def writerow(self, row):
+        self.writer.writerow(row)
+
+    def writerows(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _import_pyarrow(fmt):
+    global pyarrow
+    if pyarrow is not None:
+        return
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError(f'The {fmt} output format requires pyarrow (pip install pyarrow)')
+
+
+class ArrowTableWriter:
+    '''
+    Writes rows into a parquet or arrow ipc file. Rows are
+    buffered column by column and flushed as one row group
+    every ROW_GROUP_SIZE rows, so memory stays bounded while
+    streaming through the API pages.
+    '''
+    def __init__(self, path, schema, fmt='parquet', row_group_size=ROW_GROUP_SIZE):
+        _import_pyarrow(fmt)
+
+        self.fieldnames = [n for (n, t) in schema]
+        self.converters = [_CONVERTERS[t] for (n, t) in schema]
+        self.schema = pyarrow.schema([(n, _ARROW_TYPES[t]()) for (n, t) in schema])
+        self.row_group_size = row_group_size
+        self.columns = [[] for _ in schema]
+        self.rows = 0
+
+        if fmt == 'parquet':
+            self.writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression='zstd')
+        else:
+            self.sink = pyarrow.OSFile(path, 'wb')
+            self.writer = pyarrow.ipc.new_file(self.sink, self.schema)
+
+    def writeheader(self):
+        # the schema is the header
+        pass
+
+    def writerow(self, row):
+        self.writerows((row,))
+
+    def writerows(self, rows):
+        rows = list(rows)
+        while rows:
+            batch = rows[:self.row_group_size - self.rows]
+            rows = rows[len(batch):]
+            for (col, values, convert) in zip(self.columns, zip(*batch), self.converters):
+                col.extend(map(convert, values))
+            self.rows += len(batch)
+            if self.rows >= self.row_group_size:
+                self.flush()
+
+    def flush(self):
+        if self.rows == 0:
+            return
+        table = pyarrow.Table.from_arrays(
+            [pyarrow.array(c, type=f.type) for (c, f) in zip(self.columns, self.schema)],
+            schema=self.schema
+        )
+        self.writer.write_table(table)
+        self.columns = [[] for _ in self.fieldnames]
+        self.rows = 0
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        if getattr(self, 'sink', None) is not None:
+            self.sink.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _to_bool(v):
+    if v is None or v == '':
+        return None
+    if isinstance(v, str):
+        return v.lower() == 'true'
+    return bool(v)
+
+
+def _to_int(v):
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_timestamp(v):
+    if not v:
+        return None
+    if isinstance(v, (int, float)):
+        return datetime.datetime.fromtimestamp(v, datetime.timezone.utc)
+    try:
+        return datetime.datetime.fromisoformat(v.replace('Z', '+00:00'))
+    except (AttributeError, ValueError):
+        return None
+
+
+def _to_string(v):
+    if v is None:
+        return None
+    return str(v)
+
+
+_CONVERTERS = {
+    'bool': _to_bool,
+    'int': _to_int,
+    'timestamp': _to_timestamp,
+    'string': _to_string
+}
+
+_ARROW_TYPES = {
+    'bool': lambda: pyarrow.bool_(),
+    'int': lambda: pyarrow.int64(),
+    'timestamp': lambda: pyarrow.timestamp('us', tz='UTC'),
+    'string': lambda: pyarrow.string()
+}
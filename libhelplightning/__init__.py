@@ -1 +1,38 @@
+from .Archiver import Archiver
+from .DownloadQueue import DownloadQueue
 from .GaldrClient import GaldrClient
+from .JsonDecoder import JsonDecoder
+from .PageSizeTuner import PageSizeTuner
+from .RateLimiter import RateLimiter
+from .ReportWaiter import ReportWaiter, ReportBatch, ReportFailed, ReportTimeout
+from . import Downloader
+from . import Logging
+from . import Resources
+from . import Sites
+from . import TableWriter
+
+# Only some scripts use these, and their dependencies (cProfile,
+#  sqlite3, zipfile, http.server) are slow to import, so they
+#  are imported on first use.
+_LAZY = {
+    'BlobStore': 'BlobStore',
+    'CallStore': 'CallStore',
+    'ChangeTracker': 'ChangeTracker',
+    'Profiler': 'Profiler',
+    'ReportReader': 'ReportReader',
+    'ResponseCache': 'ResponseCache'
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    import importlib
+    module = importlib.import_module(f'.{_LAZY[name]}', __name__)
+    # importing the submodule binds its name here, so rebind it to the class
+    globals()[name] = getattr(module, name)
+    return globals()[name]
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY))
@@ -0,0 +1,709 @@
+#!/usr/bin/env python3
+#
+# A local stand-in for the Help Lightning API, for
+#  benchmarking and testing the sample scripts offline.
+#  The dataset is synthetic and generated on the fly from
+#  the record index, so it can be made very large without
+#  using much memory.
+
+import argparse
+import base64
+import datetime
+import hashlib
+import hmac
+import http.server
+import io
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+import zipfile
+
+PORT = 8090
+
+# All timestamps in the dataset are after this date
+EPOCH = int(datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc).timestamp())
+
+# Secret used to sign the blob and report urls
+URL_SECRET = b'mock-server'
+
+
+def iso(ts):
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+class Dataset:
+    '''
+    Synthetic users, pods, calls and attachments. Records are
+    computed from their index, and timestamps grow with the
+    index, so time range filters map to index ranges.
+    '''
+    def __init__(self, users=1000, pods=50, calls=10000, enterprise_id=8888,
+                 attachment_every=7, attachments_per_call=2, attachment_size=256 * 1024,
+                 call_spacing=60, user_spacing=3600):
+        self.users = users
+        self.pods = pods
+        self.calls = calls
+        self.enterprise_id = enterprise_id
+        self.attachment_every = attachment_every
+        self.attachments_per_call = attachments_per_call
+        self.attachment_size = attachment_size
+        self.call_spacing = call_spacing
+        self.user_spacing = user_spacing
+
+    ###########################
+    # START Users and Pods
+    ###########################
+    def user(self, i):
+        created = EPOCH + i * self.user_spacing
+        return {
+            'id': i + 1,
+            'active': i % 10 != 0,
+            'available': i % 3 == 0,
+            'confirmation_sent_at': iso(created),
+            'confirmed_at': iso(created + 60),
+            'created_at': iso(created),
+            'email': f'user{i + 1}@example.com',
+            'email_confirmed': True,
+            'enterprise_id': self.enterprise_id,
+            'first_call_at': iso(created + 3600),
+            'invitation_sent_at': iso(created),
+            'is_confirmed': True,
+            'is_first_login': False,
+            'last_used_at': iso(created + 7200),
+            'license': 'professional',
+            'location': 'Birmingham, AL',
+            'manage': i % 20 == 0,
+            'name': f'User {i + 1}',
+            'provider': 'helplightning',
+            'provider_uid': None,
+            'role_id': 1 + i % 3,
+            'role_name': ['User', 'Admin', 'Owner'][i % 3],
+            'status': 'active',
+            'status_message': '',
+            'title': 'Technician',
+            'unavailable_expires_at': None,
+            'updated_at': iso(created + 60),
+            'username': f'user{i + 1}'
+        }
+
+    def user_updated_at(self, i):
+        return EPOCH + i * self.user_spacing + 60
+
+    def pod(self, i):
+        return {
+            'id': i + 1,
+            'admin_count': 1,
+            'default': i == 0,
+            'description': f'Group {i + 1}',
+            'email': f'group{i + 1}@example.com',
+            'expert': i % 2 == 0,
+            'manage': False,
+            'name': f'Group {i + 1}',
+            'user_count': len(range(i, self.users, self.pods)),
+            'updated_at': iso(EPOCH + i * self.user_spacing)
+        }
+
+    def pod_updated_at(self, i):
+        return EPOCH + i * self.user_spacing
+
+    def pod_detail(self, pod_id):
+        i = pod_id - 1
+        detail = self.pod(i)
+        members = range(i, self.users, self.pods)
+        detail['users'] = [{'id': u + 1, 'name': f'User {u + 1}'} for u in members]
+        detail['admins'] = [{'id': u + 1, 'name': f'User {u + 1}'} for u in members[:1]]
+        detail['subpods'] = [{'id': (i + 1) % self.pods + 1}] if self.pods > 1 else []
+        detail['on_call_pods'] = [{'id': (i + 2) % self.pods + 1}] if self.pods > 2 else []
+        return detail
+
+    def pod_users(self, pod_id):
+        return [self.user(u) for u in range(pod_id - 1, self.users, self.pods)]
+    ###########################
+    # END Users and Pods
+    ###########################
+
+    ###########################
+    # START Calls and Attachments
+    ###########################
+    def session(self, i):
+        return str(uuid.UUID(int=(self.enterprise_id << 64) + i))
+
+    def call_index(self, session):
+        return uuid.UUID(session).int - (self.enterprise_id << 64)
+
+    def call_started(self, i):
+        return EPOCH + i * self.call_spacing
+
+    def call(self, i):
+        dialer = i % self.users + 1
+        receiver = (i * 7 + 1) % self.users + 1
+        started = self.call_started(i)
+        duration = 30 + i % 1800
+        c = {
+            'session': self.session(i),
+            'has_attachments': self.has_attachments(i),
+            'callDuration': duration,
+            'dialerId': str(dialer),
+            'dialerName': f'User {dialer}',
+            'intraEnterpriseCall': i % 5 != 0,
+            'reasonCallEnded': 'hangup',
+            'receiverId': str(receiver),
+            'receiverName': f'User {receiver}',
+            'timestamp': iso(started),
+            'timeCallStarted': started,
+            'timeCallEnded': started + duration,
+            'participants': [
+                {'id': dialer, 'name': f'User {dialer}', 'isAnonymous': False, 'enterpriseId': f'{self.enterprise_id}'},
+                {'id': receiver, 'name': f'User {receiver}', 'isAnonymous': i % 11 == 0,
+                 'enterpriseId': f'{self.enterprise_id}' if i % 5 != 0 else '1'}
+            ]
+        }
+        if i % 2 == 0:
+            c['recordingStatus'] = 'complete' if c['has_attachments'] else 'none'
+        return c
+
+    def has_attachments(self, i):
+        return self.attachment_every > 0 and i % self.attachment_every == 0
+
+    def attachments(self, i, base_url):
+        if not self.has_attachments(i):
+            return []
+        results = []
+        for j in range(self.attachments_per_call):
+            attachment_id = i * 10 + j + 1
+            name = 'recording.mp4' if j == 0 else f'capture_{j}.png'
+            results.append({
+                'id': attachment_id,
+                'name': name,
+                'content_type': 'video/mp4' if j == 0 else 'image/png',
+                'size': self.attachment_size_of(attachment_id),
+                'signed_url': sign_url(f'{base_url}/blobs/{attachment_id}/{name}')
+            })
+        return results
+
+    def attachment_size_of(self, attachment_id):
+        # recordings are large, screen captures are small
+        if attachment_id % 10 == 1:
+            return self.attachment_size
+        return max(self.attachment_size // 64, 1)
+
+    def blob(self, attachment_id, start, end):
+        """
+        The bytes [start, end) of an attachment, without
+        building the whole blob in memory.
+        """
+        pattern = hashlib.sha256(str(attachment_id).encode('utf-8')).digest() * 128
+        out = bytearray()
+        pos = start
+        while pos < end:
+            offset = pos % len(pattern)
+            n = min(len(pattern) - offset, end - pos)
+            out += pattern[offset:offset + n]
+            pos += n
+        return bytes(out)
+    ###########################
+    # END Calls and Attachments
+    ###########################
+
+
+def sign_url(url, expires_in=3600):
+    expires = int(time.time()) + expires_in
+    sep = '&' if '?' in url else '?'
+    unsigned = f'{url}{sep}expires={expires}'
+    signature = hmac.new(URL_SECRET, urllib.parse.urlsplit(unsigned).path.encode('utf-8') + str(expires).encode('utf-8'), hashlib.sha256).hexdigest()
+    return f'{unsigned}&signature={signature}'
+
+
+def verify_url(path, query):
+    try:
+        expires = int(query['expires'][0])
+        signature = query['signature'][0]
+    except (KeyError, ValueError):
+        return False
+    expected = hmac.new(URL_SECRET, path.encode('utf-8') + str(expires).encode('utf-8'), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature) and expires >= time.time()
+
+
+def token_expired(token):
+    """
+    Whether a JWT's exp claim has passed. The signature isn't
+    checked, and tokens that aren't JWTs never expire.
+    """
+    try:
+        payload = token.split('.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        return claims['exp'] < time.time()
+    except (IndexError, KeyError, TypeError, ValueError):
+        return False
+
+
+class Throttle:
+    '''
+    A token bucket allowing `rate` requests per second. A rate
+    of 0 turns throttling off.
+    '''
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def allow(self):
+        if not self.rate:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class MockServer(http.server.ThreadingHTTPServer):
+    '''
+    latency is added to every API response, plus latency_per_entry
+    for every record in a page. error_rate is the fraction of API
+    requests that fail with a 500, and throttle the number of
+    requests per second allowed before answering with 429.
+    '''
+    daemon_threads = True
+
+    def __init__(self, host, port, dataset, latency=0.0, latency_per_entry=0.0, error_rate=0.0,
+                 throttle=0, max_page_size=1000, report_delay=5.0, report_rows=None, handler=None):
+        super().__init__((host, port), handler or MockHandler)
+        self.dataset = dataset
+        self.latency = latency
+        self.latency_per_entry = latency_per_entry
+        self.error_rate = error_rate
+        self.throttle = Throttle(throttle)
+        self.max_page_size = max_page_size
+        self.report_delay = report_delay
+        self.report_rows = report_rows
+        self.reports = {}
+        self.report_zips = {}
+
+        self.stats_lock = threading.Lock()
+        self.stats = {'requests': 0, 'bytes': 0, 'errors': 0, 'throttled': 0, 'not_modified': 0, 'routes': {}}
+
+    @property
+    def base_url(self):
+        (host, port) = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def api_url(self):
+        return self.base_url + '/api'
+
+    def start(self):
+        """
+        Serves requests from a background thread.
+        """
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def count(self, route, nbytes, status):
+        with self.stats_lock:
+            self.stats['requests'] += 1
+            self.stats['bytes'] += nbytes
+            if status == 429:
+                self.stats['throttled'] += 1
+            elif status == 304:
+                self.stats['not_modified'] += 1
+            elif status >= 500:
+                self.stats['errors'] += 1
+            self.stats['routes'][route] = self.stats['routes'].get(route, 0) + 1
+
+    def snapshot(self):
+        with self.stats_lock:
+            return json.loads(json.dumps(self.stats))
+
+    ###########################
+    # START Reports
+    ###########################
+    def create_report(self, kind):
+        report_uuid = str(uuid.uuid4())
+        self.reports[report_uuid] = {
+            'kind': kind,
+            'ready_at': time.monotonic() + self.report_delay
+        }
+        return report_uuid
+
+    def report_zip(self, report_uuid):
+        if report_uuid not in self.report_zips:
+            kind = self.reports[report_uuid]['kind']
+            rows = self.dataset.calls if self.report_rows is None else self.report_rows
+            buf = io.BytesIO()
+            with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as z:
+                calls = (self.dataset.call(i) for i in range(rows))
+                if kind == 'csv':
+                    fields = [k for k in self.dataset.call(0) if k != 'participants']
+                    lines = [','.join(fields)]
+                    lines.extend(','.join(str(c.get(k, '')) for k in fields) for c in calls)
+                    z.writestr('calls.csv', '\n'.join(lines) + '\n')
+                else:
+                    z.writestr('calls.json', json.dumps(list(calls)))
+            self.report_zips[report_uuid] = buf.getvalue()
+        return self.report_zips[report_uuid]
+    ###########################
+    # END Reports
+    ###########################
+
+
+class MockHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    ROUTES = [
+        ('GET', r'/api/v1r1/enterprise/users', 'users'),
+        ('GET', r'/api/v1r1/enterprise/pods', 'pods'),
+        ('GET', r'/api/v1r1/enterprise/pods/(\d+)', 'pod'),
+        ('GET', r'/api/v1/enterprise/pods/(\d+)/users', 'pod_users'),
+        ('GET', r'/api/v1/enterprise/calls', 'calls'),
+        ('GET', r'/api/v1/enterprise/calls/range', 'calls_range'),
+        ('GET', r'/api/v1r1/enterprise/calls/([0-9a-f-]+)', 'call'),
+        ('GET', r'/api/v1r1/enterprise/calls/([0-9a-f-]+)/attachments', 'attachments'),
+        ('POST', r'/api/v1r1/enterprise/reports/calls(\.json)?', 'create_report'),
+        ('GET', r'/api/v1r1/enterprise/reports/calls/([0-9a-f-]+)', 'report_status'),
+        ('POST', r'/api/v1/auth/refresh', 'auth'),
+        ('POST', r'/api/v1r1/auth', 'auth'),
+        ('GET', r'/blobs/(\d+)/([^/]+)', 'blob'),
+        ('GET', r'/reports/([0-9a-f-]+)\.zip', 'report_download'),
+        ('GET', r'/_stats', 'stats')
+    ]
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def dispatch(self, method):
+        url = urllib.parse.urlsplit(self.path)
+        self.query = urllib.parse.parse_qs(url.query)
+        if method == 'POST':
+            length = int(self.headers.get('Content-Length') or 0)
+            self.body = self.rfile.read(length)
+
+        for (m, pattern, name) in self.ROUTES:
+            match = re.fullmatch(pattern, url.path)
+            if m == method and match:
+                self.route = name
+                if url.path.startswith('/api/'):
+                    if not self.api_checks():
+                        return
+                getattr(self, 'route_' + name)(*match.groups())
+                return
+
+        self.route = 'not_found'
+        self.send_json({'error': 'not found'}, 404)
+
+    def api_checks(self):
+        """
+        Authentication, throttling and injected errors
+        for the API endpoints.
+        """
+        if not self.server.throttle.allow():
+            self.send_json({'error': 'too many requests'}, 429, {'Retry-After': '1'})
+            return False
+        if 'x-helplightning-api-key' not in self.headers:
+            self.send_json({'error': 'missing api key'}, 401)
+            return False
+        if self.route != 'auth' and not self.headers.get('Authorization'):
+            self.send_json({'error': 'missing token'}, 401)
+            return False
+        if self.route != 'auth' and token_expired(self.headers['Authorization']):
+            self.send_json({'error': 'token expired'}, 401)
+            return False
+        if self.server.error_rate and random.random() < self.server.error_rate:
+            self.send_json({'error': 'injected error'}, 500)
+            return False
+        return True
+
+    ###########################
+    # START Helpers
+    ###########################
+    def paginate(self, count, make, first=0):
+        """
+        Returns one page of `count` records, where
+        make(i) builds the record with index first + i.
+        """
+        page = int(self.query.get('page', ['1'])[0])
+        page_size = min(int(self.query.get('page_size', ['50'])[0]), self.server.max_page_size)
+        start = (page - 1) * page_size
+        end = min(start + page_size, count)
+        entries = [make(first + i) for i in range(start, end)]
+        self.delay(len(entries))
+        return {
+            'entries': entries,
+            'page': page,
+            'page_size': page_size,
+            'total_entries': count,
+            'total_pages': (count + page_size - 1) // page_size
+        }
+
+    def updated_since(self):
+        """
+        Parses filter=updated_at>ISO8601 into a timestamp.
+        """
+        f = self.query.get('filter', [''])[0]
+        m = re.match(r'updated_at>(.+)', f)
+        if m is None:
+            return None
+        return datetime.datetime.fromisoformat(m.group(1).replace('Z', '+00:00')).timestamp()
+
+    def first_after(self, count, ts, timestamp_of):
+        """
+        Index of the first record (with increasing timestamps)
+        that is newer than ts.
+        """
+        (lo, hi) = (0, count)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if timestamp_of(mid) > ts:
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def delay(self, entries=0):
+        d = self.server.latency + self.server.latency_per_entry * entries
+        if d > 0:
+            time.sleep(d)
+
+    def send_json(self, data, status=200, headers={}):
+        body = json.dumps(data).encode('utf-8')
+        if self.command == 'GET' and status == 200:
+            # let clients revalidate with If-None-Match
+            etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+            headers = dict(headers, ETag=etag)
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                self.server.count(self.route, 0, 304)
+                return
+        self.send_bytes(body, 'application/json', status, headers)
+
+    def send_bytes(self, body, content_type, status=200, headers={}):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for (k, v) in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count(self.route, len(body), status)
+
+    def send_range(self, size, read, content_type):
+        """
+        Sends a blob of `size` bytes, honoring a Range header.
+        read(start, end) returns the bytes [start, end).
+        """
+        m = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if m is None:
+            self.send_bytes(read(0, size), content_type)
+            return
+        start = int(m.group(1))
+        end = int(m.group(2)) + 1 if m.group(2) else size
+        if start >= size:
+            self.send_bytes(b'', content_type, 416, {'Content-Range': f'bytes */{size}'})
+            return
+        end = min(end, size)
+        self.send_bytes(read(start, end), content_type, 206, {'Content-Range': f'bytes {start}-{end - 1}/{size}'})
+
+    def log_message(self, format, *args):
+        # Don't log every request to stderr
+        pass
+    ###########################
+    # END Helpers
+    ###########################
+
+    ###########################
+    # START Routes
+    ###########################
+    def route_users(self):
+        ds = self.server.dataset
+        first = 0
+        since = self.updated_since()
+        if since is not None:
+            first = self.first_after(ds.users, since, ds.user_updated_at)
+        self.send_json(self.paginate(ds.users - first, ds.user, first))
+
+    def route_pods(self):
+        ds = self.server.dataset
+        first = 0
+        since = self.updated_since()
+        if since is not None:
+            first = self.first_after(ds.pods, since, ds.pod_updated_at)
+        self.send_json(self.paginate(ds.pods - first, ds.pod, first))
+
+    def route_pod(self, pod_id):
+        ds = self.server.dataset
+        pod_id = int(pod_id)
+        if not 1 <= pod_id <= ds.pods:
+            self.send_json({'error': 'not found'}, 404)
+            return
+        self.delay(1)
+        self.send_json(ds.pod_detail(pod_id))
+
+    def route_pod_users(self, pod_id):
+        ds = self.server.dataset
+        members = list(range(int(pod_id) - 1, ds.users, ds.pods))
+        since = self.updated_since()
+        if since is not None:
+            members = [u for u in members if ds.user_updated_at(u) > since]
+        self.send_json(self.paginate(len(members), lambda i: ds.user(members[i])))
+
+    def route_calls(self):
+        ds = self.server.dataset
+        self.send_json(self.paginate(ds.calls, ds.call))
+
+    def route_calls_range(self):
+        ds = self.server.dataset
+        from_date = int(self.query.get('from_date', ['0'])[0])
+        first = self.first_after(ds.calls, from_date - 1, ds.call_started)
+        last = ds.calls
+        if 'to_date' in self.query:
+            last = self.first_after(ds.calls, int(self.query['to_date'][0]), ds.call_started)
+        self.send_json(self.paginate(max(last - first, 0), ds.call, first))
+
+    def route_call(self, session):
+        i = self.find_call(session)
+        if i is None:
+            return
+        self.delay(1)
+        self.send_json(self.server.dataset.call(i))
+
+    def route_attachments(self, session):
+        i = self.find_call(session)
+        if i is None:
+            return
+        self.delay(1)
+        self.send_json(self.server.dataset.attachments(i, self.server.base_url))
+
+    def find_call(self, session):
+        """
+        The index of a call, or None (after answering 404)
+        if there is no such call.
+        """
+        ds = self.server.dataset
+        try:
+            i = ds.call_index(session)
+        except ValueError:
+            i = -1
+        if not 0 <= i < ds.calls:
+            self.send_json({'error': 'not found'}, 404)
+            return None
+        return i
+
+    def route_blob(self, attachment_id, name):
+        url = urllib.parse.urlsplit(self.path)
+        if not verify_url(url.path, self.query):
+            self.send_json({'error': 'bad signature'}, 403)
+            return
+        ds = self.server.dataset
+        attachment_id = int(attachment_id)
+        self.send_range(
+            ds.attachment_size_of(attachment_id),
+            lambda start, end: ds.blob(attachment_id, start, end),
+            'application/octet-stream'
+        )
+
+    def route_create_report(self, json_suffix):
+        self.delay()
+        report_uuid = self.server.create_report('json' if json_suffix else 'csv')
+        self.send_json({'uuid': report_uuid, 'status': 'pending'})
+
+    def route_report_status(self, report_uuid):
+        report = self.server.reports.get(report_uuid)
+        if report is None:
+            self.send_json({'error': 'not found'}, 404)
+            return
+        self.delay()
+        if time.monotonic() < report['ready_at']:
+            self.send_json({'uuid': report_uuid, 'status': 'pending'})
+        else:
+            url = sign_url(f'{self.server.base_url}/reports/{report_uuid}.zip')
+            self.send_json({'uuid': report_uuid, 'status': 'complete', 'url': url})
+
+    def route_report_download(self, report_uuid):
+        url = urllib.parse.urlsplit(self.path)
+        if report_uuid not in self.server.reports or not verify_url(url.path, self.query):
+            self.send_json({'error': 'bad signature'}, 403)
+            return
+        data = self.server.report_zip(report_uuid)
+        self.send_range(len(data), lambda start, end: data[start:end], 'application/zip')
+
+    def route_auth(self):
+        self.delay()
+        self.send_json({'token': 'mock-token-' + uuid.uuid4().hex, 'refresh_token': 'mock-refresh-' + uuid.uuid4().hex})
+
+    def route_stats(self):
+        self.send_json(self.server.snapshot())
+    ###########################
+    # END Routes
+    ###########################
+
+
+def add_arguments(parser):
+    """
+    Adds the dataset and server options to an argument parser,
+    so the benchmarks can take the same options.
+    """
+    parser.add_argument('--users', type=int, default=1000, help='Number of users')
+    parser.add_argument('--pods', type=int, default=50, help='Number of pods (groups)')
+    parser.add_argument('--calls', type=int, default=10000, help='Number of calls')
+    parser.add_argument('--attachment-size', type=int, default=256 * 1024, help='Size of a recording in bytes')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every API response')
+    parser.add_argument('--latency-per-entry', type=float, default=0.0, help='Seconds added per record in a page')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of API requests that fail with a 500')
+    parser.add_argument('--throttle', type=float, default=0, help='Requests per second before answering 429 (0 is unlimited)')
+    parser.add_argument('--max-page-size', type=int, default=1000, help='Largest page size the server returns')
+    parser.add_argument('--report-delay', type=float, default=5.0, help='Seconds until a report is ready')
+
+
+def from_arguments(args, host='localhost', port=0):
+    dataset = Dataset(
+        users=args.users,
+        pods=args.pods,
+        calls=args.calls,
+        attachment_size=args.attachment_size
+    )
+    return MockServer(
+        host,
+        port,
+        dataset,
+        latency=args.latency,
+        latency_per_entry=args.latency_per_entry,
+        error_rate=args.error_rate,
+        throttle=args.throttle,
+        max_page_size=args.max_page_size,
+        report_delay=args.report_delay
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=PORT, help='Port to listen on')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    s = from_arguments(args, port=args.port)
+    print(f'Mock Help Lightning API at {s.api_url}')
+    try:
+        s.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        s.server_close()
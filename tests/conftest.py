@@ -0,0 +1,59 @@
+#
+# Fixtures shared by the tests. The tests run against the
+#  mock server, so they need no live site or network access.
+
+import importlib.util
+import logging
+import os
+import sys
+import types
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'mock-server'))
+
+import libhelplightning
+import mock_server
+
+
+@pytest.fixture
+def dataset():
+    return mock_server.Dataset(users=120, pods=6, calls=300, attachment_size=64 * 1024)
+
+
+@pytest.fixture
+def server(dataset):
+    s = mock_server.MockServer('localhost', 0, dataset, report_delay=0.2).start()
+    yield s
+    s.stop()
+
+
+@pytest.fixture
+def client(server):
+    return libhelplightning.GaldrClient(logging.getLogger(), server.api_url, 'test', token='test-token')
+
+
+@pytest.fixture
+def load_script(server, monkeypatch):
+    """
+    Imports one of the scripts (a path under the root) with a
+    siteconfig pointing at the mock server, which accepts any token.
+    """
+    siteconfig = types.ModuleType('siteconfig')
+    siteconfig.API_KEY = 'test'
+    siteconfig.PARTNER_KEY = None
+    siteconfig.SITE_ID = server.dataset.enterprise_id
+    siteconfig.HELPLIGHTNING_ENDPOINT = server.api_url
+    monkeypatch.setitem(sys.modules, 'siteconfig', siteconfig)
+
+    def load(path):
+        name = os.path.splitext(os.path.basename(path))[0].replace('-', '_')
+        spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, path))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        module.generate_token = lambda *args, **kwargs: 'test-token'
+        return module
+
+    return load
@@ -0,0 +1,37 @@
+import concurrent.futures
+import hashlib
+import os
+
+import libhelplightning
+
+
+def put(store, data, key):
+    tmp = store.tmp_path()
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    blob_hash = hashlib.sha256(data).hexdigest()
+    store.put(tmp, blob_hash, key)
+    return blob_hash
+
+
+def test_a_stored_blob_is_never_replaced(tmp_path):
+    store = libhelplightning.BlobStore(str(tmp_path / 'store'))
+    blob_hash = put(store, b'recording', 'a')
+    path = str(tmp_path / 'a.mp4')
+    store.link(blob_hash, path)
+
+    # the same content under another key keeps the blob, and its links
+    assert put(store, b'recording', 'b') == blob_hash
+    assert os.path.samefile(path, store.blob_path(blob_hash))
+    assert (store.stored, store.deduplicated) == (1, 1)
+    assert os.listdir(str(tmp_path / 'store' / 'tmp')) == []
+
+
+def test_concurrent_puts_of_the_same_blob(tmp_path):
+    store = libhelplightning.BlobStore(str(tmp_path / 'store'))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as pool:
+        hashes = set(pool.map(lambda i: put(store, b'capture', f'key{i}'), range(32)))
+    [blob_hash] = hashes
+    assert (store.stored, store.deduplicated) == (1, 31)
+    for i in range(32):
+        assert store.find(f'key{i}') == blob_hash
@@ -0,0 +1,42 @@
+import time
+
+import libhelplightning
+
+
+class FlakyStore:
+    '''
+    A CallStore whose first upsert fails, like a locked database.
+    '''
+    def __init__(self, store):
+        self.store = store
+        self.failures = 1
+
+    def upsert(self, calls):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError('database is locked')
+        return self.store.upsert(calls)
+
+
+def test_a_failed_batch_is_stored_by_the_next_one(load_script, dataset, tmp_path):
+    script = load_script('download-attachments/download-attachments.py')
+    store = libhelplightning.CallStore(str(tmp_path / 'calls.sqlite'), dataset.enterprise_id)
+    ingester = script.CallIngester(FlakyStore(store), interval=0.05)
+    ingester.start()
+    try:
+        for i in range(5):
+            ingester.add(dataset.session(i))
+        deadline = time.monotonic() + 10
+        while store.count() < 5 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert ingester.is_alive()
+        assert store.count() == 5
+
+        # and it keeps ingesting
+        ingester.add(dataset.session(5))
+        while store.count() < 6 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert store.count() == 6
+    finally:
+        ingester.stop()
+        store.close()
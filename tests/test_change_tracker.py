@@ -0,0 +1,45 @@
+import libhelplightning
+
+
+def tracker(tmp_path, full=False):
+    return libhelplightning.ChangeTracker(str(tmp_path / 'index.db'), full=full)
+
+
+def test_only_changed_rows_are_returned(tmp_path):
+    t = tracker(tmp_path)
+    assert t.changes('users', [(1, 'a'), (2, 'b')]) == [(1, 'a'), (2, 'b')]
+    t.commit()
+    assert t.changes('users', [(1, 'a'), (2, 'c'), (3, 'd')]) == [(2, 'c'), (3, 'd')]
+    assert t.counts == {'inserted': 3, 'updated': 1, 'unchanged': 1, 'deleted': 0}
+
+
+def test_rows_missing_from_a_scope_are_deleted(tmp_path):
+    t = tracker(tmp_path)
+    t.changes('pods_users', [('1_1', 1), ('1_2', 1)], scope=1)
+    t.changes('pods_users', [('2_1', 2)], scope=2)
+    t.commit()
+    # only pod 1 is listed again, pod 2 keeps its rows
+    assert t.changes('pods_users', [('1_1', 1)], scope=1) == []
+    assert t.finish() == [('pods_users', '1_2')]
+
+
+def test_full_export_writes_everything_and_deletes_unseen_rows(tmp_path):
+    t = tracker(tmp_path)
+    t.changes('users', [(1, 'a'), (2, 'b')])
+    t.commit()
+    t.close()
+
+    t = tracker(tmp_path, full=True)
+    assert t.changes('users', [(1, 'a')]) == [(1, 'a')]
+    assert t.finish() == [('users', '2')]
+
+
+def test_changes_not_committed_are_rolled_back(tmp_path):
+    t = tracker(tmp_path)
+    t.changes('users', [(1, 'a')])
+    t.commit()
+    t.changes('users', [(1, 'b')])
+    t.close()
+
+    t = tracker(tmp_path)
+    assert t.changes('users', [(1, 'b')]) == [(1, 'b')]
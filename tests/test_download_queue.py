@@ -0,0 +1,72 @@
+import collections
+
+import libhelplightning
+
+Attachment = collections.namedtuple('Attachment', ['size', 'content_type', 'signed_url'])
+
+
+def job(name, size=None, host='a', content_type=None):
+    resolved = Attachment(size, content_type, f'https://{host}/{name}') if size is not None or content_type else None
+    return {'name': name, 'resolved': resolved}
+
+
+def test_priority_then_order():
+    q = libhelplightning.DownloadQueue()
+    for (name, priority) in [('b', 1), ('a', 0), ('c', 1), ('d', 0)]:
+        q.put(job(name, 10), priority)
+    assert [q.take()['name'] for _ in range(4)] == ['a', 'd', 'b', 'c']
+
+
+def test_small_only_workers_skip_large_files():
+    q = libhelplightning.DownloadQueue(small_file_size=100)
+    q.put(job('large', 1000))
+    q.put(job('small', 10))
+    assert q.take(small_only=True)['name'] == 'small'
+    assert q.take(small_only=True) is None
+    assert q.take()['name'] == 'large'
+
+
+def test_unknown_size_is_classed_by_content_type():
+    q = libhelplightning.DownloadQueue()
+    assert q.classify(Attachment(None, 'image/png', 'https://a/x'))[0] == 'small'
+    assert q.classify(Attachment(None, 'video/mp4', 'https://a/x'))[0] == 'large'
+
+
+def test_large_downloads_per_host():
+    q = libhelplightning.DownloadQueue(small_file_size=100, max_large_per_host=1)
+    for (name, host) in [('a1', 'a'), ('a2', 'a'), ('b1', 'b')]:
+        q.put(job(name, 1000, host))
+    first = q.take()
+    assert first['name'] == 'a1'
+    # a is busy, so b goes next, then nothing until a1 is done
+    assert q.take()['name'] == 'b1'
+    assert q.take() is None
+    q.done(first)
+    assert q.take()['name'] == 'a2'
+
+
+def test_requeue_keeps_its_place_and_join_waits_for_done():
+    q = libhelplightning.DownloadQueue(small_file_size=100)
+    unresolved = job('first')
+    q.put(unresolved)
+    q.put(job('second', 10))
+    taken = q.take()
+    assert taken is unresolved
+    # resolving it puts it back ahead of the jobs queued after it
+    taken['resolved'] = Attachment(10, None, 'https://a/first')
+    q.requeue(taken)
+    assert q.qsize() == 2
+    done = [q.take(), q.take()]
+    assert [j['name'] for j in done] == ['first', 'second']
+    assert q.unfinished == 2
+    for j in done:
+        q.done(j)
+    q.join()
+    assert q.get(timeout=.01) is None
+
+
+def test_webhooks_go_ahead_of_backfill():
+    q = libhelplightning.DownloadQueue()
+    q.put(job('backfill', 10), libhelplightning.DownloadQueue.BACKFILL)
+    q.put(job('webhook', 10), libhelplightning.DownloadQueue.WEBHOOK)
+    assert q.take()['name'] == 'webhook'
@@ -0,0 +1,97 @@
+import concurrent.futures
+import gzip
+import hashlib
+import http.server
+import os
+import threading
+
+import libhelplightning
+
+
+def recording(client, dataset):
+    # the first call has attachments, the first of them is the large one
+    return libhelplightning.Resources.Calls(client).attachments(dataset.session(0))[0]
+
+
+def test_download_hashed(client, dataset, tmp_path):
+    a = recording(client, dataset)
+    output = str(tmp_path / 'recording.mp4')
+    digest = libhelplightning.Downloader.download_hashed(a.signed_url, output)
+    expected = dataset.blob(a.id, 0, a.size)
+    assert open(output, 'rb').read() == expected
+    assert digest == hashlib.sha256(expected).hexdigest()
+
+
+def test_resume_only_fetches_the_rest(server, client, dataset, tmp_path):
+    a = recording(client, dataset)
+    output = str(tmp_path / 'recording.mp4')
+    with open(output + '.part', 'wb') as f:
+        f.write(dataset.blob(a.id, 0, 1000))
+
+    before = server.snapshot()['bytes']
+    digest = libhelplightning.Downloader.download_hashed(a.signed_url, output, resume=True)
+    expected = dataset.blob(a.id, 0, a.size)
+    assert open(output, 'rb').read() == expected
+    assert digest == hashlib.sha256(expected).hexdigest()
+    assert server.snapshot()['bytes'] - before == a.size - 1000
+
+
+def test_resume_of_a_complete_part(server, client, dataset, tmp_path):
+    a = recording(client, dataset)
+    output = str(tmp_path / 'recording.mp4')
+    with open(output + '.part', 'wb') as f:
+        f.write(dataset.blob(a.id, 0, a.size))
+
+    before = server.snapshot()['bytes']
+    libhelplightning.Downloader.download(a.signed_url, output, resume=True)
+    assert open(output, 'rb').read() == dataset.blob(a.id, 0, a.size)
+    assert server.snapshot()['bytes'] == before
+
+
+def test_concurrent_downloads_of_the_same_file(client, dataset, tmp_path):
+    a = recording(client, dataset)
+    output = str(tmp_path / 'recording.mp4')
+    # a part left over from a resumable download is left alone
+    with open(output + '.part', 'wb') as f:
+        f.write(b'left over')
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as pool:
+        futures = [
+            pool.submit(libhelplightning.Downloader.download, a.signed_url, output, chunk_size=1024)
+            for _ in range(4)
+        ]
+        for f in futures:
+            f.result()
+    assert open(output, 'rb').read() == dataset.blob(a.id, 0, a.size)
+    assert sorted(os.listdir(tmp_path)) == ['recording.mp4', 'recording.mp4.part']
+    assert open(output + '.part', 'rb').read() == b'left over'
+
+
+class GzipHandler(http.server.BaseHTTPRequestHandler):
+    BODY = b'compressible ' * 10000
+
+    def do_GET(self):
+        data = gzip.compress(self.BODY)
+        self.send_response(200)
+        self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_compressed_download(tmp_path):
+    server = http.server.ThreadingHTTPServer(('localhost', 0), GzipHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        output = str(tmp_path / 'report.zip')
+        progress = []
+        libhelplightning.Downloader.download(f'http://localhost:{server.server_address[1]}/report.zip', output,
+                                             progress=lambda done, total: progress.append(total))
+        assert open(output, 'rb').read() == GzipHandler.BODY
+        assert set(progress) == {None}
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,40 @@
+import csv
+import datetime
+import os
+import time
+
+import libhelplightning
+
+GROUP_ID = 1
+
+
+def export(script, client, start_date, base, tracker):
+    os.makedirs(base)
+    user_ids = script.write_users(client, GROUP_ID, start_date, base, 'csv', tracker)
+    script.write_pods(client, user_ids, start_date, base, 'csv', tracker)
+    tracker.write_deleted(base, 'csv')
+    tracker.commit()
+    tracker.close()
+
+
+def rows(base, table):
+    with open(os.path.join(base, f'{table}.csv'), newline='') as f:
+        return list(csv.reader(f))[1:]
+
+
+def test_incremental_runs_keep_the_memberships_of_unchanged_users(load_script, client, dataset, tmp_path, monkeypatch):
+    script = load_script('export-data-groups/export_data_groups.py')
+    index = str(tmp_path / 'index.db')
+
+    export(script, client, None, str(tmp_path / 'first'), libhelplightning.ChangeTracker(index, full=True))
+    members = rows(str(tmp_path / 'first'), 'pods_users')
+    assert len(members) == len(range(GROUP_ID - 1, dataset.users, dataset.pods))
+
+    # every pod was updated since, but only the newer half of the users
+    monkeypatch.setattr(dataset, 'pod_updated_at', lambda i: time.time())
+    start_date = datetime.datetime.fromtimestamp(dataset.user_updated_at(dataset.users // 2), datetime.timezone.utc)
+
+    second = str(tmp_path / 'second')
+    export(script, client, start_date, second, libhelplightning.ChangeTracker(index))
+    assert rows(second, 'deleted') == []
+    assert rows(second, 'pods_users') == []
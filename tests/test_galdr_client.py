@@ -0,0 +1,39 @@
+import logging
+import time
+
+import mock_server
+import requests
+
+import libhelplightning
+from libhelplightning.GaldrClient import retry_after
+
+
+def response(headers):
+    r = requests.Response()
+    r.headers.update(headers)
+    return r
+
+
+def test_retry_after():
+    assert retry_after(response({})) is None
+    assert retry_after(response({'Retry-After': '3'})) == 3
+    later = time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime(time.time() + 30))
+    assert 25 < retry_after(response({'Retry-After': later})) <= 30
+    assert retry_after(response({'Retry-After': 'soon'})) is None
+
+
+def test_pause_holds_back_every_unit():
+    limiter = libhelplightning.RateLimiter(100)
+    limiter.pause(2)
+    assert limiter.reserve() > 1.9
+
+
+def test_throttled_pages_wait_for_the_server(server):
+    server.throttle = mock_server.Throttle(4)
+    limiter = libhelplightning.RateLimiter(100)
+    client = libhelplightning.GaldrClient(logging.getLogger(), server.api_url, 'test', token='test-token',
+                                          limiter=limiter)
+    users = [u['id'] for page in client.iter_pages('/v1r1/enterprise/users', page_size=20) for u in page]
+    assert users == list(range(1, server.dataset.users + 1))
+    # each 429 holds every request back for the Retry-After second
+    assert server.snapshot()['throttled'] <= 2
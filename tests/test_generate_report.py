@@ -0,0 +1,18 @@
+import json
+
+import pytest
+
+
+def test_batch_goes_on_when_a_report_cant_be_created(load_script, server, tmp_path):
+    script = load_script('generate-report/generate_report.py')
+    batch_file = tmp_path / 'reports.json'
+    batch_file.write_text(json.dumps([
+        {'output': str(tmp_path / 'missing.zip'), 'endpoint': server.base_url + '/nope'},
+        {'output': str(tmp_path / 'calls.zip')}
+    ]))
+
+    with pytest.raises(SystemExit) as e:
+        script.go_batch(str(batch_file), timeout=10)
+    assert e.value.code == '1 of 2 reports failed'
+    assert (tmp_path / 'calls.zip').exists()
+    assert not (tmp_path / 'missing.zip').exists()
@@ -0,0 +1,38 @@
+import json
+import logging
+
+import libhelplightning
+from libhelplightning import Logging
+
+
+def record(msg, *args):
+    return logging.LogRecord('libhelplightning.requests', logging.DEBUG, __file__, 1, msg, args, None)
+
+
+def filtered(count):
+    """
+    Passes `count` records through a filter that lets one through,
+    and returns the last one.
+    """
+    f = Logging.RateLimitFilter(rate=0.001, burst=1)
+    records = [record('GET %s 100%% %sms', '/v1r1/enterprise/users', 12) for _ in range(count)]
+    assert [f.filter(r) for r in records] == [True] + [False] * (count - 1)
+    f.tokens = 1
+    last = record('GET %s 100%% %sms', '/v1r1/enterprise/users', 12)
+    assert f.filter(last)
+    return last
+
+
+def test_dropped_count_is_an_attribute():
+    r = filtered(4)
+    assert r.dropped == 3
+    assert r.getMessage() == 'GET /v1r1/enterprise/users 100% 12ms'
+
+
+def test_formatters_write_the_dropped_count():
+    r = filtered(3)
+    assert Logging.TextFormatter().format(r) == 'GET /v1r1/enterprise/users 100% 12ms (2 similar messages dropped)'
+    entry = json.loads(Logging.JsonFormatter().format(r))
+    assert entry['message'] == 'GET /v1r1/enterprise/users 100% 12ms'
+    assert entry['dropped'] == 2
+    assert Logging.TextFormatter().format(record('no %s', 'drops')) == 'no drops'
@@ -0,0 +1,24 @@
+import mock_server
+import requests
+
+
+def test_pages_are_capped_at_the_maximum(server, client):
+    server.max_page_size = 40
+    r = client.get('/v1r1/enterprise/users', {'page': 2, 'page_size': 100})
+    assert r['page_size'] == 40
+    assert [u['id'] for u in r['entries']] == list(range(41, 81))
+    assert r['total_pages'] == (server.dataset.users + 39) // 40
+
+
+def test_requests_need_a_token(server):
+    r = requests.get(server.api_url + '/v1r1/enterprise/users', headers={'x-helplightning-api-key': 'test'})
+    assert r.status_code == 401
+
+
+def test_throttled_requests_get_429(server):
+    server.throttle = mock_server.Throttle(1)
+    headers = {'x-helplightning-api-key': 'test', 'Authorization': 'test-token'}
+    statuses = [requests.get(server.api_url + '/v1r1/enterprise/users', headers=headers).status_code
+                for _ in range(5)]
+    assert 429 in statuses
+    assert server.snapshot()['throttled'] == statuses.count(429)
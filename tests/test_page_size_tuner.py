@@ -0,0 +1,63 @@
+import libhelplightning
+from libhelplightning import Resources
+
+
+def test_grows_one_step_on_whole_pages():
+    tuner = libhelplightning.PageSizeTuner(target_latency=1.0)
+    # fast pages ask for the largest size, but it only grows one step,
+    #  and only at an offset that is a whole number of bigger pages
+    assert tuner.observe('/x', 50, 50, 0.01, 1000, 50) == 50
+    assert tuner.observe('/x', 50, 100, 0.01, 1000, 50) == 100
+    assert tuner.observe('/x', 100, 200, 0.01, 1000, 100) == 200
+
+
+def test_shrinks_when_slow():
+    tuner = libhelplightning.PageSizeTuner(target_latency=1.0)
+    assert tuner.observe('/x', 400, 400, 10.0, 1000, 400) == 200
+
+
+def test_the_maximum_is_the_top_size():
+    assert libhelplightning.PageSizeTuner().ladder == [50, 100, 200, 400, 800, 1000]
+    assert libhelplightning.PageSizeTuner(max_page_size=800).ladder[-1] == 800
+    assert libhelplightning.PageSizeTuner(max_page_size=1010).ladder[-1] == 1000
+
+
+def test_smaller_pages_fit_the_offset():
+    tuner = libhelplightning.PageSizeTuner(target_latency=1.0)
+    # 3000 records in, a page of 800 would start at 2400
+    assert tuner.observe('/x', 1000, 3000, 10.0, 1000, 1000) == 200
+    assert tuner.reject('/y', 1000, 3000) == 200
+    assert tuner.initial('/y') == 800
+
+
+def test_reject_and_cap_limit_the_endpoint():
+    tuner = libhelplightning.PageSizeTuner()
+    assert tuner.reject('/x', 1000) == 800
+    assert tuner.cap('/y', 120) == 100
+    assert tuner.initial('/y') == 100
+    assert tuner.reject('/z', tuner.ladder[0]) is None
+
+
+def test_state_is_saved(tmp_path):
+    state = str(tmp_path / 'page_sizes.json')
+    tuner = libhelplightning.PageSizeTuner(state_file=state)
+    tuner.cap('/y', 120)
+    tuner.save()
+    assert libhelplightning.PageSizeTuner(state_file=state).initial('/y') == 100
+
+
+def test_auto_pages_follow_the_server_maximum(server, client):
+    server.max_page_size = 100
+    client.page_size = 'auto'
+    users = [u.id for page in Resources.Users(client).list().pages() for u in page]
+    assert users == list(range(1, server.dataset.users + 1))
+    assert client.page_size_tuner.initial('/v1r1/enterprise/users') == 100
+
+
+def test_auto_pages_below_the_smallest_size(server, client):
+    # 35 a page, fewer than the tuner ever asks for
+    server.max_page_size = 35
+    client.page_size = 'auto'
+    users = [u.id for page in Resources.Users(client).list().pages() for u in page]
+    assert users == list(range(1, server.dataset.users + 1))
+    assert server.snapshot()['routes']['users'] <= 5
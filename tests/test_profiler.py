@@ -0,0 +1,30 @@
+import socket
+import threading
+import time
+
+import libhelplightning
+
+
+def test_lock_waits_are_not_io():
+    profiler = libhelplightning.Profiler(True, sample_interval=0.001)
+    event = threading.Event()
+    (a, b) = socket.socketpair()
+    threads = [
+        threading.Thread(target=event.wait),
+        threading.Thread(target=a.makefile('rb').read, args=(1,))
+    ]
+    profiler.start()
+    for t in threads:
+        t.start()
+    time.sleep(0.2)
+    event.set()
+    b.send(b'x')
+    for t in threads:
+        t.join()
+    profiler.stop()
+    a.close()
+    b.close()
+
+    assert profiler.io_samples > 0
+    assert profiler.lock_samples > 0
+    assert 'waiting on locks or idle' in profiler.summary()
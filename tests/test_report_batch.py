@@ -0,0 +1,57 @@
+import requests
+
+import libhelplightning
+
+
+def test_every_report_completes(client):
+    reports = libhelplightning.Resources.Reports(client)
+    batch = libhelplightning.ReportBatch(initial_interval=0.05, timeout=10)
+    uuids = [reports.create().uuid for _ in range(3)]
+    for u in uuids:
+        batch.add(client, u, context=u)
+
+    done = {}
+    batch.run(lambda context, url: done.setdefault(context, url))
+    assert sorted(done) == sorted(uuids)
+    assert all(u in url for (u, url) in done.items())
+
+
+def test_timed_out_reports_go_to_on_failed(client):
+    reports = libhelplightning.Resources.Reports(client)
+    batch = libhelplightning.ReportBatch(initial_interval=0.05, timeout=0.05)
+    batch.add(client, reports.create().uuid, context='slow')
+
+    failed = []
+    batch.run(lambda context, url: None, on_failed=lambda context, e: failed.append((context, type(e))))
+    assert failed == [('slow', libhelplightning.ReportTimeout)]
+
+
+class FlakyClient:
+    '''
+    A client whose first `failures` requests fail to connect.
+    '''
+    def __init__(self, client, failures):
+        self.client = client
+        self.failures = failures
+
+    def get(self, *args, **kwargs):
+        if self.failures:
+            self.failures -= 1
+            raise requests.exceptions.ConnectionError('connection reset')
+        return self.client.get(*args, **kwargs)
+
+
+def test_request_errors_only_fail_their_own_report(client):
+    reports = libhelplightning.Resources.Reports(client)
+    batch = libhelplightning.ReportBatch(initial_interval=0.05, timeout=10)
+    batch.add(client, '00000000-0000-0000-0000-000000000000', context='missing')
+    batch.add(FlakyClient(client, 2), reports.create().uuid, context='flaky')
+    batch.add(client, reports.create().uuid, context='ok')
+
+    done = []
+    failed = []
+    batch.run(lambda context, url: done.append(context), on_failed=lambda context, e: failed.append((context, e)))
+    assert sorted(done) == ['flaky', 'ok']
+    [(context, e)] = failed
+    assert context == 'missing'
+    assert e.response.status_code == 404
@@ -0,0 +1,43 @@
+import json
+import sys
+import zipfile
+
+import pytest
+
+import libhelplightning
+
+
+def report(tmp_path, name, text):
+    path = str(tmp_path / 'report.zip')
+    with zipfile.ZipFile(path, 'w') as z:
+        z.writestr(name, text)
+    return path
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    # so elements and numbers are split across reads
+    module = sys.modules[libhelplightning.ReportReader.__module__]
+    monkeypatch.setattr(module, 'CHUNK_SIZE', 3)
+
+
+def test_json_array_rows(tmp_path, small_chunks):
+    rows = [{'id': i, 'name': f'call, "{i}" ]', 'n': [i, 1.5e3]} for i in range(50)]
+    path = report(tmp_path, 'calls.json', ' \n' + json.dumps(rows, indent=1))
+    assert list(libhelplightning.ReportReader(path)) == rows
+
+
+def test_json_object_rows(tmp_path, small_chunks):
+    path = report(tmp_path, 'calls.json', json.dumps({'entries': [1, 22, 333]}))
+    assert list(libhelplightning.ReportReader(path)) == [1, 22, 333]
+
+
+@pytest.mark.parametrize('text', ['[1,]', '[1 2]', '[1, 2'])
+def test_broken_json(tmp_path, small_chunks, text):
+    with pytest.raises(ValueError):
+        list(libhelplightning.ReportReader(report(tmp_path, 'calls.json', text)))
+
+
+def test_csv_rows(tmp_path):
+    path = report(tmp_path, 'calls.csv', 'id,name\n1,a\n2,"b\nc"\n')
+    assert list(libhelplightning.ReportReader(path)) == [{'id': '1', 'name': 'a'}, {'id': '2', 'name': 'b\nc'}]
@@ -0,0 +1,27 @@
+import datetime
+
+from libhelplightning import Resources
+
+
+def test_call_shards_cover_every_call():
+    shards = Resources.call_shards(None, 4)
+    assert len(shards) == 4
+    assert shards[0]['from_date'] == 0
+    assert 'to_date' not in shards[-1]
+    for (a, b) in zip(shards, shards[1:]):
+        assert a['to_date'] == b['from_date']
+
+
+def test_each_page_passes_every_call_once(client, dataset):
+    for shards in (1, 3):
+        ids = []
+        Resources.Calls(client).each_page(lambda page: ids.extend(c.id for c in page), shards=shards)
+        assert sorted(ids) == sorted(dataset.session(i) for i in range(dataset.calls))
+
+
+def test_each_page_since(client, dataset):
+    since = datetime.datetime.fromtimestamp(dataset.call_started(dataset.calls - 10), datetime.timezone.utc)
+    for shards in (1, 3):
+        ids = []
+        Resources.Calls(client).each_page(lambda page: ids.extend(c.id for c in page), since, shards)
+        assert sorted(ids) == sorted(dataset.session(i) for i in range(dataset.calls - 10, dataset.calls))
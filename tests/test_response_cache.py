@@ -0,0 +1,40 @@
+import logging
+
+import libhelplightning
+from libhelplightning import Resources
+
+
+def cached_client(server, tmp_path, tuner=None, **kwargs):
+    cache = libhelplightning.ResponseCache(str(tmp_path / 'cache'), **kwargs)
+    client = libhelplightning.GaldrClient(logging.getLogger(), server.api_url, 'test', token='test-token', cache=cache,
+                                          page_size_tuner=tuner)
+    return (client, cache)
+
+
+def test_only_users_and_pods_are_cached(server, tmp_path):
+    (client, cache) = cached_client(server, tmp_path)
+    for _ in range(2):
+        list(Resources.Users(client).list())
+        list(Resources.Calls(client).list())
+    # the 3 pages of users, none of the calls
+    assert cache.revalidated == 3
+    assert server.snapshot()['not_modified'] == 3
+    assert cache.caches('/v1r1/enterprise/pods/3')
+    assert not cache.caches('/v1/enterprise/calls?page=1&page_size=50')
+
+
+def test_cache_hits_are_not_tuned_on(server, tmp_path):
+    tuner = libhelplightning.PageSizeTuner(min_page_size=10, max_page_size=20)
+    (client, cache) = cached_client(server, tmp_path, tuner, default_ttl=60)
+    client.page_size = 'auto'
+
+    observed = []
+    observe = tuner.observe
+    tuner.observe = lambda *args: observed.append(args) or observe(*args)
+
+    list(Resources.Users(client).list())
+    first = len(observed)
+    assert first > 0
+    list(Resources.Users(client).list())
+    assert cache.hits > 0
+    assert len(observed) == first
@@ -0,0 +1,30 @@
+import os
+
+import libhelplightning
+from libhelplightning.Sites import Site
+
+
+def site(name, endpoint='https://api.helplightning.net/api'):
+    return Site(name, 1, None, endpoint, 'key', {})
+
+
+def test_export_sites_share_sessions_and_fail_alone(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    sites = [site('a'), site('b'), site('eu', 'https://api.eu1.helplightning.net/api'), site('bad')]
+    calls = {}
+
+    def export(site, **options):
+        if site.name == 'bad':
+            raise RuntimeError('boom')
+        calls[site.name] = options
+
+    failed = libhelplightning.Sites.export_sites(sites, export, parallel=2, max_rps=10, cache_dir='cache',
+                                                 threads=1)
+    assert list(failed) == ['bad']
+    assert sorted(calls) == ['a', 'b', 'eu']
+    assert calls['a']['session'] is calls['b']['session']
+    assert calls['a']['session'] is not calls['eu']['session']
+    assert calls['a']['limiter'] is calls['eu']['limiter']
+    # relative paths are in the directory of each site
+    assert calls['a']['cache_dir'] == os.path.join('a', 'cache')
+    assert os.path.isdir(tmp_path / 'eu')